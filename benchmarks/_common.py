@@ -0,0 +1,48 @@
+"""Helpers shared by the benchmark scripts."""
+from __future__ import annotations
+
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from portkeeper.core import PortRegistry  # noqa: E402
+from portkeeper.storage import open_backend  # noqa: E402
+
+HOST = '127.0.0.1'
+BACKENDS = ('json', 'journal', 'sqlite', 'sharded', 'bitmap')
+
+
+def percentiles(samples: Sequence[float], scale: float = 1000.0) -> Dict[str, float]:
+    """p50/p95/max of ``samples`` (seconds), scaled to milliseconds by default."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'p50_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale  # noqa: E731
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'max_ms': ordered[-1] * scale}
+
+
+def make_registry(tmp: str, backend: str, entries: int = 0, first_port: int = 10000) -> PortRegistry:
+    """A registry in ``tmp`` using ``backend``, pre-filled with ``entries`` reservations from ``first_port`` up."""
+    path = os.path.join(tmp, f'registry.{backend}')
+    registry = PortRegistry(backend=open_backend(backend, path, os.path.join(tmp, 'registry.lock')), daemon=False)
+    if entries:
+        registry.backend.update(lambda txn: [
+            txn.put(f'{HOST}:{port}', {'host': HOST, 'port': port, 'owner': 'seed', 'timestamp': 0.0})
+            for port in range(first_port, first_port + entries)])
+    return registry
+
+
+def print_table(rows: List[Dict], columns: Sequence[str]) -> None:
+    widths = [max(len(c), *(len(_fmt(r.get(c))) for r in rows)) for c in columns]
+    print('  '.join(c.rjust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(_fmt(row.get(c)).rjust(w) for c, w in zip(columns, widths)))
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f'{value:.3f}' if value < 100 else f'{value:.0f}'
+    return '' if value is None else str(value)
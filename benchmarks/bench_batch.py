@@ -0,0 +1,58 @@
+"""How ``reserve(count=N)`` scales with N.
+
+Each batch is picked against one registry snapshot and committed in a single
+write, so the cost per port should fall as N grows.
+
+    python benchmarks/bench_batch.py --counts 1 10 100 1000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+from _common import make_registry, percentiles, print_table
+
+PORT_RANGE = (10000, 65535)
+
+
+def run(backend: str, count: int, repeats: int) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = make_registry(tmp, backend)
+        samples = []
+        for _ in range(repeats):
+            began = time.perf_counter()
+            result = registry.reserve(port_range=PORT_RANGE, count=count)
+            samples.append(time.perf_counter() - began)
+            keys = [f"{r.host}:{r.port}" for r in (result if isinstance(result, list) else [result])]
+            registry.backend.update(lambda txn, keys=keys: [txn.delete(key) for key in keys])
+        registry.backend.close()
+    stats = percentiles(samples)
+    return {'backend': backend, 'count': count, 'repeats': repeats, 'call_p50_ms': stats['p50_ms'],
+            'call_p95_ms': stats['p95_ms'], 'per_port_ms': stats['p50_ms'] / count}
+
+
+def run_all(backends: Sequence[str] = ('json', 'bitmap'), counts: Sequence[int] = (1, 10, 100),
+            repeats: int = 10) -> List[Dict]:
+    return [run(backend, count, repeats) for backend in backends for count in counts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=['json', 'bitmap'])
+    parser.add_argument('--counts', nargs='+', type=int, default=[1, 10, 100, 1000],
+                        help='Batch sizes (default: 1 10 100 1000)')
+    parser.add_argument('--repeats', type=int, default=10, help='Calls per batch size (default: 10)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    results = run_all(args.backends, args.counts, args.repeats)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print_table(results, ('backend', 'count', 'call_p50_ms', 'call_p95_ms', 'per_port_ms'))
+
+
+if __name__ == '__main__':
+    main()
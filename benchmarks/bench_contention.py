@@ -0,0 +1,82 @@
+"""Reservation throughput of the JSON registry with many concurrent processes.
+
+Runs ``--processes`` workers that each reserve and release ``--ops`` ports
+against one registry, first with optimistic commits (the default), then with
+every update serialized behind the exclusive lock, and reports operations per
+second and optimistic conflicts for both.
+
+    python benchmarks/bench_contention.py --processes 32 --ops 50
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from portkeeper.core import PortRegistry  # noqa: E402
+from portkeeper.storage import DEFAULT_OPTIMISTIC_RETRIES, JsonBackend  # noqa: E402
+
+
+def _worker(registry_file, lock_file, retries, ops, port_range, strategy, start, results):
+    backend = JsonBackend(registry_file, lock_file, retries=retries)
+    registry = PortRegistry(backend=backend, daemon=False, strategy=strategy)
+    start.wait()
+    for _ in range(ops):
+        registry.release(registry.reserve(port_range=port_range))
+    results.put(backend.conflicts)
+
+
+def run(mode: str, processes: int, ops: int, port_range, strategy: str = 'first-fit') -> dict:
+    retries = DEFAULT_OPTIMISTIC_RETRIES if mode == 'optimistic' else 0
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        registry_file = os.path.join(tmp, 'registry.json')
+        lock_file = os.path.join(tmp, 'registry.lock')
+        JsonBackend(registry_file, lock_file)
+        start, results = ctx.Event(), ctx.Queue()
+        workers = [ctx.Process(target=_worker, args=(registry_file, lock_file, retries, ops, port_range, strategy,
+                                                          start, results))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.5 + processes * 0.05)  # let interpreters start before the clock does
+        began = time.perf_counter()
+        start.set()
+        conflicts = sum(results.get() for _ in workers)
+        elapsed = time.perf_counter() - began
+        for worker in workers:
+            worker.join()
+    total = processes * ops * 2
+    return {'mode': mode, 'strategy': strategy, 'processes': processes, 'operations': total, 'seconds': elapsed,
+            'ops_per_second': total / elapsed, 'conflicts': conflicts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=32, help='Concurrent processes (default: 32)')
+    parser.add_argument('--ops', type=int, default=50, help='Reserve/release pairs per process (default: 50)')
+    parser.add_argument('--range', default='20000-40000', help='Port range (default: 20000-40000)')
+    parser.add_argument('--strategy', default='random', help='Allocation strategy (default: random)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    port_range = tuple(map(int, args.range.split('-')))
+
+    results = [run(mode, args.processes, args.ops, port_range, args.strategy) for mode in ('optimistic', 'locked')]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<11} {'procs':>6} {'ops':>7} {'seconds':>8} {'ops/s':>9} {'conflicts':>10}")
+    for r in results:
+        print(f"{r['mode']:<11} {r['processes']:>6} {r['operations']:>7} {r['seconds']:>8.2f} "
+              f"{r['ops_per_second']:>9.0f} {r['conflicts']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Reserve and release latency against registries of increasing size, per backend.
+
+Each registry is pre-filled with ``size`` reservations starting at port 10000
+and every reservation searches the range 10000-65535, so allocation has to
+skip the occupied block as well as read and rewrite the registry.
+
+    python benchmarks/bench_latency.py --sizes 0 1000 10000 50000 --ops 100
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+from _common import BACKENDS, make_registry, percentiles, print_table
+
+PORT_RANGE = (10000, 65535)
+
+
+def run(backend: str, size: int, ops: int) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = make_registry(tmp, backend, size)
+        reserve, release = [], []
+        for _ in range(ops):
+            began = time.perf_counter()
+            reservation = registry.reserve(port_range=PORT_RANGE)
+            reserved = time.perf_counter()
+            registry.release(reservation)
+            reserve.append(reserved - began)
+            release.append(time.perf_counter() - reserved)
+        registry.backend.close()
+    result = {'backend': backend, 'size': size, 'ops': ops}
+    result.update({f'reserve_{k}': v for k, v in percentiles(reserve).items()})
+    result.update({f'release_{k}': v for k, v in percentiles(release).items()})
+    return result
+
+
+def run_all(backends: Sequence[str] = BACKENDS, sizes: Sequence[int] = (0, 1000, 10000),
+            ops: int = 50) -> List[Dict]:
+    return [run(backend, size, ops) for backend in backends for size in sizes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[0, 1000, 10000, 50000],
+                        help='Registry sizes to measure (default: 0 1000 10000 50000)')
+    parser.add_argument('--ops', type=int, default=100, help='Reserve/release pairs per measurement (default: 100)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    results = run_all(args.backends, args.sizes, args.ops)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print_table(results, ('backend', 'size', 'reserve_p50_ms', 'reserve_p95_ms', 'release_p50_ms', 'release_p95_ms'))
+
+
+if __name__ == '__main__':
+    main()
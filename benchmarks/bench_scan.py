@@ -0,0 +1,93 @@
+"""``scan_local_network`` throughput against stand-in listeners on 127.0.0.0/8.
+
+Opens listeners on every ``--open-every``-th port of ``--hosts`` loopback
+addresses (127.0.0.1, 127.0.0.2, ...; on systems that only route 127.0.0.1
+the others are skipped) and scans them through PortRegistry.scan_local_network
+(the kernel socket table where available) and through the connect-probe
+Scanner. Reports ports per second and checks every listener was found.
+
+    python benchmarks/bench_scan.py --hosts 16 --range 20000-20999
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import socket
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Dict, List, Sequence, Tuple
+
+from _common import make_registry, print_table
+
+from portkeeper.scanner import OPEN, Scanner
+
+
+def _listeners(stack: ExitStack, hosts: int, port_range: Tuple[int, int], every: int) -> Dict[str, List[int]]:
+    opened: Dict[str, List[int]] = {}
+    for i in range(1, hosts + 1):
+        host = f'127.0.0.{i}'
+        for port in range(port_range[0], port_range[1] + 1, every):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.bind((host, port))
+            except OSError:
+                sock.close()
+                if port == port_range[0]:
+                    break  # address not routable here, or the first port is taken: skip this host
+                continue
+            sock.listen(64)
+            stack.callback(sock.close)
+            opened.setdefault(host, []).append(port)
+    return opened
+
+
+def _result(mode: str, opened: Dict[str, List[int]], port_range: Tuple[int, int], seconds: float,
+            found: Dict[str, set]) -> Dict:
+    ports = len(opened) * (port_range[1] - port_range[0] + 1)
+    missed = sum(len(set(listening) - found.get(host, set())) for host, listening in opened.items())
+    return {'mode': mode, 'hosts': len(opened), 'ports': ports, 'seconds': seconds,
+            'ports_per_second': ports / seconds if seconds else 0.0, 'missed_listeners': missed}
+
+
+def run(hosts: int = 4, port_range: Tuple[int, int] = (20000, 20499), every: int = 50,
+        timeout: float = 0.2, modes: Sequence[str] = ('registry', 'probe')) -> List[Dict]:
+    results = []
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as tmp:
+        opened = _listeners(stack, hosts, port_range, every)
+        targets = sorted(opened)
+        if 'registry' in modes:
+            registry = make_registry(tmp, 'json')
+            registry._local_hosts = lambda: list(targets)
+            began = time.perf_counter()
+            free = registry.scan_local_network(port_range, timeout=timeout)
+            seconds = time.perf_counter() - began
+            found = {host: set(range(port_range[0], port_range[1] + 1)) - set(free.get(host, ())) for host in targets}
+            results.append(_result('registry', opened, port_range, seconds, found))
+        if 'probe' in modes:
+            began = time.perf_counter()
+            states = Scanner(timeout=timeout).scan(targets, port_range)
+            seconds = time.perf_counter() - began
+            found = {host: {port for port, state in ports.items() if state == OPEN} for host, ports in states.items()}
+            results.append(_result('probe', opened, port_range, seconds, found))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=16, help='Loopback addresses to scan (default: 16)')
+    parser.add_argument('--range', default='20000-20999', help='Port range (default: 20000-20999)')
+    parser.add_argument('--open-every', type=int, default=50, help='Listen on every Nth port (default: 50)')
+    parser.add_argument('--timeout', type=float, default=0.2, help='Connect timeout (default: 0.2)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    port_range = tuple(map(int, args.range.split('-')))
+    results = run(args.hosts, port_range, args.open_every, args.timeout)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print_table(results, ('mode', 'hosts', 'ports', 'seconds', 'ports_per_second', 'missed_listeners'))
+
+
+if __name__ == '__main__':
+    main()
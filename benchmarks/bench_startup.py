@@ -0,0 +1,104 @@
+"""Cold-start time of the ``portkeeper`` CLI, checked against a budget.
+
+Every sample is a fresh interpreter, as when a shell wrapper calls the CLI:
+bare ``python`` (the floor), ``import portkeeper.cli``, ``--help``, and
+``status`` streaming a JSON registry of ``--entries`` reservations. Bytecode
+is cached in a private directory and one warm-up run precedes each case, as
+for an installed package. The budget applies to ``import portkeeper.cli``
+minus bare interpreter startup; going over it makes the exit status 1.
+
+    python benchmarks/bench_startup.py --repeats 20 --budget-ms 40
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from _common import HOST, percentiles, print_table
+
+SRC = str(Path(__file__).resolve().parents[1] / 'src')
+DEFAULT_BUDGET_MS = 40.0
+
+
+def _commands(registry: str) -> Dict[str, List[str]]:
+    status = ['-m', 'portkeeper.cli', 'status', '--registry', registry, '--lock', registry + '.lock']
+    return {
+        'python': ['-c', 'pass'],
+        'import': ['-c', 'import portkeeper.cli'],
+        'help': ['-m', 'portkeeper.cli', '--help'],
+        'status': status,
+    }
+
+
+def _seed(path: str, entries: int) -> None:
+    with open(path, 'w') as f:
+        json.dump({f'{HOST}:{port}': {'host': HOST, 'port': port, 'owner': f'svc-{port % 10}', 'timestamp': 0.0}
+                   for port in range(10000, 10000 + entries)}, f, indent=2)
+
+
+def _time(argv: List[str], env: Dict[str, str], repeats: int) -> List[float]:
+    samples = []
+    for i in range(repeats + 1):
+        began = time.perf_counter()
+        subprocess.run([sys.executable] + argv, env=env, check=True, stdout=subprocess.DEVNULL)
+        if i:  # the first run writes the bytecode cache
+            samples.append(time.perf_counter() - began)
+    return samples
+
+
+def run_all(repeats: int = 10, entries: int = 10000) -> List[Dict]:
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = os.path.join(tmp, 'registry.json')
+        _seed(registry, entries)
+        env = dict(os.environ, PYTHONPATH=SRC, PYTHONPYCACHEPREFIX=os.path.join(tmp, 'pycache'),
+                   PORTKEEPER_SOCKET=os.path.join(tmp, 'no-daemon.sock'))
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        env.pop('PORTKEEPER_METRICS_FILE', None)
+        rows = []
+        for case, argv in _commands(registry).items():
+            stats = percentiles(_time(argv, env, repeats))
+            rows.append({'case': case, 'repeats': repeats, 'start_p50_ms': stats['p50_ms'],
+                         'start_p95_ms': stats['p95_ms']})
+    floor = rows[0]['start_p50_ms']
+    for row in rows:
+        row['over_python_ms'] = row['start_p50_ms'] - floor
+    return rows
+
+
+def over_budget(rows: Sequence[Dict], budget_ms: float) -> Optional[float]:
+    """The import overhead if it exceeds ``budget_ms``, else None."""
+    overhead = next(row['over_python_ms'] for row in rows if row['case'] == 'import')
+    return overhead if overhead > budget_ms else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=10, help='Processes started per case (default: 10)')
+    parser.add_argument('--entries', type=int, default=10000,
+                        help="Reservations in the registry 'status' reads (default: 10000)")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'Allowed median cost of importing the CLI beyond bare interpreter startup '
+                             f'(default: {DEFAULT_BUDGET_MS:g})')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    results = run_all(args.repeats, args.entries)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results, ('case', 'start_p50_ms', 'start_p95_ms', 'over_python_ms'))
+    overhead = over_budget(results, args.budget_ms)
+    if overhead is not None:
+        print(f'import portkeeper.cli takes {overhead:.1f} ms beyond interpreter startup; '
+              f'the budget is {args.budget_ms:g} ms', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
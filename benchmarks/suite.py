@@ -0,0 +1,160 @@
+"""Run every benchmark, write the results as JSON and compare them with a baseline.
+
+    python benchmarks/suite.py --profile quick --output bench-results.json --baseline .bench-baseline-quick.json
+
+Results are flattened into metrics named ``<benchmark>/<case>/<metric>``.
+Medians (``*_p50_ms``, ``per_port_ms``) are better when lower and
+``*_per_second`` when higher; a change in the wrong direction larger than
+``--tolerance`` counts as a regression and makes the exit status 1. Tail
+latencies and the other fields are reported but too noisy to compare.
+Baselines are only meaningful on the machine that recorded them: refresh
+one with ``--save-baseline`` (``make bench-baseline``).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import bench_batch
+import bench_contention
+import bench_latency
+import bench_scan
+import bench_startup
+import bench_strategies
+from _common import print_table
+
+from portkeeper import __version__
+from portkeeper.strategies import FirstFit, HashedFit, NextFit, RandomFit
+
+DEFAULT_TOLERANCE = 0.25
+
+PROFILES = {
+    'quick': {'sizes': (0, 1000, 10000), 'ops': 30, 'counts': (1, 10, 100), 'repeats': 5,
+              'processes': 4, 'contention_ops': 10, 'scan_hosts': 4, 'scan_range': (20000, 20499),
+              'reservations': 1000, 'startup_repeats': 10, 'status_entries': 10000},
+    'full': {'sizes': (0, 1000, 10000, 50000), 'ops': 100, 'counts': (1, 10, 100, 1000), 'repeats': 10,
+             'processes': 32, 'contention_ops': 50, 'scan_hosts': 16, 'scan_range': (20000, 20999),
+             'reservations': 5000, 'startup_repeats': 30, 'status_entries': 50000},
+}
+
+
+def _strategies(profile: Dict) -> List[Dict]:
+    return [bench_strategies.simulate(strategy, 32, profile['reservations'], (20000, 40000), 0.25, 0.05, 1)
+            for strategy in (FirstFit(), NextFit(), RandomFit(rng=random.Random(1)), HashedFit())]
+
+
+# benchmark name -> (runner, fields naming a case)
+BENCHMARKS: Dict[str, Tuple[Callable[[Dict], List[Dict]], Tuple[str, ...]]] = {
+    'latency': (lambda p: bench_latency.run_all(sizes=p['sizes'], ops=p['ops']), ('backend', 'size')),
+    'batch': (lambda p: bench_batch.run_all(counts=p['counts'], repeats=p['repeats']), ('backend', 'count')),
+    'contention': (lambda p: [bench_contention.run(mode, p['processes'], p['contention_ops'], (20000, 40000),
+                                                   'random') for mode in ('optimistic', 'locked')], ('mode',)),
+    'scan': (lambda p: bench_scan.run(p['scan_hosts'], p['scan_range']), ('mode',)),
+    'strategies': (_strategies, ('strategy',)),
+    'startup': (lambda p: bench_startup.run_all(p['startup_repeats'], p['status_entries']), ('case',)),
+}
+
+
+def direction(metric: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if the metric is not compared."""
+    name = metric.rsplit('/', 1)[-1]
+    if name.endswith('_per_second'):
+        return 1
+    if name.endswith('_p50_ms') or name == 'per_port_ms':
+        return -1
+    return 0
+
+
+def flatten(results: Dict[str, List[Dict]]) -> Dict[str, float]:
+    metrics = {}
+    for bench, rows in results.items():
+        case_fields = BENCHMARKS[bench][1]
+        for row in rows:
+            case = '/'.join(str(row[field]) for field in case_fields)
+            for field, value in row.items():
+                if field not in case_fields and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metrics[f'{bench}/{case}/{field}'] = value
+    return metrics
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], tolerance: float = DEFAULT_TOLERANCE) -> List[Dict]:
+    """One row per metric present in both runs, flagging changes worse than ``tolerance`` as regressions."""
+    rows = []
+    for metric in sorted(set(current) & set(baseline)):
+        sign = direction(metric)
+        old, new = baseline[metric], current[metric]
+        if not sign or not old:
+            continue
+        change = (new - old) / old
+        rows.append({'metric': metric, 'baseline': old, 'current': new, 'change': change,
+                     'regression': sign * change < -tolerance})
+    return rows
+
+
+def run(profile: str, only: Optional[List[str]] = None) -> Dict:
+    settings = PROFILES[profile]
+    results = {}
+    for name, (runner, _) in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        began = time.perf_counter()
+        print(f'running {name}...', file=sys.stderr)
+        results[name] = runner(settings)
+        print(f'  {name} done in {time.perf_counter() - began:.1f}s', file=sys.stderr)
+    return {
+        'meta': {'version': __version__, 'profile': profile, 'python': platform.python_version(),
+                 'platform': platform.platform(), 'cpus': os.cpu_count(), 'time': time.time()},
+        'results': results,
+        'metrics': flatten(results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick', help='Workload size (default: quick)')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='Run only these benchmarks')
+    parser.add_argument('--output', help='Write the results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='Compare with this results JSON; exit 1 on regressions')
+    parser.add_argument('--save-baseline', metavar='PATH', help='Also write the results JSON here as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'Allowed relative slowdown before a metric counts as a regression '
+                             f'(default: {DEFAULT_TOLERANCE})')
+    args = parser.parse_args()
+
+    report = run(args.profile, args.only)
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('profile') != args.profile:
+            print(f'warning: baseline was recorded with the {baseline.get("meta", {}).get("profile")} profile',
+                  file=sys.stderr)
+        rows = compare(report['metrics'], baseline.get('metrics', {}), args.tolerance)
+        report['comparison'] = rows
+        regressions = [row for row in rows if row['regression']]
+        print_table([dict(row, change=f"{row['change']:+.1%}", regression='REGRESSION' if row['regression'] else '')
+                     for row in rows], ('metric', 'baseline', 'current', 'change', 'regression'))
+        print(f'{len(regressions)} regression(s) beyond {args.tolerance:.0%}', file=sys.stderr)
+    elif args.baseline:
+        print(f'warning: no baseline at {args.baseline}; run with --save-baseline first', file=sys.stderr)
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload + '\n')
+    elif not args.baseline:
+        print(payload)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(payload + '\n')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,12 @@ Reserve a port with PortKeeper and then run a basic HTTP server on that port.
 - Update .env (PORT) and config.json (server.host/port)
 - Start a simple HTTP server listening on the reserved port
 
+Reserving and then binding leaves a moment in which another process can
+take the port. Started with ``portkeeper run``, the server instead adopts
+the socket the launcher already bound and listened on, so there is no gap:
+
+    portkeeper run --range 8000-8100 -- python examples/reserve_and_run_http_server.py
+
 Press Ctrl+C to stop.
 """
 from __future__ import annotations
@@ -15,6 +21,7 @@ import json
 import socketserver
 from pathlib import Path
 from portkeeper import PortRegistry
+from portkeeper.activation import listen_fds
 
 
 class SimpleHandler(http.server.SimpleHTTPRequestHandler):
@@ -34,7 +41,28 @@ class SimpleHandler(http.server.SimpleHTTPRequestHandler):
             super().do_GET()
 
 
+def serve(httpd: socketserver.TCPServer) -> None:
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Shutting down...")
+    finally:
+        httpd.server_close()
+
+
 def main() -> None:
+    sockets = listen_fds()
+    if sockets:
+        # Handed over by `portkeeper run`: already bound and listening, and released when we exit
+        httpd = socketserver.TCPServer(sockets[0].getsockname(), SimpleHandler, bind_and_activate=False)
+        httpd.socket.close()
+        httpd.socket = sockets[0]
+        host, port = httpd.server_address[:2]
+        print(f"\n🌐 Serving the inherited socket on http://{host}:{port}\n")
+        with httpd:
+            serve(httpd)
+        return
+
     reg = PortRegistry()
 
     # Reserve a port; don't hold while server runs, but ensure we update configs first.
@@ -47,12 +75,7 @@ def main() -> None:
     print(f"\n🌐 Starting HTTP server on http://{res.host}:{res.port}\n")
 
     with socketserver.TCPServer((res.host, res.port), SimpleHandler) as httpd:
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\n🛑 Shutting down...")
-        finally:
-            httpd.server_close()
+        serve(httpd)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,20 @@
-from .core import PortRegistry, Reservation, PortKeeperError
+from .errors import PortKeeperError
 
-__all__ = ["PortRegistry", "Reservation", "PortKeeperError"]
+__all__ = ["PortRegistry", "AsyncPortRegistry", "Reservation", "PortKeeperError"]
 __version__ = "0.5.6"
+
+# Resolved on first use so that `import portkeeper.cli` does not pay for asyncio and the allocator
+_LAZY = {"PortRegistry": ".core", "Reservation": ".core", "AsyncPortRegistry": ".aio"}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        from importlib import import_module
+        value = getattr(import_module(_LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
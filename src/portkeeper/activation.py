@@ -0,0 +1,188 @@
+"""Socket handoff using the systemd ``LISTEN_FDS`` convention.
+
+``run()`` (``portkeeper run``) reserves ports, binds and listens on them
+itself and starts a command with the listening sockets as inherited file
+descriptors 3, 4, ... . ``LISTEN_FDS`` holds their count, ``LISTEN_PID``
+the pid they are meant for and ``LISTEN_FDNAMES`` their names. The port
+numbers are in ``PORT`` (the first), ``PORTS`` (comma-separated) and
+``PORT_0``, ``PORT_1``, ... . No other process can take a port between its
+reservation and the application starting to serve on it.
+
+Applications adopt the sockets with ``listen_fds()``, which works the same
+under systemd socket activation. This module only imports the allocator
+when ``run()`` is called, so importing it costs an application nothing.
+"""
+from __future__ import annotations
+
+import os
+import signal
+import socket
+import sys
+from typing import TYPE_CHECKING, Sequence
+
+from .errors import PortKeeperError
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .core import PortRegistry
+
+LISTEN_FDS_START = 3
+DEFAULT_BACKLOG = socket.SOMAXCONN
+
+# Signals the launcher passes on to the command; SIGINT from a terminal reaches it directly
+_FORWARDED_SIGNALS = ('SIGTERM', 'SIGHUP', 'SIGQUIT', 'SIGUSR1', 'SIGUSR2')
+
+
+def listen_fds_with_names(unset_environment: bool = True) -> list[tuple[str, socket.socket]]:
+    """
+    ``(name, socket)`` for each socket passed to this process by ``portkeeper run``
+    or systemd, in order; empty when there are none, or they were meant for
+    another process. The sockets are made close-on-exec. With
+    ``unset_environment``, the ``LISTEN_*`` variables are removed so that
+    processes started later do not take them for their own.
+    """
+    try:
+        count = int(os.environ.get('LISTEN_FDS', ''))
+        pid = int(os.environ.get('LISTEN_PID', ''))
+    except ValueError:
+        return []
+    names = os.environ.get('LISTEN_FDNAMES', '').split(':')
+    if unset_environment:
+        for name in ('LISTEN_FDS', 'LISTEN_PID', 'LISTEN_FDNAMES'):
+            os.environ.pop(name, None)
+    if pid != os.getpid() or count < 1:
+        return []
+    adopted = []
+    for i, fd in enumerate(range(LISTEN_FDS_START, LISTEN_FDS_START + count)):
+        os.set_inheritable(fd, False)
+        adopted.append((names[i] if i < len(names) and names[i] else 'unknown',
+                        socket.socket(fileno=fd)))
+    return adopted
+
+
+def listen_fds(unset_environment: bool = True) -> list[socket.socket]:
+    """The sockets passed to this process, in order; see listen_fds_with_names()."""
+    return [sock for _, sock in listen_fds_with_names(unset_environment)]
+
+
+def port_environment(ports: Sequence[int], env_keys: Sequence[str] = ()) -> dict[str, str]:
+    """Environment variables naming ``ports``: PORT, PORTS, PORT_<i> and ``env_keys[i]``."""
+    env = {'PORT': str(ports[0]), 'PORTS': ','.join(map(str, ports))}
+    env.update((f'PORT_{i}', str(port)) for i, port in enumerate(ports))
+    env.update((key, str(port)) for key, port in zip(env_keys, ports))
+    return env
+
+
+def _expand(command: Sequence[str], env: dict[str, str]) -> list[str]:
+    """Replace ``{NAME}`` in the command's arguments with the port variables, e.g. ``{PORT}``."""
+    expanded = []
+    for arg in command:
+        for name, value in env.items():
+            arg = arg.replace('{' + name + '}', value)
+        expanded.append(arg)
+    return expanded
+
+
+def _exec_child(command: list[str], env: dict[str, str], fds: list[int], names: list[str]) -> None:
+    """In the forked child: move ``fds`` to 3, 4, ..., announce them and exec ``command``.
+
+    Never returns.
+    """
+    try:
+        if fds:
+            import fcntl
+            # Copy above every target first, so moving one cannot overwrite another
+            floor = max([LISTEN_FDS_START + len(fds)] + fds) + 1
+            moved = [fcntl.fcntl(fd, fcntl.F_DUPFD, floor) for fd in fds]
+            for i, fd in enumerate(moved):
+                os.dup2(fd, LISTEN_FDS_START + i)  # inheritable
+                os.close(fd)
+            env = dict(env, LISTEN_FDS=str(len(fds)), LISTEN_PID=str(os.getpid()),
+                       LISTEN_FDNAMES=':'.join(names))
+        for name in ('SIGPIPE', 'SIGXFSZ', 'SIGINT'):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), signal.SIG_DFL)
+        os.execvpe(command[0], command, env)
+    except BaseException as e:
+        try:
+            message = f"portkeeper run: cannot run {command[0]}: {e}\n"
+            os.write(2, message.encode('utf-8', 'replace'))
+        finally:
+            os._exit(127)
+
+
+def _wait(pid: int) -> int:
+    """Wait for the child, passing on termination signals; return its exit status.
+
+    A child killed by signal n exits with 128 + n, as in the shell.
+    """
+    forwarded = {}
+
+    def forward(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+    for name in _FORWARDED_SIGNALS:
+        if hasattr(signal, name):
+            forwarded[name] = signal.signal(getattr(signal, name), forward)
+    interrupt = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        _, status = os.waitpid(pid, 0)
+    finally:
+        signal.signal(signal.SIGINT, interrupt)
+        for name, previous in forwarded.items():
+            signal.signal(getattr(signal, name), previous)
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run(command: Sequence[str], ports: int = 1, registry: PortRegistry | None = None,
+        port_range: tuple[int, int] | None = None, host: str | None = None,
+        owner: str | None = None, label: str | None = None, env_keys: Sequence[str] = (),
+        ttl: float | None = None, handoff: bool = True, backlog: int = DEFAULT_BACKLOG) -> int:
+    """
+    Reserve ``ports`` ports, run ``command`` with them and release them when it exits.
+    Returns the command's exit status.
+
+    With ``handoff`` (the default) the ports are bound and listening before the
+    command starts and it inherits the sockets (see the module docstring);
+    without, only the port variables are passed, for programs that must bind
+    the ports themselves. ``{PORT}``, ``{PORT_1}``, ``{<env key>}`` and the
+    like in ``command`` are replaced with the port numbers. With ``ttl`` the
+    reservations are leases renewed while the command runs, so gc() collects
+    them should the launcher be killed.
+    """
+    if not hasattr(os, 'fork'):
+        raise PortKeeperError("portkeeper run needs a POSIX system (os.fork)")
+    if not command:
+        raise PortKeeperError("No command to run")
+    from .core import DEFAULT_HOST, PortRegistry
+    registry = registry or PortRegistry()
+    result = registry.reserve(port_range=port_range, host=host or DEFAULT_HOST, hold=handoff,
+                              owner=owner, count=ports, ttl=ttl, label=label)
+    reservations = result if isinstance(result, list) else [result]
+    keeper = None
+    try:
+        env = port_environment([r.port for r in reservations], env_keys)
+        names = [env_keys[i] if i < len(env_keys) else f'PORT_{i}'
+                 for i in range(len(reservations))]
+        fds = []
+        for reservation in reservations if handoff else ():
+            reservation._holder_socket.listen(backlog)  # held with a backlog of 1 until now
+            fds.append(reservation._holder_socket.fileno())
+        argv = _expand(command, env)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            _exec_child(argv, dict(os.environ, **env), fds, names)
+        # The command owns the sockets now; the launcher only keeps the reservations
+        registry._close_holders(reservations)
+        if ttl:
+            keeper = registry.keep_alive(reservations)
+        return _wait(pid)
+    finally:
+        if keeper is not None:
+            keeper.stop()
+        registry.release_many(reservations)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import AsyncIterator
+
+from .core import DEFAULT_HOST, PortRegistry, Reservation
+from .scanner import DEFAULT_CONCURRENCY, ScanResult
+
+DEFAULT_WORKERS = 8
+
+
+class AsyncPortRegistry:
+    """asyncio front end for PortRegistry.
+
+    Lock waits, registry I/O and bind probes run on a small dedicated thread
+    pool, so the event loop never blocks on ``flock`` or fsync. Coroutines
+    beyond ``max_workers`` wait on the loop rather than tying up threads.
+    Pass an existing PortRegistry or the keyword arguments to build one.
+    """
+
+    def __init__(self, registry: PortRegistry | None = None, *, max_workers: int = DEFAULT_WORKERS,
+                 **kwargs):
+        self.registry = registry or PortRegistry(**kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='portkeeper')
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def reserve(self, port_range: tuple[int, int] | None = None,
+                      host: str = DEFAULT_HOST, hold: bool = False,
+                      owner: str | None = None, count: int = 1,
+                      preferred: int | None = None,
+                      ttl: float | None = None,
+                      strategy=None, label: str | None = None) -> Reservation | list[Reservation]:
+        """Reserve one or more ports; see PortRegistry.reserve."""
+        return await self._run(self.registry.reserve, port_range, host, hold, owner, count,
+                               preferred, ttl, strategy, label)
+
+    async def reserve_block(self, length: int, port_range: tuple[int, int] | None = None,
+                            host: str = DEFAULT_HOST, align: int = 1, hold: bool = False,
+                            owner: str | None = None, ttl: float | None = None,
+                            label: str | None = None) -> list[Reservation]:
+        """Reserve ``length`` consecutive ports; see PortRegistry.reserve_block."""
+        return await self._run(self.registry.reserve_block, length, port_range, host, align, hold,
+                               owner, ttl, label)
+
+    async def release(self, reservation: Reservation) -> None:
+        await self._run(self.registry.release, reservation)
+
+    async def release_many(self, reservations: list[Reservation] | None = None,
+                           owner: str | None = None, pid: int | None = None,
+                           label: str | None = None) -> list[str]:
+        """Release many reservations in one transaction; see PortRegistry.release_many."""
+        return await self._run(self.registry.release_many, reservations, owner, pid, label)
+
+    async def find(self, owner: str | None = None, pid: int | None = None,
+                   label: str | None = None) -> dict[str, dict]:
+        return await self._run(self.registry.find, owner, pid, label)
+
+    async def renew(self, reservations: list[Reservation], ttl: float | None = None) -> int:
+        return await self._run(self.registry.renew, reservations, ttl)
+
+    async def gc(self, check_pids: bool = True) -> list[str]:
+        return await self._run(self.registry.gc, check_pids)
+
+    async def status(self) -> dict[str, dict]:
+        return await self._run(self.registry.status)
+
+    async def scan_local_network(self, port_range: tuple[int, int] = (8000, 9000),
+                                 timeout: float = 0.1) -> dict[str, list[int]]:
+        return await self._run(self.registry.scan_local_network, port_range, timeout)
+
+    async def iter_scan_local_network(self, port_range: tuple[int, int] = (8000, 9000),
+                                      timeout: float = 0.1,
+                                      concurrency: int = DEFAULT_CONCURRENCY,
+                                      ) -> AsyncIterator[ScanResult]:
+        """Yield (host, port, state) as the scan progresses; leaving the loop early stops it."""
+        loop = asyncio.get_running_loop()
+        results: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                scan = self.registry.iter_scan_local_network(port_range, timeout, concurrency)
+                with closing(scan):
+                    for item in scan:
+                        if stop.is_set():
+                            break
+                        loop.call_soon_threadsafe(results.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(results.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(results.put_nowait, done)
+
+        producer = loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                item = await results.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            await producer
+
+    async def get_free_host_port(self, port_range: tuple[int, int] = (8000, 9000),
+                                 timeout: float = 0.1) -> tuple[str, int]:
+        return await self._run(self.registry.get_free_host_port, port_range, timeout)
+
+    async def reserve_network_port(self, port_range: tuple[int, int] | None = None,
+                                   host: str | None = None, hold: bool = False,
+                                   owner: str | None = None) -> Reservation:
+        return await self._run(self.registry.reserve_network_port, port_range, host, hold, owner)
+
+    def reserve_context(self, *args, count: int = 1, **kwargs):
+        """Async context manager reserving ports on entry and releasing them on exit; leases
+        (``ttl=...``) are renewed while inside."""
+        return _AsyncReservationContext(self, args, kwargs, count)
+
+    async def aclose(self) -> None:
+        """Wait for running operations and shut down the worker threads."""
+        shutdown = functools.partial(self._executor.shutdown, wait=True)
+        await asyncio.get_running_loop().run_in_executor(None, shutdown)
+
+    async def __aenter__(self) -> AsyncPortRegistry:
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
+
+
+class _AsyncReservationContext:
+    def __init__(self, reg: AsyncPortRegistry, args, kwargs, count: int):
+        self.reg = reg
+        self.args = args
+        self.kwargs = kwargs
+        self.count = count
+        self.reservations = None
+        self.renewer: asyncio.Task | None = None
+
+    async def _renew(self, reservations: list[Reservation], interval: float) -> None:
+        """Renew the leases every ``interval`` seconds, as LeaseKeeper does for the sync context."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reg.renew(reservations)
+            except Exception:
+                pass  # keep trying; the lease may still be saved by the next beat
+
+    async def __aenter__(self):
+        self.reservations = await self.reg.reserve(*self.args, count=self.count, **self.kwargs)
+        reservations = self.reservations
+        if not isinstance(reservations, list):
+            reservations = [reservations]
+        ttls = [r.ttl for r in reservations if r.ttl]
+        if ttls:
+            # A third of the shortest lease, like LeaseKeeper: a lease survives two missed beats
+            self.renewer = asyncio.ensure_future(self._renew(reservations, min(ttls) / 3))
+        return self.reservations
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self.renewer is not None:
+            self.renewer.cancel()
+            try:
+                await self.renewer
+            except asyncio.CancelledError:
+                pass
+            self.renewer = None
+        if not self.reservations:
+            return
+        reservations = self.reservations
+        if not isinstance(reservations, list):
+            reservations = [reservations]
+        for reservation in reservations:
+            await self.reg.release(reservation)
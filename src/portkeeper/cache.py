@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterable, Iterator, NamedTuple, Tuple
+
+from . import metrics
+from .locking import FileLock
+
+DEFAULT_SCAN_TTL = float(os.environ.get("PORTKEEPER_SCAN_TTL", "30"))
+DEFAULT_SCAN_CACHE = os.environ.get("PORTKEEPER_SCAN_CACHE") or None
+
+_Key = Tuple[str, int, int]
+
+
+class _CacheEntry(NamedTuple):
+    scanned_at: float
+    free: deque[int]
+
+
+def _overlaps(a: tuple[int, int], b: tuple[int, int]) -> bool:
+    return a[0] <= b[1] and b[0] <= a[1]
+
+
+class ScanCache:
+    """Free ports found by network scans, keyed by host and port range.
+
+    Entries expire ``ttl`` seconds after the scan that produced them. Ports are
+    handed out from a deque, so each pop is O(1) and a port is never handed out
+    twice from the same scan. With ``path``, the cache lives in a JSON file
+    guarded by a lock file and is shared by every process pointing at it.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_SCAN_TTL, path: str | None = None):
+        self.ttl = ttl
+        self.path = path
+        self.lock_path = f"{path}.lock" if path else None
+        self._entries: dict[_Key, _CacheEntry] = {}
+        self._mutex = threading.Lock()
+
+    # --- persistence ---
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        entries = {}
+        for key, value in data.items():
+            host, start, end = key.rsplit('|', 2)
+            entries[(host, int(start), int(end))] = _CacheEntry(value['scanned_at'],
+                                                                deque(value['free']))
+        self._entries = entries
+
+    def _save(self) -> None:
+        data = {f"{host}|{start}|{end}": {'scanned_at': entry.scanned_at, 'free': list(entry.free)}
+                for (host, start, end), entry in self._entries.items()}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    @contextmanager
+    def _locked(self, write: bool = False) -> Iterator[dict[_Key, _CacheEntry]]:
+        with self._mutex:
+            if self.path is None:
+                yield self._entries
+                return
+            with FileLock(self.lock_path, caller='scan-cache'):
+                self._load()
+                yield self._entries
+                if write:
+                    self._save()
+
+    def _expire(self, entries: dict[_Key, _CacheEntry], now: float) -> bool:
+        stale = [key for key, entry in entries.items()
+                 if now - entry.scanned_at >= self.ttl or not entry.free]
+        for key in stale:
+            del entries[key]
+        return bool(stale)
+
+    # --- public API ---
+    def put(self, host: str, port_range: tuple[int, int], free_ports: Iterable[int],
+            scanned_at: float | None = None) -> None:
+        """Record the free ports a scan of ``port_range`` on ``host`` found, replacing old ones."""
+        entry = _CacheEntry(time.time() if scanned_at is None else scanned_at, deque(free_ports))
+        with self._locked(write=True) as entries:
+            entries[(host, port_range[0], port_range[1])] = entry
+
+    def pop(self, port_range: tuple[int, int]) -> tuple[str, int] | None:
+        """Hand out a cached free (host, port) from a fresh scan of ``port_range``, or None."""
+        start, end = port_range
+        with self._locked(write=True) as entries:
+            self._expire(entries, time.time())
+            for (host, s, e), entry in entries.items():
+                if (s, e) == (start, end):
+                    port = entry.free.popleft()
+                    if not entry.free:
+                        del entries[(host, s, e)]
+                    metrics.inc('portkeeper_scan_cache_requests_total', result='hit')
+                    return host, port
+        metrics.inc('portkeeper_scan_cache_requests_total', result='miss')
+        return None
+
+    def fresh(self, port_range: tuple[int, int]) -> bool:
+        """True if unexpired results are cached for ``port_range``."""
+        now = time.time()
+        with self._locked() as entries:
+            return any((s, e) == tuple(port_range) and entry.free
+                       and now - entry.scanned_at < self.ttl
+                       for (_, s, e), entry in entries.items())
+
+    def invalidate(self, host: str | None = None, port_range: tuple[int, int] | None = None) -> int:
+        """Drop cached results for ``host`` and/or ranges overlapping ``port_range``.
+
+        With neither, everything is dropped.
+        """
+        with self._locked(write=True) as entries:
+            doomed = [key for key in entries
+                      if (host is None or key[0] == host)
+                      and (port_range is None or _overlaps((key[1], key[2]), port_range))]
+            for key in doomed:
+                del entries[key]
+        return len(doomed)
+
+    def clear(self) -> None:
+        self.invalidate()
@@ -1,64 +1,237 @@
+from __future__ import annotations
+
 import argparse
+import json
+import os
 import sys
-from typing import Optional
+from typing import TYPE_CHECKING
+
+from .errors import PortKeeperError
+
+# The allocator (and everything it imports) is loaded only by the commands that use it:
+# shell wrappers run this thousands of times a day, so cold start is kept to the standard library.
+if TYPE_CHECKING:
+    from .core import PortRegistry
+
+
+def _metrics_text(registry: PortRegistry, path: str | None) -> str:
+    """Prometheus text for the samples at ``path``, a running daemon's and the reservation gauge."""
+    from . import metrics
+
+    data = metrics.load(path) if path else {'counters': {}, 'histograms': {}}
+    client = registry._daemon()
+    if client is not None:
+        try:
+            metrics.merge(data, client.request('metrics')['metrics'])
+        except (ConnectionError, PortKeeperError):
+            pass  # gone, or too old to serve metrics
+    hosts = {}
+    for _, entry in registry.iter_status():
+        host = str(entry.get('host', ''))
+        hosts[host] = hosts.get(host, 0) + 1
+    gauges = {'portkeeper_reservations': {metrics._label_string({'host': host}): count
+                                          for host, count in hosts.items()}}
+    return metrics.render(data, gauges)
+
+
+def _registry(args, **kwargs) -> PortRegistry:
+    from .core import PortRegistry
+    kwargs.setdefault('backend', args.backend)
+    return PortRegistry(registry_path=args.registry, lock_path=args.lock, **kwargs)
+
+
+def _status(registry: PortRegistry, args) -> int:
+    """Print matching reservations as JSON Lines while reading them from the registry."""
+    out = sys.stdout
+    try:
+        for key, entry in registry.iter_status(host=args.host, owner=args.owner, label=args.label,
+                                               older_than=args.older_than,
+                                               newer_than=args.newer_than):
+            out.write(json.dumps({'key': key, **entry}, separators=(',', ':')) + '\n')
+        out.flush()
+    except BrokenPipeError:
+        # e.g. `portkeeper status | head`: stop quietly, and keep the interpreter from
+        # complaining at exit
+        sys.stdout = open(os.devnull, 'w')
+    return 0
+
+
+def _release(registry: PortRegistry, args) -> int:
+    """Release the reservations chosen by --port/--host, --owner, --glob and --label at once."""
+    if args.port is None and args.owner is None and args.glob is None and args.label is None:
+        print("❌ Give --port, --owner, --glob or --label to choose the reservations to release.",
+              file=sys.stderr)
+        return 2
+    try:
+        released = registry.release_matching(host=args.host, port=args.port, owner=args.owner,
+                                             pattern=args.glob, label=args.label)
+    except PortKeeperError as e:
+        print(f"❌ Failed to release: {e}", file=sys.stderr)
+        return 1
+    for key in released:
+        print(f"🔓 {key}")
+    if not released:
+        print("⚠️ No matching reservations", file=sys.stderr)
+        return 1
+    print(f"✅ Released {len(released)} reservation(s)")
+    return 0
 
-from .core import PortRegistry, Reservation
+
+def _parse_range(text: str | None) -> tuple[int, int] | None:
+    """``(start, end)`` from a --range like '8000-9000'; ValueError if malformed."""
+    if not text:
+        return None
+    start, end = map(int, text.split('-'))
+    return start, end
+
+
+def _run(registry: PortRegistry, args, command) -> int:
+    """Reserve --ports ports, run ``command`` with their sockets, release them when it exits."""
+    from .activation import run
+    if not command:
+        print("❌ Give the command to run after '--', e.g. portkeeper run -- python app.py",
+              file=sys.stderr)
+        return 2
+    try:
+        port_range = _parse_range(args.range)
+    except ValueError:
+        print(f"❌ Invalid range format: {args.range}. Use 'start-end'.", file=sys.stderr)
+        return 2
+    try:
+        return run(command, ports=args.ports, registry=registry, port_range=port_range,
+                   host=args.host, owner=args.owner, label=args.label,
+                   env_keys=args.env_key or (), ttl=args.ttl, handoff=not args.no_handoff)
+    except PortKeeperError as e:
+        print(f"❌ Failed to run: {e}", file=sys.stderr)
+        return 1
 
 
 def main():
     """CLI interface for PortKeeper."""
-    parser = argparse.ArgumentParser(description="PortKeeper - Manage and reserve free ports for your applications.")
-    parser.add_argument("command", choices=["reserve", "release", "status"], help="Command to execute")
+    parser = argparse.ArgumentParser(
+        description="PortKeeper - Manage and reserve free ports for your applications.")
+    parser.add_argument("command",
+                        choices=["reserve", "release", "status", "migrate", "gc", "metrics", "run"],
+                        help="Command to execute")
     parser.add_argument("--port", type=int, help="Preferred port to reserve")
     parser.add_argument("--range", type=str, help="Port range to reserve from (e.g., '8000-9000')")
-    parser.add_argument("--host", default="127.0.0.1", help="Host to reserve port on (default: 127.0.0.1)")
+    parser.add_argument("--host",
+                        help="Host to reserve port on (default: 127.0.0.1); "
+                             "with 'status' and 'release', only reservations on this host")
     parser.add_argument("--hold", action="store_true", help="Hold the port open with a socket")
-    parser.add_argument("--owner", help="Owner identifier for the reservation")
+    parser.add_argument("--owner",
+                        help="Owner identifier for the reservation; "
+                             "with 'status' and 'release', a glob matching owners")
+    parser.add_argument("--glob",
+                        help="With 'release', a glob matching 'host:port' keys to release")
+    parser.add_argument("--label",
+                        help="Label recorded with the reservation; "
+                             "with 'status' and 'release', only reservations with this label")
+    parser.add_argument("--older-than", type=float, metavar="SECONDS",
+                        help="With 'status', only reservations made at least this long ago")
+    parser.add_argument("--newer-than", type=float, metavar="SECONDS",
+                        help="With 'status', only reservations made at most this long ago")
     parser.add_argument("--registry", help="Path to the registry file")
     parser.add_argument("--lock", help="Path to the lock file")
+    parser.add_argument("--backend", choices=["json", "journal", "sqlite", "sharded", "bitmap"],
+                        help="Registry storage backend (default: json)")
+    parser.add_argument("--strategy", choices=["first-fit", "next-fit", "random", "hashed"],
+                        help="Allocation strategy for 'reserve' (default: first-fit)")
+    parser.add_argument("--block", type=int,
+                        help="With 'reserve', reserve this many consecutive ports")
+    parser.add_argument("--align", type=int, default=1,
+                        help="With '--block', start the block at a multiple of this (default: 1)")
+    parser.add_argument("--source",
+                        help="JSON registry to import with 'migrate' "
+                             "(default: .port_registry.json)")
+    parser.add_argument("--no-pid-check", action="store_true",
+                        help="With 'gc', only remove expired leases, not those whose process "
+                             "has exited")
+    parser.add_argument("--metrics-file", default=os.environ.get("PORTKEEPER_METRICS_FILE"),
+                        help="With 'metrics', the file processes save samples to "
+                             "(default: $PORTKEEPER_METRICS_FILE)")
+    parser.add_argument("--ports", type=int, default=1,
+                        help="With 'run', how many ports to pass to the command")
+    parser.add_argument("--env-key", action="append", metavar="NAME",
+                        help="With 'run', an environment variable for the next port (repeatable; "
+                             "PORT, PORTS and PORT_<i> are always set)")
+    parser.add_argument("--ttl", type=float,
+                        help="With 'run', hold the ports as leases of this many seconds, "
+                             "renewed while the command runs")
+    parser.add_argument("--no-handoff", action="store_true",
+                        help="With 'run', pass only the port numbers, for commands that bind "
+                             "the ports themselves")
+
+    # `portkeeper run [options] -- command ...`: everything after the first '--' is the command
+    argv = sys.argv[1:]
+    command = []
+    if '--' in argv:
+        command = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        sys.exit(_status(_registry(args), args))
+    if args.command == "release":
+        sys.exit(_release(_registry(args), args))
+    if args.command == "run":
+        sys.exit(_run(_registry(args, strategy=args.strategy), args, command))
+
+    if args.command == "migrate":
+        from .storage import DEFAULT_REGISTRY, JsonBackend, migrate
+        source_path = args.source or DEFAULT_REGISTRY
+        if not os.path.isfile(source_path):
+            print(f"❌ No JSON registry to migrate at {source_path}", file=sys.stderr)
+            sys.exit(1)
+        target = _registry(args, backend=args.backend or "sqlite")
+        source = JsonBackend(source_path, target.lock_path, create=False)
+        count = migrate(source, target.backend)
+        print(f"✅ Migrated {count} reservation(s) from {source.path} to {target.registry_path}")
+        return
+
+    registry = _registry(args, strategy=args.strategy)
 
-    args = parser.parse_args()
+    if args.command == "metrics":
+        print(_metrics_text(registry, args.metrics_file), end='')
+        return
 
-    registry = PortRegistry(registry_path=args.registry, lock_path=args.lock)
+    if args.command == "gc":
+        removed = registry.gc(check_pids=not args.no_pid_check)
+        for key in removed:
+            print(f"🗑️ {key}")
+        print(f"✅ Removed {len(removed)} dead lease(s)")
+        return
 
     if args.command == "reserve":
-        port_range = None
-        if args.range:
-            try:
-                start, end = map(int, args.range.split('-'))
-                port_range = (start, end)
-            except ValueError:
-                print(f"❌ Invalid range format: {args.range}. Use 'start-end'.")
-                sys.exit(1)
-
-        registry = PortRegistry(args.registry, args.lock)
         try:
+            port_range = _parse_range(args.range)
+        except ValueError:
+            print(f"❌ Invalid range format: {args.range}. Use 'start-end'.")
+            sys.exit(1)
+
+        host = args.host or "127.0.0.1"
+        try:
+            if args.block:
+                block = registry.reserve_block(args.block, port_range=port_range, host=host,
+                                               align=args.align, hold=args.hold, owner=args.owner,
+                                               label=args.label)
+                print(f"✅ Reserved ports {block[0].port}-{block[-1].port} on {block[0].host}")
+                return
             reservation = registry.reserve(
                 port_range=port_range,
-                host=args.host,
+                host=host,
                 hold=args.hold,
                 owner=args.owner,
-                preferred=args.port
+                preferred=args.port,
+                label=args.label,
             )
             print(f"✅ Reserved port {reservation.port} on {reservation.host}")
             if reservation.held:
                 print("🔒 Port is held open with a socket")
-            print(f"Use 'portkeeper release' to release this port.")
+            print("Use 'portkeeper release' to release this port.")
         except Exception as e:
             print(f"❌ Failed to reserve port: {str(e)}", file=sys.stderr)
             sys.exit(1)
 
-    elif args.command == "release":
-        # This is a placeholder; actual release logic would need to track reservations
-        print("⚠️ Release functionality is not fully implemented in CLI mode.")
-        print("Please ensure you have a reservation to release.")
-        sys.exit(1)
-
-    elif args.command == "status":
-        # This is a placeholder; actual status logic would need to read the registry
-        print("⚠️ Status functionality is not fully implemented in CLI mode.")
-        print("Check the registry file for current reservations.")
-        sys.exit(1)
-
 if __name__ == "__main__":
     main()
@@ -1,204 +1,771 @@
 from __future__ import annotations
 
+import fnmatch
 import json
 import os
 import socket
 import time
-from dataclasses import dataclass
+import weakref
+from contextlib import closing
 from pathlib import Path
-from typing import Dict, Optional, Tuple, Iterator, List, Set, Union
-import threading
-import queue
-import ipaddress
-from typing import List, Tuple, Dict, Optional
-
-# Cross-platform locking
-try:
-    import fcntl  # type: ignore
-    _HAS_FCNTL = True
-except Exception:
-    _HAS_FCNTL = False
-
-try:
-    import msvcrt  # type: ignore
-    _HAS_MSVCRT = True
-except Exception:
-    _HAS_MSVCRT = False
-
-DEFAULT_REGISTRY = os.environ.get("PORTKEEPER_REGISTRY", ".port_registry.json")
-DEFAULT_LOCKFILE = os.environ.get("PORTKEEPER_LOCK", ".port_registry.lock")
+from typing import Iterable, Iterator
+
+from . import metrics
+from .cache import DEFAULT_SCAN_CACHE, ScanCache
+from .errors import PortKeeperError
+from .index import MAX_PORT, PortIndex, split_entry
+from .intervals import FreeIntervals
+from .kernel import KernelPortTable
+from .leases import LeaseKeeper, is_dead, lease_fields
+from .pool import DEFAULT_POOL_SIZE, PortPool
+from .scanner import CLOSED, DEFAULT_CONCURRENCY, OPEN, Scanner, ScanResult, address_family
+from .storage import DEFAULT_LOCKFILE, RegistryBackend, open_backend
+from .strategies import AllocationStrategy, get_strategy
+
 DEFAULT_HOST = os.environ.get("PORTKEEPER_HOST", "127.0.0.1")
 DEFAULT_PORT_RANGE = (1024, 65535)
+DEFAULT_SOCKET = os.environ.get("PORTKEEPER_SOCKET", ".portkeeperd.sock")
+# Seconds to use the backend directly after the daemon socket did not answer, before trying it again
+DAEMON_RETRY_INTERVAL = float(os.environ.get("PORTKEEPER_DAEMON_RETRY", "5"))
+DEFAULT_SCAN_CANDIDATES = 32
 
 
-class PortKeeperError(Exception):
-    pass
+def _entry_filter(host: str | None = None, owner: str | None = None,
+                  older_than: float | None = None, newer_than: float | None = None,
+                  now: float | None = None, label: str | None = None):
+    """Predicate on ``(key, entry)`` for the status and release filters.
+
+    An entry matches if it is on ``host``, its owner matches the glob
+    ``owner``, it has ``label`` and its age in seconds is within
+    ``older_than`` and ``newer_than``.
+    """
+    now = time.time() if now is None else now
+
+    def matches(key: str, entry: dict) -> bool:
+        if host is not None and str(entry.get('host', key.rpartition(':')[0])) != host:
+            return False
+        if owner is not None and not fnmatch.fnmatchcase(str(entry.get('owner') or ''), owner):
+            return False
+        if label is not None and entry.get('label') != label:
+            return False
+        age = now - float(entry.get('timestamp') or 0)
+        if older_than is not None and age < older_than:
+            return False
+        return newer_than is None or age <= newer_than
+    return matches
 
 
-@dataclass
 class Reservation:
-    host: str
-    port: int
-    held: bool = False
-    _holder_socket: Optional[socket.socket] = None
-
-
-class FileLock:
-    def __init__(self, path: str):
-        self.path = path
-        self.fd = None
-
-    def __enter__(self):
-        open(self.path, 'a').close()
-        if _HAS_FCNTL:
-            self.fd = open(self.path, 'r+')
-            fcntl.flock(self.fd.fileno(), fcntl.LOCK_EX)
-        elif _HAS_MSVCRT:
-            self.fd = open(self.path, 'r+')
-            msvcrt.locking(self.fd.fileno(), msvcrt.LK_LOCK, 1)
-        else:
-            # Fallback lock file
-            while True:
-                try:
-                    self.fd = os.open(self.path + '.lck', os.O_CREAT | os.O_EXCL | os.O_RDWR)
-                    break
-                except FileExistsError:
-                    time.sleep(0.05)
-        return self
+    # A plain class rather than a dataclass: importing dataclasses (and inspect) costs
+    # more than the rest of the CLI's cold start.
 
-    def __exit__(self, exc_type, exc, tb):
-        try:
-            if _HAS_FCNTL and self.fd:
-                fcntl.flock(self.fd.fileno(), fcntl.LOCK_UN)
-                self.fd.close()
-            elif _HAS_MSVCRT and self.fd:
-                msvcrt.locking(self.fd.fileno(), msvcrt.LK_UN, 1)
-                self.fd.close()
-            else:
-                if self.fd:
-                    os.close(self.fd)
-                    try:
-                        os.remove(self.path + '.lck')
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+    def __init__(self, host: str, port: int, held: bool = False,
+                 _holder_socket: socket.socket | None = None,
+                 ttl: float | None = None, expires: float | None = None):
+        self.host = host
+        self.port = port
+        self.held = held
+        self._holder_socket = _holder_socket
+        self.ttl = ttl
+        self.expires = expires
+
+    def _fields(self) -> tuple:
+        return (self.host, self.port, self.held, self._holder_socket, self.ttl, self.expires)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None  # mutable, like the dataclass it replaces
+
+    def __repr__(self) -> str:
+        return (f"Reservation(host={self.host!r}, port={self.port!r}, held={self.held!r}, "
+                f"_holder_socket={self._holder_socket!r}, ttl={self.ttl!r}, "
+                f"expires={self.expires!r})")
 
 
 class PortRegistry:
     """Registry tracking reserved ports; updates .env and config.json atomically."""
 
-    def __init__(self, registry_path: Optional[str] = None, lock_path: Optional[str] = None):
-        self.registry_path = Path(registry_path or DEFAULT_REGISTRY)
+    def __init__(self, registry_path: str | None = None, lock_path: str | None = None,
+                 backend: str | RegistryBackend | None = None, daemon: bool | str | None = None,
+                 scan_cache: ScanCache | None = None,
+                 strategy: str | AllocationStrategy | None = None):
+        """
+        ``backend`` selects the storage: 'json' (default, or $PORTKEEPER_BACKEND),
+        'journal', 'sqlite', 'sharded' (per-host, per-port-block files in
+        ``<registry_path>.d``), 'bitmap' (memory-mapped per-host bitmaps) or a
+        RegistryBackend instance. ``registry_path`` is the file the backend
+        stores the registry in.
+
+        While a portkeeperd serving this same registry file listens on the
+        socket (``daemon`` path, or $PORTKEEPER_SOCKET), reserve/release/status/scan
+        go through the daemon instead; a daemon serving another registry is
+        ignored. Pass ``daemon=False`` to always use the backend directly.
+
+        Network scan results are kept in ``scan_cache``; by default a private
+        in-memory cache, or one shared through $PORTKEEPER_SCAN_CACHE if set.
+
+        ``strategy`` picks the order free ports are tried in: 'first-fit'
+        (default, or $PORTKEEPER_STRATEGY), 'next-fit', 'random', 'hashed'
+        (by owner) or an AllocationStrategy instance.
+        """
         self.lock_path = lock_path or DEFAULT_LOCKFILE
-        if not self.registry_path.exists():
-            self._write_registry({})
-        self._network_scan_cache = {}
+        if isinstance(backend, RegistryBackend):
+            self.backend = backend
+        else:
+            self.backend = open_backend(backend, registry_path, self.lock_path)
+        self.registry_path = Path(self.backend.path)
+        if daemon is False:
+            self.socket_path = None
+        else:
+            self.socket_path = daemon if isinstance(daemon, str) else DEFAULT_SOCKET
+        self._client = None
+        self._daemon_retry_at = 0.0
+        self.scan_cache = scan_cache or ScanCache(path=DEFAULT_SCAN_CACHE)
+        self.strategy = get_strategy(strategy, str(self.registry_path))
+        self._pools: dict[tuple[str, tuple[int, int]], PortPool] = {}
+        # host:port -> socket this registry bound to hold it, so bulk releases can close them
+        self._held: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
 
     # --- registry helpers ---
-    def _read_registry(self) -> Dict[str, Dict]:
-        if not self.registry_path.exists():
-            return {}
-        try:
-            with open(self.registry_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return {}
-
-    def _write_registry(self, data: Dict[str, Dict]):
-        tmp = Path(str(self.registry_path) + '.tmp')
-        with open(tmp, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        os.replace(tmp, self.registry_path)
+    def _read_registry(self) -> dict[str, dict]:
+        return self.backend.read()
+
+    def _daemon(self):
+        """Client for a running portkeeperd serving this registry, or None to use the backend."""
+        if not self.socket_path or not os.path.exists(self.socket_path):
+            return None
+        if self._client is not None and self._client._sock is None:
+            # Its last request lost the connection: check the daemon is back before using it again
+            self._client = None
+        if self._client is None:
+            if time.monotonic() < self._daemon_retry_at:
+                return None
+            from .daemon import DaemonClient
+            client = DaemonClient(self.socket_path)
+            try:
+                served = client.request('ping').get('registry')
+            except (ConnectionError, PortKeeperError):
+                # e.g. a socket file left behind by a daemon that died: don't knock on it every call
+                client.close()
+                self._daemon_retry_at = time.monotonic() + DAEMON_RETRY_INTERVAL
+                return None
+            if served is None or served != os.path.realpath(str(self.registry_path)):
+                # Its in-memory copy is of another registry: going through it would mix the two up
+                client.close()
+                self.socket_path = None
+                return None
+            self._client = client
+        return self._client
+
+    def _claim(self, host: str, port: int, owner: str | None = None, force: bool = False) -> bool:
+        """Record host:port unless it is already reserved (or regardless, with force)."""
+        client = self._daemon()
+        if client is not None:
+            try:
+                return client.request('claim', host=host, port=port, owner=owner,
+                                      force=force)['claimed']
+            except ConnectionError:
+                pass  # daemon went away; fall back to the registry file
+        def claim(txn) -> bool:
+            if not force and txn.index.is_reserved(host, port):
+                return False
+            txn.put(f"{host}:{port}", self._make_entry(Reservation(host, port), owner))
+            return True
+        return self.backend.update(claim)
 
     def _is_port_free(self, host: str, port: int) -> bool:
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s = socket.socket(address_family(host), socket.SOCK_STREAM)
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind((host, port))
             s.close()
             return True
         except OSError:
+            metrics.inc('portkeeper_bind_failures_total')
             return False
 
-    def _find_free_port(self, port_range: Tuple[int, int], host: str, used_ports: Optional[Set[int]] = None) -> Optional[int]:
+    def _kernel_used_ports(self, host: str) -> frozenset[int]:
+        """Ports bound on host according to the kernel socket table; empty where unavailable."""
+        table = KernelPortTable.load(('tcp', 'tcp6'))
+        return table.used_ports(host) if table else frozenset()
+
+    def _resolve_strategy(self, strategy: str | AllocationStrategy | None) -> AllocationStrategy:
+        if strategy is None or strategy == self.strategy.name:
+            return self.strategy
+        return get_strategy(strategy, str(self.registry_path))
+
+    def _iter_free_ports(self, port_range: tuple[int, int], host: str, index: PortIndex,
+                         kernel_ports: frozenset[int], strategy: AllocationStrategy | None = None,
+                         owner: str | None = None,
+                         probes: list[int] | None = None) -> Iterator[int]:
+        """Yield ports in range that are unreserved, unbound and pass a bind probe, by strategy.
+
+        ``probes[0]``, if given, is incremented for every bind probe made.
+        """
+        for port in (strategy or self.strategy).candidates(index, host, port_range, owner):
+            if port in kernel_ports:
+                continue
+            if probes is not None:
+                probes[0] += 1
+            # Verify the port is actually free on the system
+            if self._is_port_free(host, port):
+                yield port
+
+    def _find_free_port(self, port_range: tuple[int, int], host: str,
+                        used_ports: set[int] | None = None, index: PortIndex | None = None,
+                        kernel_ports: frozenset[int] | None = None) -> int | None:
         """Find a free port in the given range that's not currently reserved or used."""
-        start, end = port_range
         used_ports = used_ports or set()
-        # First, try to find a port that was previously released and can be reused
-        for port in range(start, end + 1):
-            if port in used_ports:
-                continue
-            key = f"{host}:{port}"
-            registry = self._read_registry()
-            if key not in registry:
-                # Verify the port is actually free on the system
-                if self._is_port_free(host, port):
-                    return port
+        if index is None:
+            index = PortIndex.from_registry(self._read_registry())
+        if kernel_ports is None:
+            kernel_ports = self._kernel_used_ports(host)
+        for port in self._iter_free_ports(port_range, host, index, kernel_ports):
+            if port not in used_ports:
+                return port
         # If no free port is found, return None
         return None
 
+    def _pick_ports(self, index: PortIndex, port_range: tuple[int, int], host: str, count: int,
+                    preferred: int | None = None, strategy: AllocationStrategy | None = None,
+                    owner: str | None = None) -> list[int]:
+        """Pick count free ports against one index snapshot, marking them reserved in the index.
+
+        Raises PortKeeperError without side effects on the registry if fewer are available.
+        """
+        kernel_ports = self._kernel_used_ports(host)
+        ports: list[int] = []
+        probes = [0]
+        # Try preferred port first if specified
+        if (preferred is not None and not index.is_reserved(host, preferred)
+                and preferred not in kernel_ports):
+            probes[0] += 1
+            if self._is_port_free(host, preferred):
+                index.add(host, preferred)
+                ports.append(preferred)
+        # Fall back to normal port finding logic
+        candidates = self._iter_free_ports(port_range, host, index, kernel_ports, strategy, owner,
+                                           probes)
+        while len(ports) < count:
+            port = next(candidates, None)
+            if port is None:
+                metrics.observe('portkeeper_reserve_probes', probes[0])
+                raise PortKeeperError(f"Only {len(ports)} of {count} free ports in range "
+                                      f"{port_range[0]}-{port_range[1]} on {host}")
+            index.add(host, port)
+            ports.append(port)
+        metrics.observe('portkeeper_reserve_probes', probes[0])
+        return ports
+
+    def _make_entry(self, reservation: Reservation, owner: str | None = None,
+                    pid: int | None = None, label: str | None = None) -> dict:
+        now = time.time()
+        entry = {'host': reservation.host, 'port': reservation.port, 'owner': owner or '',
+                 'timestamp': now}
+        if label:
+            entry['label'] = label
+        if reservation.ttl:
+            entry.update(lease_fields(reservation.ttl, pid, now))
+            reservation.expires = entry['expires']
+        return entry
+
+    def _close_holders(self, reservations: list[Reservation]) -> None:
+        for reservation in reservations:
+            self._held.pop(f"{reservation.host}:{reservation.port}", None)
+            if reservation._holder_socket:
+                try:
+                    reservation._holder_socket.close()
+                except Exception:
+                    pass
+                reservation._holder_socket = None
+            reservation.held = False
+
+    @staticmethod
+    def _check_request(count: int, preferred: int | None, ttl: float | None) -> None:
+        if count < 1:
+            raise PortKeeperError("Cannot reserve fewer than 1 port")
+        if preferred is not None and not 0 < preferred <= MAX_PORT:
+            raise PortKeeperError(f"Invalid preferred port: {preferred}")
+        if ttl is not None and ttl <= 0:
+            raise PortKeeperError(f"Invalid lease ttl: {ttl}")
+
     # --- public API ---
-    def reserve(self, port_range: Optional[Tuple[int, int]] = None, 
-               host: str = DEFAULT_HOST, hold: bool = False, 
-               owner: Optional[str] = None, count: int = 1,
-               preferred: Optional[int] = None):
+    def reserve(self, port_range: tuple[int, int] | None = None,
+               host: str = DEFAULT_HOST, hold: bool = False,
+               owner: str | None = None, count: int = 1,
+               preferred: int | None = None, ttl: float | None = None,
+               strategy: str | AllocationStrategy | None = None, label: str | None = None):
         """
         Reserve one or more ports, with optional preferred port.
         Returns a single Reservation object if count=1, or a list if count>1.
+
+        ``label`` is recorded with the reservations, e.g. to name the test
+        environment they belong to; see find() and release_many().
+
+        All ports are picked under one lock against one registry snapshot and
+        written in a single registry write: either every reservation is
+        committed or none is.
+
+        With ``ttl`` the reservations are leases: they expire ``ttl`` seconds
+        after the last renew() (see keep_alive()) or once this process exits,
+        and gc() removes them.
+
+        ``strategy`` overrides the registry's allocation strategy for this call.
+
+        Single-port requests for a host and range with a pool (see pool()) are
+        served from the pool when it has a port ready.
         """
-        if count < 1:
-            raise PortKeeperError("Cannot reserve fewer than 1 port")
-            
-        with FileLock(self.lock_path):
-            registry = self._read_registry()
-            host_key = str(ipaddress.ip_address(host))
-            used_ports = {int(p) for p in registry.get(host_key, {}).keys()}
-            
-            # Try preferred port first if specified
-            if preferred is not None:
-                if preferred not in used_ports and self._is_port_free(host, preferred):
-                    reservation = Reservation(host, preferred, hold)
-                    if hold:
-                        self._hold_port(host, preferred)
-                    self._add_to_registry(reservation, owner)
-                    return [reservation] if count == 1 else [reservation] + \
-                        self.reserve(port_range, host, hold, owner, count-1, preferred=None)
-            
-            # Fall back to normal port finding logic
-            port = self._find_free_port(port_range or DEFAULT_PORT_RANGE, host, used_ports)
-            reservation = Reservation(host, port, hold)
-            if hold:
-                self._hold_port(host, port)
-            self._add_to_registry(reservation, owner)
-            
-            if count == 1:
+        self._check_request(count, preferred, ttl)
+        began = time.perf_counter()
+        if (self._pools and count == 1 and preferred is None and ttl is None and strategy is None
+                and label is None):
+            pool = self._pools.get((host, tuple(port_range or DEFAULT_PORT_RANGE)))
+            reservation = pool.take(hold, owner) if pool is not None else None
+            if reservation is not None:
+                metrics.observe('portkeeper_reserve_seconds', time.perf_counter() - began,
+                                path='pool')
                 return reservation
-            else:
-                return [reservation] + self.reserve(port_range, host, hold, owner, count-1)
+        client = self._daemon()
+        if client is not None:
+            try:
+                result = self._reserve_remote(client, port_range, host, hold, owner, count,
+                                              preferred, ttl, strategy, label)
+                metrics.observe('portkeeper_reserve_seconds', time.perf_counter() - began,
+                                path='daemon')
+                return result
+            except ConnectionError:
+                pass  # daemon went away; fall back to the registry file
+        result = self._reserve_local(port_range, host, hold, owner, count, preferred, ttl,
+                                     strategy=strategy, label=label)
+        metrics.observe('portkeeper_reserve_seconds', time.perf_counter() - began, path='local')
+        return result
+
+    def _reserve_local(self, port_range: tuple[int, int] | None, host: str, hold: bool,
+                       owner: str | None, count: int, preferred: int | None,
+                       ttl: float | None = None, pid: int | None = None,
+                       strategy: str | AllocationStrategy | None = None, label: str | None = None):
+        # A preferred port outside an explicit range is ignored
+        if (preferred is not None and port_range is not None
+                and not port_range[0] <= preferred <= port_range[1]):
+            preferred = None
+        port_range = port_range or DEFAULT_PORT_RANGE
+        strategy = self._resolve_strategy(strategy)
+
+        reservations: list[Reservation] = []
+
+        def allocate(txn) -> None:
+            # Runs again if another writer committed first; drop what the previous attempt held
+            self._close_holders(reservations)
+            reservations[:] = [Reservation(host, port, hold, ttl=ttl)
+                               for port in self._pick_ports(txn.index, port_range, host, count,
+                                                            preferred, strategy, owner)]
+            if hold:
+                for reservation in reservations:
+                    reservation._holder_socket = self._hold_port(host, reservation.port)
+            for reservation in reservations:
+                txn.put(f"{host}:{reservation.port}",
+                        self._make_entry(reservation, owner, pid, label))
+
+        try:
+            self.backend.update(allocate)
+        except OSError as e:
+            self._close_holders(reservations)
+            raise PortKeeperError(f"Failed to reserve {count} port(s) on {host}: {e}") from e
+        except BaseException:
+            self._close_holders(reservations)
+            raise
+        # Once per committed batch, so retried attempts never move a strategy's cursor
+        strategy.allocated(host, port_range, reservations[-1].port)
+
+        return reservations[0] if count == 1 else reservations
+
+    def _reserve_remote(self, client, port_range: tuple[int, int] | None, host: str, hold: bool,
+                        owner: str | None, count: int, preferred: int | None,
+                        ttl: float | None = None, strategy: str | AllocationStrategy | None = None,
+                        label: str | None = None):
+        # Strategy instances stay local; the daemon applies its own default unless given a name
+        strategy_name = strategy.name if isinstance(strategy, AllocationStrategy) else strategy
+        response = client.request('reserve', port_range=list(port_range) if port_range else None,
+                                  host=host, owner=owner, count=count, preferred=preferred,
+                                  ttl=ttl, pid=os.getpid(), strategy=strategy_name, label=label)
+        reservations = [Reservation(response['host'], port, hold, ttl=ttl,
+                                    expires=response.get('expires'))
+                        for port in response['ports']]
+        if hold:
+            self._hold_remote(client, reservations)
+        return reservations[0] if count == 1 else reservations
+
+    def _hold_remote(self, client, reservations: list[Reservation]) -> None:
+        """Bind ports the daemon reserved for us, giving them all back if one cannot be held."""
+        try:
+            for reservation in reservations:
+                reservation._holder_socket = self._hold_port(reservation.host, reservation.port)
+        except OSError as e:
+            self._close_holders(reservations)
+            for reservation in reservations:
+                client.request('release', host=reservation.host, port=reservation.port)
+            raise PortKeeperError(f"Failed to hold {len(reservations)} port(s) on "
+                                  f"{reservations[0].host}: {e}") from e
+
+    def _pick_block(self, index: PortIndex, port_range: tuple[int, int], host: str, length: int,
+                    align: int = 1) -> int:
+        """First port of ``length`` consecutive free ports in one index snapshot, reserved in it."""
+        intervals = FreeIntervals.from_index(index, host, port_range, self._kernel_used_ports(host))
+        while True:
+            first = intervals.find(length, align)
+            if first is None:
+                aligned = f" aligned to {align}" if align > 1 else ""
+                raise PortKeeperError(f"No block of {length} free consecutive ports{aligned} "
+                                      f"in range {port_range[0]}-{port_range[1]} on {host}")
+            busy = next((port for port in range(first, first + length)
+                         if not self._is_port_free(host, port)), None)
+            if busy is None:
+                for port in range(first, first + length):
+                    index.add(host, port)
+                return first
+            intervals.take(busy, 1)  # bound outside the registry; look elsewhere
+
+    def reserve_block(self, length: int, port_range: tuple[int, int] | None = None,
+                      host: str = DEFAULT_HOST, align: int = 1, hold: bool = False,
+                      owner: str | None = None, ttl: float | None = None,
+                      label: str | None = None) -> list[Reservation]:
+        """
+        Reserve ``length`` consecutive ports whose first port is a multiple of ``align``.
+
+        The block is taken from the smallest run of free ports in the range
+        that fits it (found by bisection over the free runs, not port by
+        port) and committed in a single registry write: either the whole
+        block is reserved or none of it. Returns the reservations in port order.
+        """
+        self._check_request(length, None, ttl)
+        if align < 1:
+            raise PortKeeperError(f"Invalid block alignment: {align}")
+        client = self._daemon()
+        if client is not None:
+            try:
+                response = client.request('reserve_block', length=length,
+                                          port_range=list(port_range) if port_range else None,
+                                          host=host, align=align, owner=owner, ttl=ttl,
+                                          pid=os.getpid(), label=label)
+                reservations = [Reservation(response['host'], port, hold, ttl=ttl,
+                                            expires=response.get('expires'))
+                                for port in response['ports']]
+                if hold:
+                    self._hold_remote(client, reservations)
+                return reservations
+            except ConnectionError:
+                pass  # daemon went away; fall back to the registry file
+        return self._reserve_block_local(length, port_range, host, align, hold, owner, ttl,
+                                         label=label)
+
+    def _reserve_block_local(self, length: int, port_range: tuple[int, int] | None, host: str,
+                             align: int, hold: bool, owner: str | None, ttl: float | None = None,
+                             pid: int | None = None, label: str | None = None) -> list[Reservation]:
+        port_range = port_range or DEFAULT_PORT_RANGE
+        reservations: list[Reservation] = []
+
+        def allocate(txn) -> None:
+            self._close_holders(reservations)
+            first = self._pick_block(txn.index, port_range, host, length, align)
+            reservations[:] = [Reservation(host, port, hold, ttl=ttl)
+                               for port in range(first, first + length)]
+            if hold:
+                for reservation in reservations:
+                    reservation._holder_socket = self._hold_port(host, reservation.port)
+            for reservation in reservations:
+                txn.put(f"{host}:{reservation.port}",
+                        self._make_entry(reservation, owner, pid, label))
+
+        try:
+            self.backend.update(allocate)
+        except OSError as e:
+            self._close_holders(reservations)
+            raise PortKeeperError(
+                f"Failed to reserve a block of {length} port(s) on {host}: {e}") from e
+        except BaseException:
+            self._close_holders(reservations)
+            raise
+        return reservations
 
     def release(self, reservation: Reservation) -> None:
         key = f"{reservation.host}:{reservation.port}"
-        with FileLock(self.lock_path):
-            registry = self._read_registry()
-            if key in registry:
-                del registry[key]
-                self._write_registry(registry)
+        began = time.perf_counter()
+        released = False
+        client = self._daemon()
+        if client is not None:
+            try:
+                client.request('release', host=reservation.host, port=reservation.port)
+                released = True
+            except ConnectionError:
+                pass  # daemon went away; fall back to the registry file
+        if not released:
+            self.backend.update(lambda txn: txn.delete(key))
+        self._close_holders([reservation])
+        metrics.observe('portkeeper_release_seconds', time.perf_counter() - began)
+
+    def _release_many_local(self, keys: list[str], owner: str | None = None, pid: int | None = None,
+                            label: str | None = None) -> list[str]:
+        def release(txn) -> list[str]:
+            chosen = dict.fromkeys(keys)
+            chosen.update(dict.fromkeys(txn.find(owner=owner, pid=pid, label=label)))
+            return [key for key in chosen if txn.delete(key)]
+        return self.backend.update(release)
+
+    def release_many(self, reservations: Iterable[Reservation] | None = None,
+                     owner: str | None = None, pid: int | None = None,
+                     label: str | None = None) -> list[str]:
+        """
+        Release ``reservations`` plus every reservation with the given ``owner``, ``pid`` and
+        ``label`` (each one given must match) in one transaction: one registry write however
+        many there are. Sockets this registry holds for the released ports are closed.
+        Returns the released ``host:port`` keys.
+        """
+        reservations = list(reservations or [])
+        keys = [f"{r.host}:{r.port}" for r in reservations]
+        if not keys and owner is None and pid is None and label is None:
+            return []
+        began = time.perf_counter()
+        released = None
+        client = self._daemon()
+        if client is not None:
+            try:
+                released = client.request('release_many', keys=keys, owner=owner, pid=pid,
+                                          label=label)['released']
+            except ConnectionError:
+                pass
+        if released is None:
+            released = self._release_many_local(keys, owner, pid, label)
+        self._close_holders(reservations)
+        for key in released:
+            sock = self._held.pop(key, None)
+            if sock is not None:
+                sock.close()
+        metrics.observe('portkeeper_release_seconds', time.perf_counter() - began)
+        return released
+
+    def _settle_local(self, keys: list[str], owner: str | None = None) -> int:
+        now = time.time()
+
+        def settle(txn) -> int:
+            settled = 0
+            for key in keys:
+                entry = txn.get(key)
+                if entry is None or entry.get('expires') is None:
+                    continue  # released (or collected) since it was handed out
+                txn.put(key, {'host': entry['host'], 'port': entry['port'], 'owner': owner or '',
+                              'timestamp': now})
+                settled += 1
+            return settled
+        return self.backend.update(settle)
+
+    def _settle(self, reservations: list[Reservation], owner: str | None = None) -> int:
+        """Turn the pool leases of handed-out ``reservations`` into reservations of ``owner``."""
+        keys = [f"{r.host}:{r.port}" for r in reservations]
+        client = self._daemon()
+        if client is not None:
+            try:
+                return client.request('settle', keys=keys, owner=owner)['settled']
+            except ConnectionError:
+                pass
+        return self._settle_local(keys, owner)
+
+    def _renew_local(self, keys: list[str], ttl: float | None = None) -> dict[str, float]:
+        now = time.time()
+
+        def extend(txn) -> dict[str, float]:
+            renewed: dict[str, float] = {}
+            for key in keys:
+                entry = txn.get(key)
+                if entry is None or entry.get('expires') is None:
+                    continue
+                lease_ttl = ttl or entry.get('ttl')
+                txn.put(key, dict(entry, ttl=lease_ttl, expires=now + lease_ttl))
+                renewed[key] = now + lease_ttl
+            return renewed
+        return self.backend.update(extend)
+
+    def renew(self, reservations: list[Reservation], ttl: float | None = None) -> int:
+        """
+        Extend the leases of ``reservations`` by their ttl (or ``ttl``) from now, in one
+        transaction. Returns how many were renewed; leases gc() already collected stay gone.
+        """
+        keys = [f"{r.host}:{r.port}" for r in reservations]
+        client = self._daemon()
+        renewed = None
+        if client is not None:
+            try:
+                renewed = client.request('renew', keys=keys, ttl=ttl)['renewed']
+            except ConnectionError:
+                pass
+        if renewed is None:
+            renewed = self._renew_local(keys, ttl)
+        for reservation in reservations:
+            expires = renewed.get(f"{reservation.host}:{reservation.port}")
+            if expires is not None:
+                reservation.expires = expires
+                reservation.ttl = ttl or reservation.ttl
+        return len(renewed)
+
+    def keep_alive(self, reservations: Reservation | list[Reservation],
+                   interval: float | None = None) -> LeaseKeeper:
+        """Start a heartbeat thread renewing ``reservations`` until its stop() is called."""
+        if not isinstance(reservations, list):
+            reservations = [reservations]
+        keeper = LeaseKeeper(self, reservations, interval)
+        keeper.start()
+        return keeper
+
+    def pool(self, port_range: tuple[int, int] | None = None, host: str = DEFAULT_HOST,
+             size: int = DEFAULT_POOL_SIZE, **kwargs) -> PortPool:
+        """
+        Start a PortPool keeping ``size`` verified ports of ``port_range`` on ``host`` ready.
+
+        reserve() then hands single ports of that host and range out of the
+        pool without probing; see PortPool for ``low_water``, ``hold``,
+        ``interval`` and ``ttl``. Call the pool's stop() (or use it as a
+        context manager) to release the ports it still holds.
+        """
+        key = (host, tuple(port_range or DEFAULT_PORT_RANGE))
+        if key in self._pools:
+            raise PortKeeperError(f"A pool for {host} {key[1][0]}-{key[1][1]} is already running")
+        pool = PortPool(self, key[1], host, size, **kwargs)
+        self._pools[key] = pool
         try:
-            if reservation._holder_socket:
-                try:
-                    reservation._holder_socket.close()
-                except Exception:
-                    pass
-            reservation.held = False
-        except Exception:
-            pass
+            return pool.start()
+        except BaseException:
+            pool.stop()
+            raise
+
+    def _gc_local(self, check_pids: bool = True) -> list[str]:
+        now = time.time()
+
+        def collect(txn) -> list[str]:
+            dead = [key for key, entry in txn.items() if is_dead(entry, now, check_pids)]
+            for key in dead:
+                txn.delete(key)
+            return dead
+        return self.backend.update(collect)
+
+    def gc(self, check_pids: bool = True) -> list[str]:
+        """
+        Remove every expired lease, and every lease whose process has exited, in one locked pass.
+        Reservations made without a ttl are kept. Returns the removed ``host:port`` keys.
+        """
+        client = self._daemon()
+        if client is not None:
+            try:
+                return client.request('gc', check_pids=check_pids)['removed']
+            except ConnectionError:
+                pass
+        return self._gc_local(check_pids)
+
+    def _settle_pools(self) -> None:
+        """Record ports our pools handed out under their new owners now, so lookups see them."""
+        for pool in list(self._pools.values()):
+            pool._settle()
+
+    def status(self) -> dict[str, dict]:
+        """Return all current reservations keyed by ``host:port``."""
+        self._settle_pools()
+        client = self._daemon()
+        if client is not None:
+            try:
+                return client.request('status')['entries']
+            except ConnectionError:
+                pass
+        return self._read_registry()
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> dict[str, dict]:
+        """Reservations with the given ``owner``, ``pid`` and ``label`` (each one given must match),
+        looked up through the backend's secondary indexes where it keeps them."""
+        self._settle_pools()
+        client = self._daemon()
+        if client is not None:
+            try:
+                return client.request('find', owner=owner, pid=pid, label=label)['entries']
+            except ConnectionError:
+                pass
+        return self.backend.find(owner=owner, pid=pid, label=label)
+
+    def iter_status(self, host: str | None = None, owner: str | None = None,
+                    older_than: float | None = None, newer_than: float | None = None,
+                    label: str | None = None) -> Iterator[tuple[str, dict]]:
+        """
+        Yield ``(host:port, entry)`` for current reservations, streamed from the backend
+        rather than read into memory at once. Only those on ``host``, whose owner matches
+        the glob ``owner``, with ``label``, and made at least ``older_than`` / at most
+        ``newer_than`` seconds ago are included.
+        """
+        self._settle_pools()
+        client = self._daemon()
+        if client is not None:
+            try:
+                entries = client.request('status', host=host, owner=owner, older_than=older_than,
+                                         newer_than=newer_than, label=label)['entries']
+            except ConnectionError:
+                pass
+            else:
+                yield from entries.items()
+                return
+        matches = _entry_filter(host, owner, older_than, newer_than, label=label)
+        for key, entry in self.backend.iter_entries(host):
+            if matches(key, entry):
+                yield key, entry
+
+    def _release_matching_local(self, host: str | None = None, port: int | None = None,
+                                owner: str | None = None, pattern: str | None = None,
+                                label: str | None = None) -> list[str]:
+        matches = _entry_filter(host, owner, label=label)
+
+        def release(txn) -> list[str]:
+            if host is not None and port is not None:
+                key = f"{host}:{port}"  # one lookup instead of a scan
+                entry = txn.get(key)
+                candidates = [] if entry is None else [(key, entry)]
+            elif label is not None:
+                candidates = [(key, txn.get(key)) for key in txn.find(label=label)]
+            else:
+                candidates = list(txn.items())
+            released = []
+            for key, entry in candidates:
+                if not matches(key, entry):
+                    continue
+                if port is not None and split_entry(key, entry)[1] != port:
+                    continue
+                if pattern is not None and not fnmatch.fnmatchcase(key, pattern):
+                    continue
+                txn.delete(key)
+                released.append(key)
+            return released
+        return self.backend.update(release)
+
+    def release_matching(self, host: str | None = None, port: int | None = None,
+                         owner: str | None = None, pattern: str | None = None,
+                         label: str | None = None) -> list[str]:
+        """
+        Release every reservation on ``host``, of ``port``, whose owner matches the glob
+        ``owner``, whose ``host:port`` key matches the glob ``pattern`` and with ``label``,
+        in one locked pass. At least one criterion is required. Returns the released keys.
+        """
+        if host is None and port is None and owner is None and pattern is None and label is None:
+            raise PortKeeperError("Refusing to release every reservation: "
+                                  "give a host, port, owner, pattern or label")
+        client = self._daemon()
+        if client is not None:
+            try:
+                return client.request('release_matching', host=host, port=port, owner=owner,
+                                      pattern=pattern, label=label)['released']
+            except ConnectionError:
+                pass
+        return self._release_matching_local(host, port, owner, pattern, label)
 
     # Context manager
     def reserve_context(self, *args, count: int = 1, **kwargs):
-        """Context manager for reserving one or more ports."""
+        """Context manager reserving one or more ports; leases (``ttl=...``) are renewed inside."""
         class _Ctx:
             def __init__(self, reg, args, kwargs, count):
                 self.reg = reg
@@ -206,10 +773,15 @@ class PortRegistry:
                 self.kwargs = kwargs
                 self.count = count
                 self.reservations = []
+                self.keeper = None
             def __enter__(self):
                 self.reservations = self.reg.reserve(*self.args, count=self.count, **self.kwargs)
-                return self.reservations if self.count > 1 else self.reservations[0] if self.reservations else None
+                if self.kwargs.get('ttl'):
+                    self.keeper = self.reg.keep_alive(self.reservations)
+                return self.reservations
             def __exit__(self, exc_type, exc, tb):
+                if self.keeper is not None:
+                    self.keeper.stop()
                 if self.reservations:
                     if isinstance(self.reservations, list):
                         for res in self.reservations:
@@ -219,11 +791,11 @@ class PortRegistry:
         return _Ctx(self, args, kwargs, count)
 
     # --- file helpers ---
-    def write_env(self, data: Dict[str, str], path: str = '.env', merge: bool = True) -> None:
+    def write_env(self, data: dict[str, str], path: str = '.env', merge: bool = True) -> None:
         p = Path(path)
-        env: Dict[str, str] = {}
+        env: dict[str, str] = {}
         if merge and p.exists():
-            with open(p, 'r', encoding='utf-8') as f:
+            with open(p, encoding='utf-8') as f:
                 for line in f:
                     line = line.strip()
                     if not line or line.startswith('#') or '=' not in line:
@@ -239,12 +811,13 @@ class PortRegistry:
             os.fsync(f.fileno())
         os.replace(tmp, p)
 
-    def update_config_json(self, changes: Dict, path: str = 'config.json', backup: bool = True) -> None:
+    def update_config_json(self, changes: dict, path: str = 'config.json',
+                           backup: bool = True) -> None:
         p = Path(path)
         data = {}
         if p.exists():
             try:
-                with open(p, 'r', encoding='utf-8') as f:
+                with open(p, encoding='utf-8') as f:
                     data = json.load(f)
             except Exception:
                 data = {}
@@ -260,19 +833,11 @@ class PortRegistry:
             os.fsync(f.fileno())
         os.replace(tmp, p)
 
-    def scan_local_network(self, port_range: Tuple[int, int] = (8000, 9000), timeout: float = 0.1) -> Dict[str, List[int]]:
-        """
-        Scan the local network for free ports on all available hosts within the specified port range.
-        Returns a dictionary mapping host IP addresses to lists of free ports.
-        """
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import netifaces
-
-        free_ports_by_host = {}
+    def _local_hosts(self) -> list[str]:
+        """Addresses of all local network interfaces (loopback only if they cannot be listed)."""
         local_hosts = []
-
-        # Get all local network interfaces and their IP addresses
         try:
+            import netifaces
             for iface in netifaces.interfaces():
                 addrs = netifaces.ifaddresses(iface)
                 for family in (netifaces.AF_INET, netifaces.AF_INET6):
@@ -284,75 +849,143 @@ class PortRegistry:
         except Exception as e:
             print(f"Warning: Could not enumerate local network interfaces: {e}")
             local_hosts = ['127.0.0.1']
+        return local_hosts
 
-        def scan_host_ports(host: str, start_port: int, end_port: int, timeout: float) -> Tuple[str, List[int]]:
-            free_ports = []
-            for port in range(start_port, end_port + 1):
-                try:
-                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    s.settimeout(timeout)
-                    result = s.connect_ex((host, port))
-                    if result != 0:  # Port is not in use
-                        free_ports.append(port)
-                    s.close()
-                except Exception:
-                    pass
-            return host, free_ports
-
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = []
+    def iter_scan_local_network(self, port_range: tuple[int, int] = (8000, 9000),
+                                timeout: float = 0.1,
+                                concurrency: int = DEFAULT_CONCURRENCY) -> Iterator[ScanResult]:
+        """
+        Yield (host, port, state) for every local host and port in range as results become
+        available. state is 'open' for ports in use and 'closed' or 'filtered' otherwise;
+        stop iterating to stop scanning.
+        """
+        client = self._daemon()
+        if client is not None:
+            try:
+                hosts = client.request('scan', port_range=list(port_range),
+                                       timeout=timeout)['hosts']
+            except ConnectionError:
+                pass
+            else:
+                for host, free_ports in hosts.items():
+                    for port in free_ports:
+                        yield host, port, CLOSED
+                return
+
+        local_hosts = self._local_hosts()
+        # Fast path: the hosts are local, so the kernel socket table answers for all of them at once
+        table = KernelPortTable.load(('tcp', 'tcp6'))
+        if table is not None:
             for host in local_hosts:
-                futures.append(executor.submit(scan_host_ports, host, port_range[0], port_range[1], timeout))
-
-            for future in as_completed(futures):
-                host, free_ports = future.result()
-                if free_ports:
-                    free_ports_by_host[host] = free_ports
-
-        self._network_scan_cache = free_ports_by_host
+                used = table.used_ports(host)
+                for port in range(port_range[0], port_range[1] + 1):
+                    yield host, port, OPEN if port in used else CLOSED
+            return
+
+        # Elsewhere, probe with many non-blocking connects in flight at once
+        scanner = Scanner(concurrency=concurrency, timeout=timeout)
+        with closing(scanner.iter_scan(local_hosts, port_range)) as results:
+            yield from results
+
+    def scan_local_network(self, port_range: tuple[int, int] = (8000, 9000), timeout: float = 0.1,
+                           concurrency: int = DEFAULT_CONCURRENCY) -> dict[str, list[int]]:
+        """
+        Scan the local network for free ports on all available hosts within the port range.
+        Returns a dictionary mapping host IP addresses to lists of free ports.
+        ``timeout`` bounds each connect probe; up to ``concurrency`` probes run at once.
+        """
+        free_ports_by_host: dict[str, list[int]] = {}
+        for host, port, state in self.iter_scan_local_network(port_range, timeout, concurrency):
+            if state != OPEN:
+                free_ports_by_host.setdefault(host, []).append(port)
+        for host, free_ports in free_ports_by_host.items():
+            free_ports.sort()
+            self.scan_cache.put(host, port_range, free_ports)
         return free_ports_by_host
 
-    def get_free_host_port(self, port_range: Tuple[int, int] = (8000, 9000), timeout: float = 0.1) -> Tuple[str, int]:
+    def _network_candidates(self, port_range: tuple[int, int], timeout: float, candidates: int,
+                            reserved: frozenset[str] = frozenset()) -> Iterator[tuple[str, int]]:
+        """
+        Free (host, port) pairs from the scan cache, scanning at most once to refill it.
+        A refill stops after ``candidates`` free ports; ports in ``reserved`` and ports
+        that have been bound since they were scanned are skipped.
+        """
+        refilled = False
+        while True:
+            hit = self.scan_cache.pop(port_range)
+            if hit is None:
+                if refilled:
+                    return
+                refilled = True
+                found: dict[str, list[int]] = {}
+                with closing(self.iter_scan_local_network(port_range, timeout)) as results:
+                    for host, port, state in results:
+                        if state == OPEN or f"{host}:{port}" in reserved:
+                            continue
+                        found.setdefault(host, []).append(port)
+                        candidates -= 1
+                        if candidates <= 0:
+                            break
+                for host, ports in found.items():
+                    self.scan_cache.put(host, port_range, sorted(ports))
+                continue
+            host, port = hit
+            if f"{host}:{port}" not in reserved and self._is_port_free(host, port):
+                yield host, port
+
+    def get_free_host_port(self, port_range: tuple[int, int] = (8000, 9000), timeout: float = 0.1,
+                           candidates: int = DEFAULT_SCAN_CANDIDATES) -> tuple[str, int]:
         """
         Find a free host and port combination in the local network.
         Returns a tuple of (host, port) that is available.
+        Ports come from the scan cache while it is fresh; otherwise scanning stops as
+        soon as ``candidates`` free ports are found and the extras are cached.
         """
-        if not self._network_scan_cache or not any(self._network_scan_cache.values()):
-            self.scan_local_network(port_range, timeout)
-
-        for host, ports in self._network_scan_cache.items():
-            if ports:
-                port = ports.pop(0)  # Take the first available port
-                return host, port
-
-        raise PortKeeperError(f"No free ports found in range {port_range[0]}-{port_range[1]} on local network hosts")
-
-    def reserve_network_port(self, port_range: Optional[Tuple[int, int]] = None, host: Optional[str] = None, hold: bool = False, owner: Optional[str] = None) -> Reservation:
+        for host, port in self._network_candidates(port_range, timeout, candidates):
+            return host, port
+        raise PortKeeperError(f"No free ports found in range {port_range[0]}-{port_range[1]} "
+                              "on local network hosts")
+
+    def reserve_network_port(self, port_range: tuple[int, int] | None = None,
+                             host: str | None = None, hold: bool = False,
+                             owner: str | None = None) -> Reservation:
         """
         Reserve a port on a specific host or any available host in the local network.
-        If host is not specified, it will find a free host and port combination.
+        If host is not specified, it will find a free host and port combination,
+        using cached scan results where possible.
         """
-        if host is None:
-            host, port = self.get_free_host_port(port_range or (8000, 9000))
+        if host is not None:
+            return self.reserve(port_range, host=host, hold=hold, owner=owner)
+
+        port_range = port_range or (8000, 9000)
+        reserved = frozenset(self.status())
+        for host, port in self._network_candidates(port_range, 0.1, DEFAULT_SCAN_CANDIDATES,
+                                                   reserved):
+            if self._claim(host, port, owner):
+                break
         else:
-            port = self._find_free_port(port_range or (1024, 65535), host)
-
+            raise PortKeeperError(f"No free ports found in range {port_range[0]}-{port_range[1]} "
+                                  "on local network hosts")
         reservation = Reservation(host=host, port=port, held=hold)
         if hold:
-            reservation._holder_socket = self._hold_port(host, port)
-        self._add_to_registry(reservation, owner=owner)
+            try:
+                reservation._holder_socket = self._hold_port(host, port)
+            except OSError as e:
+                self.release(reservation)
+                raise PortKeeperError(f"Failed to hold port {port} on {host}: {e}") from e
         return reservation
 
     def _hold_port(self, host: str, port: int) -> socket.socket:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((host, port))
-        sock.listen(1)
+        sock = socket.socket(address_family(host), socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+            sock.listen(1)
+        except OSError:
+            sock.close()
+            raise
+        self._held[f"{host}:{port}"] = sock
         return sock
 
-    def _add_to_registry(self, reservation: Reservation, owner: Optional[str] = None) -> None:
-        key = f"{reservation.host}:{reservation.port}"
-        with FileLock(self.lock_path):
-            registry = self._read_registry()
-            registry[key] = { 'host': reservation.host, 'port': reservation.port, 'owner': owner or '', 'timestamp': time.time() }
-            self._write_registry(registry)
+    def _add_to_registry(self, reservation: Reservation, owner: str | None = None) -> None:
+        self._claim(reservation.host, reservation.port, owner, force=True)
@@ -0,0 +1,379 @@
+"""portkeeperd: a local allocation daemon serving the registry from memory.
+
+Clients talk to it over a Unix domain socket using one JSON object per line,
+for example ``{"op": "reserve", "port_range": [8000, 9000], "count": 2}``,
+and get one JSON line back (``{"ok": true, ...}`` or ``{"ok": false, "error": ...}``).
+State changes are persisted asynchronously: commits that arrive within
+``flush_interval`` of each other are written to the backing registry together.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from . import metrics
+from .core import DEFAULT_HOST, DEFAULT_SOCKET, PortRegistry
+from .errors import PortKeeperError
+from .storage import MemoryBackend, RegistryBackend, open_backend
+from .strategies import STRATEGIES
+
+DEFAULT_FLUSH_INTERVAL = 0.05
+# Delay before retrying a batch the backing registry failed to persist, doubling up to the maximum
+COMMIT_RETRY_DELAY = 0.1
+COMMIT_RETRY_MAX_DELAY = 5.0
+
+
+class DaemonUnavailable(ConnectionError):
+    """The daemon socket exists but nobody is serving it."""
+
+
+class DaemonClient:
+    """Persistent connection to a running portkeeperd; safe to share between threads."""
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: socket.socket | None = None
+        self._rfile = None
+
+    def _connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise DaemonUnavailable(
+                f"portkeeperd is not listening on {self.socket_path}: {e}") from e
+        self._sock = sock
+        self._rfile = sock.makefile('rb')
+
+    def request(self, op: str, **params) -> dict:
+        """Send one request and return the decoded response; PortKeeperError on daemon errors."""
+        payload = (json.dumps(dict(params, op=op), separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._sock.sendall(payload)
+                line = self._rfile.readline()
+            except DaemonUnavailable:
+                raise
+            except OSError as e:
+                self.close()
+                raise DaemonUnavailable(f"Lost connection to portkeeperd: {e}") from e
+            if not line:
+                self.close()
+                raise DaemonUnavailable("portkeeperd closed the connection")
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise PortKeeperError(response.get('error', 'portkeeperd request failed'))
+        return response
+
+    def close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._rfile.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._rfile = None
+
+
+class _GroupCommitter(threading.Thread):
+    """Writes batches of committed changes to the backing registry in one transaction.
+
+    A batch that fails to persist (disk full, lock timeout) is requeued behind
+    any newer changes to the same keys and retried with exponential backoff.
+    """
+
+    def __init__(self, target: RegistryBackend, interval: float):
+        super().__init__(name='portkeeperd-commit', daemon=True)
+        self.target = target
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._pending: dict[str, dict | None] = {}
+        self._stopping = False
+        self._flushing = threading.Lock()
+
+    def submit(self, changes: dict[str, dict | None]) -> None:
+        with self._cond:
+            self._pending.update(changes)
+            self._cond.notify()
+
+    def run(self) -> None:
+        delay = COMMIT_RETRY_DELAY
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._pending:
+                    return
+                # Give concurrent commits a chance to join this batch
+                if not self._stopping:
+                    self._cond.wait(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ portkeeperd: failed to persist {len(self._pending)} change(s) to "
+                      f"{self.target.path}, retrying in {delay:g}s: {type(e).__name__}: {e}",
+                      file=sys.stderr)
+                deadline = time.monotonic() + delay
+                with self._cond:
+                    # New submissions do not cut the backoff short; stop() does
+                    while not self._stopping and time.monotonic() < deadline:
+                        self._cond.wait(deadline - time.monotonic())
+                    if self._stopping:
+                        return  # stop() makes the last attempt and reports its failure
+                delay = min(delay * 2, COMMIT_RETRY_MAX_DELAY)
+            else:
+                delay = COMMIT_RETRY_DELAY
+
+    def flush(self) -> None:
+        """Persist all pending changes; returns once they (and any flush in progress) are written.
+
+        On failure the batch is put back (changes submitted meanwhile win) and the error raised.
+        """
+        with self._flushing:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                with self.target.transaction() as txn:
+                    for key, entry in pending.items():
+                        if entry is None:
+                            txn.delete(key)
+                        else:
+                            txn.put(key, entry)
+            except BaseException:
+                metrics.inc('portkeeper_daemon_commit_failures_total')
+                with self._cond:
+                    pending.update(self._pending)
+                    self._pending = pending
+                raise
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self.join()
+        self.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            began = time.perf_counter()
+            request = {}
+            try:
+                request = json.loads(line)
+                response = self.server.portkeeperd.dispatch(request)
+            except PortKeeperError as e:
+                response = {'ok': False, 'error': str(e)}
+            except Exception as e:
+                response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            metrics.observe('portkeeper_daemon_request_seconds', time.perf_counter() - began,
+                            op=str(request.get('op')) if isinstance(request, dict) else 'invalid')
+            self.wfile.write((json.dumps(response, separators=(',', ':')) + '\n').encode('utf-8'))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class PortKeeperDaemon:
+    """Owns the registry in memory and serves reserve, release, status, scan and metrics calls."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, backend: RegistryBackend | None = None,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, strategy: str | None = None):
+        self.socket_path = socket_path
+        self.target = backend or open_backend()
+        self.committer = _GroupCommitter(self.target, flush_interval)
+        self.memory = MemoryBackend(self.target.read(), on_commit=self.committer.submit,
+                                    path=str(self.target.path))
+        self.registry = PortRegistry(backend=self.memory, daemon=False, strategy=strategy)
+        self._server: _Server | None = None
+
+    def dispatch(self, request: dict) -> dict:
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid(),
+                    'registry': os.path.realpath(str(self.target.path))}
+        if op == 'reserve':
+            port_range = request.get('port_range')
+            count, preferred = int(request.get('count', 1)), request.get('preferred')
+            ttl = request.get('ttl')
+            self.registry._check_request(count, preferred, ttl)
+            result = self.registry._reserve_local(
+                tuple(port_range) if port_range else None,
+                request.get('host') or DEFAULT_HOST,
+                False,
+                request.get('owner'),
+                count,
+                preferred,
+                ttl=ttl,
+                pid=request.get('pid'),
+                strategy=request.get('strategy'),
+                label=request.get('label'),
+            )
+            reservations = result if isinstance(result, list) else [result]
+            return {'ok': True, 'host': reservations[0].host,
+                    'ports': [r.port for r in reservations], 'expires': reservations[0].expires}
+        if op == 'reserve_block':
+            port_range = request.get('port_range')
+            length, ttl = int(request['length']), request.get('ttl')
+            self.registry._check_request(length, None, ttl)
+            reservations = self.registry._reserve_block_local(
+                length,
+                tuple(port_range) if port_range else None,
+                request.get('host') or DEFAULT_HOST,
+                int(request.get('align', 1)),
+                False,
+                request.get('owner'),
+                ttl=ttl,
+                pid=request.get('pid'),
+                label=request.get('label'),
+            )
+            return {'ok': True, 'host': reservations[0].host,
+                    'ports': [r.port for r in reservations], 'expires': reservations[0].expires}
+        if op == 'claim':
+            claimed = self.registry._claim(request['host'], int(request['port']),
+                                           request.get('owner'), force=bool(request.get('force')))
+            return {'ok': True, 'claimed': claimed}
+        if op == 'release':
+            key = f"{request['host']}:{int(request['port'])}"
+            with self.memory.transaction() as txn:
+                released = txn.delete(key)
+            return {'ok': True, 'released': released}
+        if op == 'renew':
+            renewed = self.registry._renew_local(list(request['keys']), request.get('ttl'))
+            return {'ok': True, 'renewed': renewed}
+        if op == 'settle':
+            settled = self.registry._settle_local(list(request['keys']), request.get('owner'))
+            return {'ok': True, 'settled': settled}
+        if op == 'gc':
+            removed = self.registry._gc_local(bool(request.get('check_pids', True)))
+            return {'ok': True, 'removed': removed}
+        if op == 'release_many':
+            released = self.registry._release_many_local(list(request.get('keys') or []),
+                                                         request.get('owner'), request.get('pid'),
+                                                         request.get('label'))
+            return {'ok': True, 'released': released}
+        if op == 'release_matching':
+            port = request.get('port')
+            released = self.registry._release_matching_local(
+                request.get('host'), None if port is None else int(port), request.get('owner'),
+                request.get('pattern'), request.get('label'))
+            return {'ok': True, 'released': released}
+        if op == 'find':
+            entries = self.memory.find(request.get('owner'), request.get('pid'),
+                                       request.get('label'))
+            return {'ok': True, 'entries': entries}
+        if op == 'status':
+            entries = dict(self.registry.iter_status(request.get('host'), request.get('owner'),
+                                                     request.get('older_than'),
+                                                     request.get('newer_than'),
+                                                     request.get('label')))
+            return {'ok': True, 'entries': entries}
+        if op == 'metrics':
+            return {'ok': True, 'metrics': metrics.snapshot()}
+        if op == 'scan':
+            port_range = request.get('port_range') or (8000, 9000)
+            hosts = self.registry.scan_local_network(tuple(port_range),
+                                                     float(request.get('timeout', 0.1)))
+            return {'ok': True, 'hosts': hosts}
+        raise PortKeeperError(f"Unknown operation: {op}")
+
+    def _claim_socket_path(self) -> None:
+        if not os.path.exists(self.socket_path):
+            return
+        try:
+            DaemonClient(self.socket_path, timeout=1.0).request('ping')
+        except DaemonUnavailable:
+            # Left behind by a daemon that did not shut down cleanly
+            os.unlink(self.socket_path)
+            return
+        raise PortKeeperError(f"portkeeperd is already running on {self.socket_path}")
+
+    def start(self) -> None:
+        """Bind the socket and start the commit thread; call serve_forever() to handle requests."""
+        self._claim_socket_path()
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.portkeeperd = self
+        self.committer.start()
+
+    def serve_forever(self) -> None:
+        if self._server is None:
+            self.start()
+        self._server.serve_forever(poll_interval=0.1)
+
+    def shutdown(self) -> None:
+        """Stop serving, flush pending changes and remove the socket."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.committer.is_alive():
+            self.committer.stop()
+        else:
+            self.committer.flush()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def main():
+    """Run portkeeperd in the foreground."""
+    parser = argparse.ArgumentParser(
+        description="portkeeperd - serve the PortKeeper registry from memory over a Unix socket.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                        help=f"Unix socket path (default: {DEFAULT_SOCKET})")
+    parser.add_argument("--registry", help="Path to the registry file")
+    parser.add_argument("--lock", help="Path to the lock file")
+    parser.add_argument("--backend", choices=["json", "journal", "sqlite", "sharded", "bitmap"],
+                        help="Registry storage backend (default: json)")
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help=f"Seconds to batch commits before persisting "
+                             f"(default: {DEFAULT_FLUSH_INTERVAL})")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES),
+                        help="Default allocation strategy (default: first-fit)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Record metrics for 'portkeeper metrics' "
+                             "(default: only with $PORTKEEPER_METRICS)")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print("❌ portkeeperd requires Unix domain sockets", file=sys.stderr)
+        sys.exit(1)
+    try:
+        daemon = PortKeeperDaemon(args.socket, open_backend(args.backend, args.registry, args.lock),
+                                  flush_interval=args.flush_interval, strategy=args.strategy)
+        daemon.start()
+    except PortKeeperError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    def _stop(signum, frame):
+        threading.Thread(target=daemon.shutdown).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    print(f"✅ portkeeperd listening on {args.socket} (registry: {daemon.target.path})")
+    daemon.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
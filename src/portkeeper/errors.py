@@ -0,0 +1,2 @@
+class PortKeeperError(Exception):
+    pass
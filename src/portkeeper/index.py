@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import re
+from typing import Callable, Iterable, Iterator, Mapping
+
+MAX_PORT = 65535
+_BITMAP_BYTES = (MAX_PORT + 1) // 8
+
+# First byte of a bitmap that still has at least one clear bit.
+_NOT_FULL = re.compile(b'[^\xff]')
+# First byte of a bitmap with at least one set bit.
+_NOT_EMPTY = re.compile(b'[^\x00]')
+
+# Entry fields with a secondary index (see EntryIndex)
+INDEXED_FIELDS = ('owner', 'pid', 'label')
+
+
+def split_entry(key: str, entry: Mapping | None = None) -> tuple[str, int]:
+    """Return (host, port) for a registry entry, falling back to its key."""
+    if entry and 'host' in entry and 'port' in entry:
+        return str(entry['host']), int(entry['port'])
+    host, _, port = key.rpartition(':')
+    return host, int(port)
+
+
+class PortIndex:
+    """Per-host bitmap of reserved ports built from one registry snapshot.
+
+    Each host gets a 65536-bit (8 KB) bitmap, so membership tests are O(1)
+    and free-port searches skip fully reserved bytes at C speed. With a
+    ``loader``, a host's bitmap is filled from it the first time the host is
+    looked up, so backends with per-host queries never load other hosts.
+    """
+
+    def __init__(self, loader: Callable[[str], Iterable[int]] | None = None):
+        self._bitmaps: dict[str, bytearray] = {}
+        self._loader = loader
+
+    @classmethod
+    def from_registry(cls, registry: Mapping[str, Mapping]) -> PortIndex:
+        index = cls()
+        for key, entry in registry.items():
+            try:
+                index.add(*split_entry(key, entry))
+            except (TypeError, ValueError):
+                continue
+        return index
+
+    def copy(self) -> PortIndex:
+        index = type(self)(self._loader)
+        index._bitmaps = {host: bytearray(bitmap) for host, bitmap in self._bitmaps.items()}
+        return index
+
+    def _bitmap(self, host: str) -> bytearray:
+        bitmap = self._bitmaps.get(host)
+        if bitmap is None:
+            bitmap = self._bitmaps[host] = bytearray(_BITMAP_BYTES)
+            if self._loader is not None:
+                for port in self._loader(host):
+                    if 0 <= port <= MAX_PORT:
+                        bitmap[port >> 3] |= 1 << (port & 7)
+        return bitmap
+
+    def _lookup(self, host: str) -> bytearray | None:
+        if host in self._bitmaps or self._loader is not None:
+            return self._bitmap(host)
+        return None
+
+    def add(self, host: str, port: int) -> None:
+        if 0 <= port <= MAX_PORT:
+            self._bitmap(host)[port >> 3] |= 1 << (port & 7)
+
+    def discard(self, host: str, port: int) -> None:
+        bitmap = self._lookup(host)
+        if bitmap is not None and 0 <= port <= MAX_PORT:
+            bitmap[port >> 3] &= ~(1 << (port & 7)) & 0xFF
+
+    def is_reserved(self, host: str, port: int) -> bool:
+        bitmap = self._lookup(host)
+        if bitmap is None or not 0 <= port <= MAX_PORT:
+            return False
+        return bool(bitmap[port >> 3] & (1 << (port & 7)))
+
+    def hosts(self) -> Iterable[str]:
+        return self._bitmaps.keys()
+
+    def ports(self, host: str) -> Iterator[int]:
+        """Yield reserved ports for ``host`` in ascending order."""
+        bitmap = self._lookup(host)
+        if bitmap is None:
+            return
+        for i, byte in enumerate(bitmap):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (i << 3) | bit
+
+    def iter_free(self, host: str, start: int, end: int) -> Iterator[int]:
+        """Yield ports in ``[start, end]`` not reserved for ``host``, ascending."""
+        start = max(start, 0)
+        end = min(end, MAX_PORT)
+        bitmap = self._lookup(host)
+        if bitmap is None:
+            yield from range(start, end + 1)
+            return
+        port = start
+        while port <= end:
+            byte = bitmap[port >> 3]
+            if byte == 0xFF:
+                match = _NOT_FULL.search(bitmap, (port >> 3) + 1)
+                if match is None:
+                    return
+                port = match.start() << 3
+                continue
+            if not byte & (1 << (port & 7)):
+                yield port
+            port += 1
+
+    def free_runs(self, host: str, start: int, end: int) -> Iterator[tuple[int, int]]:
+        """Yield maximal ``(first, last)`` runs of ports in ``[start, end]`` unreserved on ``host``.
+
+        Fully free and fully reserved bytes are skipped at C speed, so the cost
+        grows with the number of runs rather than the size of the range.
+        """
+        start = max(start, 0)
+        end = min(end, MAX_PORT)
+        bitmap = self._lookup(host)
+        if bitmap is None:
+            if start <= end:
+                yield start, end
+            return
+        run_start: int | None = None
+        port = start
+        while port <= end:
+            byte = bitmap[port >> 3]
+            if port & 7 == 0 and byte in (0, 0xFF):
+                match = (_NOT_EMPTY if byte == 0 else _NOT_FULL).search(bitmap, (port >> 3) + 1)
+                if byte == 0:
+                    if run_start is None:
+                        run_start = port
+                elif run_start is not None:
+                    yield run_start, port - 1
+                    run_start = None
+                port = match.start() << 3 if match else end + 1
+                continue
+            if byte & (1 << (port & 7)):
+                if run_start is not None:
+                    yield run_start, port - 1
+                    run_start = None
+            elif run_start is None:
+                run_start = port
+            port += 1
+        if run_start is not None:
+            yield run_start, end
+
+
+def entry_matches(entry: Mapping, criteria: Mapping[str, object]) -> bool:
+    """True if ``entry`` has every field in ``criteria`` set to the given value (None means any)."""
+    return all(value is None or entry.get(field) == value for field, value in criteria.items())
+
+
+class EntryIndex:
+    """Registry keys by owner, pid and label, kept next to a PortIndex.
+
+    Lookups cost the number of matching entries rather than a scan of the
+    registry. Empty and missing values are not indexed.
+    """
+
+    def __init__(self):
+        self._keys: dict[str, dict[object, set[str]]] = {field: {} for field in INDEXED_FIELDS}
+
+    @classmethod
+    def from_registry(cls, registry: Mapping[str, Mapping]) -> EntryIndex:
+        index = cls()
+        for key, entry in registry.items():
+            index.add(key, entry)
+        return index
+
+    def copy(self) -> EntryIndex:
+        index = type(self)()
+        index._keys = {field: {value: set(keys) for value, keys in by_value.items()}
+                       for field, by_value in self._keys.items()}
+        return index
+
+    def add(self, key: str, entry: Mapping | None) -> None:
+        if not isinstance(entry, Mapping):
+            return
+        for field, by_value in self._keys.items():
+            value = entry.get(field)
+            if value not in (None, '') and not isinstance(value, (dict, list)):
+                by_value.setdefault(value, set()).add(key)
+
+    def discard(self, key: str, entry: Mapping | None) -> None:
+        if not isinstance(entry, Mapping):
+            return
+        for field, by_value in self._keys.items():
+            value = entry.get(field)
+            if value in (None, '') or isinstance(value, (dict, list)):
+                continue
+            keys = by_value.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del by_value[value]
+
+    def find(self, **criteria) -> set[str]:
+        """Keys of entries whose given fields (owner, pid, label, ...) all match; None means any.
+
+        With no criteria at all, nothing matches.
+        """
+        found: set[str] | None = None
+        for field, value in criteria.items():
+            if value is None:
+                continue
+            if field not in self._keys:
+                raise ValueError(f"Not an indexed field: {field}")
+            keys = self._keys[field].get(value, set())
+            found = set(keys) if found is None else found & keys
+            if not found:
+                return set()
+        return found or set()
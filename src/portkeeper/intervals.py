@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right, insort
+from typing import Iterable, Iterator
+
+from .index import PortIndex
+
+
+class FreeIntervals:
+    """Disjoint runs of free ports kept as sorted lists.
+
+    Runs are stored by position (``_starts``/``_ends``) and by size
+    (``_by_length`` as ``(length, first)`` pairs), so the smallest run that
+    can hold a block is found by bisection (best fit, which keeps large runs
+    intact for large blocks) and taking or freeing a block only touches the
+    runs around it.
+    """
+
+    def __init__(self, runs: Iterable[tuple[int, int]] = ()):
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+        self._by_length: list[tuple[int, int]] = []
+        for first, last in runs:
+            self.free(first, last - first + 1)
+
+    @classmethod
+    def from_index(cls, index: PortIndex, host: str, port_range: tuple[int, int],
+                   exclude: Iterable[int] = ()) -> FreeIntervals:
+        """Free runs of ``host`` in ``port_range``, minus the ``exclude`` (e.g. bound) ports."""
+        intervals = cls()
+        for first, last in index.free_runs(host, port_range[0], port_range[1]):
+            intervals._insert(first, last)
+        for port in exclude:
+            if port in intervals:
+                intervals.take(port, 1)
+        return intervals
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return zip(self._starts, self._ends)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __contains__(self, port: int) -> bool:
+        i = bisect_right(self._starts, port) - 1
+        return i >= 0 and port <= self._ends[i]
+
+    def _insert(self, first: int, last: int) -> None:
+        i = bisect_left(self._starts, first)
+        self._starts.insert(i, first)
+        self._ends.insert(i, last)
+        insort(self._by_length, (last - first + 1, first))
+
+    def _remove(self, i: int) -> tuple[int, int]:
+        first, last = self._starts.pop(i), self._ends.pop(i)
+        del self._by_length[bisect_left(self._by_length, (last - first + 1, first))]
+        return first, last
+
+    def find(self, length: int, align: int = 1) -> int | None:
+        """First port of a free block of ``length`` ports at a multiple of ``align``, or None."""
+        for i in range(bisect_left(self._by_length, (length, -1)), len(self._by_length)):
+            size, first = self._by_length[i]
+            aligned = -(-first // align) * align
+            if aligned + length <= first + size:
+                return aligned
+        return None
+
+    def take(self, first: int, length: int) -> None:
+        """Mark ``[first, first + length)`` as used; it must lie within one free run."""
+        last = first + length - 1
+        i = bisect_right(self._starts, first) - 1
+        if i < 0 or last > self._ends[i]:
+            raise ValueError(f"Ports {first}-{last} are not free")
+        run_first, run_last = self._remove(i)
+        if run_first < first:
+            self._insert(run_first, first - 1)
+        if last < run_last:
+            self._insert(last + 1, run_last)
+
+    def free(self, first: int, length: int) -> None:
+        """Mark ``[first, first + length)`` as free, merging it with adjacent runs."""
+        last = first + length - 1
+        i = bisect_left(self._starts, first)
+        if i > 0 and self._ends[i - 1] >= first - 1:
+            if self._ends[i - 1] >= first:
+                raise ValueError(f"Ports {first}-{last} overlap a free run")
+            first = self._remove(i - 1)[0]
+            i -= 1
+        if i < len(self._starts) and self._starts[i] <= last + 1:
+            if self._starts[i] <= last:
+                raise ValueError(f"Ports {first}-{last} overlap a free run")
+            last = self._remove(i)[1]
+        self._insert(first, last)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import os
+import socket
+import struct
+from typing import Iterable
+
+PROC_NET = os.environ.get("PORTKEEPER_PROC_NET", "/proc/net")
+PROTOCOLS = ('tcp', 'tcp6', 'udp', 'udp6')
+
+# TIME_WAIT and CLOSE sockets do not block a SO_REUSEADDR bind
+_IGNORED_TCP_STATES = {'06', '07'}
+_WILDCARDS = ('0.0.0.0', '::')
+
+
+def _decode_address(hex_addr: str) -> str:
+    """Decode a /proc/net address; words are printed in host byte order."""
+    if len(hex_addr) == 8:
+        return socket.inet_ntop(socket.AF_INET, struct.pack('=I', int(hex_addr, 16)))
+    import ipaddress
+    words = [int(hex_addr[i:i + 8], 16) for i in range(0, 32, 8)]
+    addr = ipaddress.IPv6Address(struct.pack('=IIII', *words))
+    return str(addr.ipv4_mapped or addr)
+
+
+def _resolve(host: str) -> str:
+    import ipaddress
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        try:
+            return socket.gethostbyname(host)
+        except OSError:
+            return host
+    if isinstance(addr, ipaddress.IPv6Address) and addr.ipv4_mapped:
+        return str(addr.ipv4_mapped)
+    return str(addr)
+
+
+class KernelPortTable:
+    """Ports in use per local address, read from the kernel socket table in one pass.
+
+    Only available on Linux; ``load()`` returns None elsewhere so callers can
+    fall back to probing. Answers are a snapshot, so the caller still does a
+    final bind check on the port it picks.
+    """
+
+    def __init__(self, tables: dict[str, dict[str, set[int]]]):
+        # {'tcp': {'127.0.0.1': {8000, ...}, ...}, 'udp': {...}}
+        self._tables = tables
+
+    @classmethod
+    def load(cls, protocols: Iterable[str] = PROTOCOLS,
+             root: str | None = None) -> KernelPortTable | None:
+        root = root or PROC_NET
+        tables: dict[str, dict[str, set[int]]] = {}
+        loaded = False
+        for proto in protocols:
+            by_addr = tables.setdefault(proto.rstrip('6'), {})
+            try:
+                with open(os.path.join(root, proto), encoding='ascii') as f:
+                    lines = f.read().splitlines()[1:]
+            except OSError:
+                continue
+            loaded = True
+            is_tcp = proto.startswith('tcp')
+            for line in lines:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                if is_tcp and fields[3] in _IGNORED_TCP_STATES:
+                    continue
+                try:
+                    hex_addr, hex_port = fields[1].split(':')
+                    addr = _decode_address(hex_addr)
+                except (ValueError, OSError):
+                    continue
+                by_addr.setdefault(addr, set()).add(int(hex_port, 16))
+        return cls(tables) if loaded else None
+
+    def used_ports(self, host: str, proto: str = 'tcp') -> frozenset[int]:
+        """Ports on ``host`` that a bind would collide with, wildcard listeners included."""
+        by_addr = self._tables.get(proto.rstrip('6'), {})
+        addr = _resolve(host)
+        if addr in _WILDCARDS:
+            used: set[int] = set()
+            for ports in by_addr.values():
+                used |= ports
+            return frozenset(used)
+        used = set(by_addr.get(addr, ()))
+        for wildcard in _WILDCARDS:
+            used |= by_addr.get(wildcard, set())
+        return frozenset(used)
+
+    def is_used(self, host: str, port: int, proto: str = 'tcp') -> bool:
+        return port in self.used_ports(host, proto)
+
+    def free_ports(self, host: str, start: int, end: int, proto: str = 'tcp') -> list[int]:
+        used = self.used_ports(host, proto)
+        return [port for port in range(start, end + 1) if port not in used]
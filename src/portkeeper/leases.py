@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .core import PortRegistry, Reservation
+
+DEFAULT_LEASE_TTL = 60.0
+
+
+def pid_alive(pid: int) -> bool:
+    """True unless ``pid`` certainly no longer exists on this machine."""
+    if pid <= 0 or os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows; assume it is alive
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists but belongs to someone else (EPERM)
+    return True
+
+
+def lease_fields(ttl: float, pid: int | None = None, now: float | None = None) -> dict:
+    """Registry entry fields for a lease of ``ttl`` seconds held by ``pid``."""
+    now = time.time() if now is None else now
+    return {'ttl': ttl, 'expires': now + ttl, 'pid': os.getpid() if pid is None else pid}
+
+
+def is_dead(entry: dict, now: float, check_pids: bool = True) -> bool:
+    """True if ``entry`` is a lease that expired or whose holder process has exited.
+
+    Entries without a lease (plain reservations) never die.
+    """
+    expires = entry.get('expires')
+    if expires is None:
+        return False
+    if expires <= now:
+        return True
+    pid = entry.get('pid')
+    return check_pids and isinstance(pid, int) and not pid_alive(pid)
+
+
+class LeaseKeeper(threading.Thread):
+    """Background thread renewing leased reservations until stopped.
+
+    Renews every ``interval`` seconds (a third of the shortest lease by
+    default), so a lease survives two missed heartbeats before it expires.
+    """
+
+    def __init__(self, registry: PortRegistry, reservations: list[Reservation],
+                 interval: float | None = None):
+        super().__init__(name='portkeeper-lease', daemon=True)
+        self.registry = registry
+        self.reservations = list(reservations)
+        ttls = [r.ttl for r in self.reservations if r.ttl]
+        self.interval = interval or (min(ttls) if ttls else DEFAULT_LEASE_TTL) / 3
+        self.renewals = 0
+        self.error: BaseException | None = None
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.registry.renew(self.reservations)
+                self.renewals += 1
+            except Exception as e:  # keep trying; the lease may still be saved by the next beat
+                self.error = e
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def __enter__(self) -> LeaseKeeper:
+        if not self.is_alive():
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
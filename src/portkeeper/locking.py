@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import errno
+import os
+import random
+import socket
+import threading
+import time
+
+from . import metrics
+from .errors import PortKeeperError
+from .leases import pid_alive
+
+# Cross-platform locking
+try:
+    import fcntl  # type: ignore
+    _HAS_FCNTL = True
+except Exception:
+    _HAS_FCNTL = False
+
+try:
+    import msvcrt  # type: ignore
+    _HAS_MSVCRT = True
+except Exception:
+    _HAS_MSVCRT = False
+
+_timeout = float(os.environ.get("PORTKEEPER_LOCK_TIMEOUT", "30"))
+DEFAULT_LOCK_TIMEOUT: float | None = _timeout if _timeout > 0 else None  # None: wait forever
+DEFAULT_LOCK_FAIR = os.environ.get("PORTKEEPER_LOCK_FAIR", "").lower() in ('1', 'true', 'yes', 'on')
+DEFAULT_STALE_AFTER = 60.0
+DEFAULT_BACKOFF = 0.0005
+DEFAULT_MAX_BACKOFF = 0.02
+
+_HOSTNAME = socket.gethostname()
+
+
+class LockTimeout(PortKeeperError):
+    """A FileLock could not be acquired within its timeout."""
+
+
+class _CallerStats:
+    __slots__ = ('acquired', 'reentered', 'timeouts', 'contended',
+                 'wait', 'wait_max', 'hold', 'hold_max')
+
+    def __init__(self):
+        self.acquired = self.reentered = self.timeouts = self.contended = 0
+        self.wait = self.wait_max = self.hold = self.hold_max = 0.0
+
+
+_stats: dict[str, _CallerStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _caller_stats(caller: str) -> _CallerStats:
+    stats = _stats.get(caller)
+    if stats is None:
+        stats = _stats.setdefault(caller, _CallerStats())
+    return stats
+
+
+def lock_stats() -> dict[str, dict]:
+    """Wait and hold times of every FileLock taken in this process so far, per caller.
+
+    For each caller: acquisitions of the OS lock, reentered (acquisitions by a
+    thread already holding it, which cost nothing), timeouts, contended
+    (acquisitions that had to wait), and total and worst wait and hold times
+    in seconds.
+    """
+    with _stats_lock:
+        return {caller: {'acquired': s.acquired, 'reentered': s.reentered, 'timeouts': s.timeouts,
+                         'contended': s.contended,
+                         'wait_seconds': s.wait, 'wait_max_seconds': s.wait_max,
+                         'hold_seconds': s.hold, 'hold_max_seconds': s.hold_max}
+                for caller, s in _stats.items()}
+
+
+def reset_lock_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+def _backoff(attempt: int, deadline: float | None) -> None:
+    """Sleep for a jittered, exponentially growing delay that never passes ``deadline``."""
+    delay = min(DEFAULT_MAX_BACKOFF, DEFAULT_BACKOFF * (1 << min(attempt, 16)))
+    delay = random.uniform(delay / 2, delay)
+    if deadline is not None:
+        delay = min(delay, max(0.0, deadline - time.monotonic()))
+    time.sleep(delay)
+
+
+class _ProcessLock:
+    """This process's hold on one lock file: a thread mutex in front of the OS lock.
+
+    Threads queue on ``mutex`` instead of contending for the OS lock, and the
+    holding thread may re-enter without touching it again. ``fd`` stays open
+    between acquisitions so taking the lock costs one flock call.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mutex = threading.Lock()
+        self.owner: int | None = None
+        self.depth = 0
+        self.shared = False
+        self.fd = None
+
+    def reopen(self):
+        """The descriptor to lock through, replaced if the lock file was removed or recreated."""
+        if self.fd is not None:
+            try:
+                if os.fstat(self.fd.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return self.fd
+            except OSError:
+                pass
+            self.fd.close()
+        open(self.path, 'a').close()
+        self.fd = open(self.path, 'r+')
+        return self.fd
+
+
+_process_locks: dict[str, _ProcessLock] = {}
+_process_locks_guard = threading.Lock()
+
+
+def _process_lock(path: str) -> _ProcessLock:
+    key = os.path.abspath(path)
+    plock = _process_locks.get(key)
+    if plock is None:
+        with _process_locks_guard:
+            plock = _process_locks.setdefault(key, _ProcessLock(path))
+    return plock
+
+
+def _forget_process_locks() -> None:
+    # A forked child inherits the parent's descriptors (and with them its flocks), not its threads
+    global _process_locks_guard
+    _process_locks.clear()
+    _process_locks_guard = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_process_locks)
+
+
+class FileLock:
+    """Inter-process lock on ``path``, reentrant and thread-aware within a process.
+
+    With ``shared=True`` any number of processes may hold the lock at once,
+    excluding only exclusive holders (where flock is unavailable, shared locks
+    are exclusive). Within one process the threads take turns on a mutex
+    before the OS lock is touched, and a thread already holding the lock
+    re-enters it for free (a shared hold cannot be upgraded to exclusive).
+
+    Acquisition gives up with LockTimeout after ``timeout`` seconds (default
+    $PORTKEEPER_LOCK_TIMEOUT or 30; None waits forever), retrying with jittered
+    exponential backoff meanwhile. With ``fair=True`` (or $PORTKEEPER_LOCK_FAIR)
+    waiters first queue on ``<path>.queue``, so only the longest-waiting one
+    competes for the lock and a stream of newcomers cannot starve it. Where
+    neither flock nor msvcrt exists the lock is a ``<path>.lck`` file naming
+    its holder; one left behind by a process that died (or, for holders on
+    other hosts, older than ``stale_after`` seconds) is broken.
+
+    Wait and hold times are recorded per ``caller``; see lock_stats().
+    """
+
+    def __init__(self, path: str, shared: bool = False,
+                 timeout: float | None = DEFAULT_LOCK_TIMEOUT, fair: bool = DEFAULT_LOCK_FAIR,
+                 caller: str = 'default', stale_after: float = DEFAULT_STALE_AFTER):
+        # Resolved once: a relative path must keep naming the same lock after a chdir
+        self.path = os.path.abspath(path)
+        self.shared = shared
+        self.timeout = timeout
+        self.fair = fair
+        self.caller = caller
+        self.stale_after = stale_after
+        self._acquired_at = 0.0
+        # thread -> the process lock it entered, released on exit
+        self._plocks: dict[int, _ProcessLock] = {}
+
+    @property
+    def _mode(self) -> str:
+        return 'shared' if self.shared else 'exclusive'
+
+    def __enter__(self):
+        plock = _process_lock(self.path)
+        if plock.owner == threading.get_ident():
+            if plock.shared and not self.shared:
+                raise PortKeeperError(f"Cannot take the exclusive lock on {self.path} "
+                                      "while holding it shared")
+            plock.depth += 1
+            self._plocks[threading.get_ident()] = plock
+            with _stats_lock:
+                _caller_stats(self.caller).reentered += 1
+            return self
+        began = time.monotonic()
+        deadline = None if self.timeout is None else began + self.timeout
+        try:
+            queued = not plock.mutex.acquire(blocking=False)
+            if queued and not plock.mutex.acquire(timeout=-1 if deadline is None else self.timeout):
+                raise self._timed_out(' (held by another thread of this process)')
+            try:
+                contended = self._acquire(plock, deadline) or queued
+            except BaseException:
+                plock.mutex.release()
+                raise
+        except LockTimeout:
+            with _stats_lock:
+                _caller_stats(self.caller).timeouts += 1
+            metrics.inc('portkeeper_lock_timeouts_total', mode=self._mode, caller=self.caller)
+            raise
+        plock.owner, plock.depth, plock.shared = threading.get_ident(), 1, self.shared
+        self._plocks[plock.owner] = plock
+        self._acquired_at = time.monotonic()
+        wait = self._acquired_at - began
+        with _stats_lock:
+            stats = _caller_stats(self.caller)
+            stats.acquired += 1
+            stats.contended += contended
+            stats.wait += wait
+            stats.wait_max = max(stats.wait_max, wait)
+        metrics.observe('portkeeper_lock_wait_seconds', wait, mode=self._mode, caller=self.caller)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        plock = self._plocks[threading.get_ident()]
+        plock.depth -= 1
+        if plock.depth:
+            return
+        del self._plocks[plock.owner]
+        plock.owner = None
+        try:
+            if _HAS_FCNTL:
+                fcntl.flock(plock.fd.fileno(), fcntl.LOCK_UN)
+            elif _HAS_MSVCRT:
+                msvcrt.locking(plock.fd.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                os.close(plock.fd)
+                plock.fd = None
+                try:
+                    os.remove(self.path + '.lck')
+                except Exception:
+                    pass
+        except Exception:
+            pass
+        finally:
+            plock.mutex.release()
+        hold = time.monotonic() - self._acquired_at
+        with _stats_lock:
+            stats = _caller_stats(self.caller)
+            stats.hold += hold
+            stats.hold_max = max(stats.hold_max, hold)
+        metrics.observe('portkeeper_lock_hold_seconds', hold, mode=self._mode, caller=self.caller)
+
+    # --- acquisition ---
+    def _timed_out(self, holder: str = '') -> LockTimeout:
+        return LockTimeout(f"Timed out after {self.timeout:g}s waiting for the {self._mode} "
+                           f"lock on {self.path}{holder}")
+
+    def _acquire(self, plock: _ProcessLock, deadline: float | None) -> bool:
+        """Take the OS lock for this process, waiting until ``deadline``; True if it had to wait."""
+        if not (_HAS_FCNTL or _HAS_MSVCRT):
+            return self._acquire_lockfile(plock, deadline)
+        contended = False
+        while True:
+            fd = plock.reopen()
+            if not self._try(fd):
+                contended = True
+                if not self.fair:
+                    self._wait(fd, deadline)
+                else:
+                    with open(self.path + '.queue', 'a+') as queue:
+                        # Queue behind earlier waiters, then take the lock as soon as it is released
+                        self._wait(queue, deadline, exclusive=True)
+                        self._wait(fd, deadline)
+            if plock.reopen() is fd:
+                return contended
+            # The lock file was replaced while we waited: the lock we hold guards nothing
+            contended = True
+
+    def _try(self, f, exclusive: bool | None = None) -> bool:
+        exclusive = not self.shared if exclusive is None else exclusive
+        try:
+            if _HAS_FCNTL:
+                fcntl.flock(f.fileno(),
+                            (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK, errno.EDEADLK):
+                return False
+            raise
+        return True
+
+    def _wait(self, f, deadline: float | None, exclusive: bool | None = None) -> None:
+        """Block on ``f`` until locked; poll with backoff when there is a deadline."""
+        if deadline is None and _HAS_FCNTL:
+            exclusive = not self.shared if exclusive is None else exclusive
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            return
+        attempt = 0
+        while not self._try(f, exclusive):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise self._timed_out()
+            _backoff(attempt, deadline)
+            attempt += 1
+
+    def _acquire_lockfile(self, plock: _ProcessLock, deadline: float | None) -> bool:
+        lck = self.path + '.lck'
+        attempt = 0
+        while True:
+            try:
+                plock.fd = os.open(lck, os.O_CREAT | os.O_EXCL | os.O_RDWR)
+            except FileExistsError:
+                holder = self._read_holder(lck)
+                if holder is not None and self._is_stale(lck, holder):
+                    self._break(lck, holder)
+                    continue
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise self._timed_out(f" (held by {holder or 'an unknown process'})") from None
+                _backoff(attempt, deadline)
+                attempt += 1
+                continue
+            os.write(plock.fd, f"{os.getpid()} {_HOSTNAME}\n".encode())
+            return attempt > 0
+
+    @staticmethod
+    def _read_holder(lck: str) -> str | None:
+        try:
+            with open(lck, encoding='utf-8') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _is_stale(self, lck: str, holder: str) -> bool:
+        """True if the process that created ``lck`` is gone, or it is too old to vouch for."""
+        pid, _, host = holder.partition(' ')
+        if host == _HOSTNAME and pid.isdigit():
+            return not pid_alive(int(pid))
+        try:
+            return time.time() - os.path.getmtime(lck) > self.stale_after
+        except OSError:
+            return False
+
+    def _break(self, lck: str, holder: str) -> None:
+        """Remove a stale lock file, putting it back if another process replaced it meanwhile."""
+        doomed = f"{lck}.{os.getpid()}.{threading.get_ident()}.stale"
+        try:
+            os.rename(lck, doomed)
+        except OSError:
+            return  # somebody else broke it first
+        if self._read_holder(doomed) != holder:
+            # Renamed a fresh lock taken since we looked: restore it unless yet another one exists
+            try:
+                os.link(doomed, lck)
+            except OSError:
+                pass
+        else:
+            metrics.inc('portkeeper_stale_locks_total')
+        try:
+            os.remove(doomed)
+        except OSError:
+            pass
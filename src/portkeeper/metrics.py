@@ -0,0 +1,299 @@
+"""Opt-in counters and histograms for the allocation hot path, exported as Prometheus text.
+
+Nothing is recorded until metrics are enabled, with enable() or by setting
+$PORTKEEPER_METRICS=1; until then every record call returns at once.
+Setting $PORTKEEPER_METRICS_FILE also enables them and merges the samples of
+each process into that file when it exits, which is where ``portkeeper
+metrics`` reads them from (together with a running portkeeperd's own).
+
+    from portkeeper import metrics
+    metrics.enable()
+    metrics.add_hook(lambda kind, name, value, labels: print(name, value, labels))
+    ...
+    print(metrics.render())
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+DEFAULT_METRICS_FILE = os.environ.get("PORTKEEPER_METRICS_FILE", "")
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024)
+
+# name -> (type, help, histogram buckets)
+METRICS: dict[str, tuple[str, str, tuple[float, ...]]] = {
+    'portkeeper_reserve_seconds': (
+        'histogram', 'Time to reserve ports, by path (local, daemon, pool)', LATENCY_BUCKETS),
+    'portkeeper_release_seconds': ('histogram', 'Time to release a reservation', LATENCY_BUCKETS),
+    'portkeeper_reserve_probes': (
+        'histogram', 'Bind probes made by one reserve call', COUNT_BUCKETS),
+    'portkeeper_bind_failures_total': ('counter', 'Bind probes that found the port in use', ()),
+    'portkeeper_lock_wait_seconds': (
+        'histogram', 'Time spent waiting to acquire a FileLock, by mode and caller',
+        LATENCY_BUCKETS),
+    'portkeeper_lock_hold_seconds': (
+        'histogram', 'Time a FileLock was held, by mode and caller', LATENCY_BUCKETS),
+    'portkeeper_lock_timeouts_total': (
+        'counter', 'FileLock acquisitions that timed out, by mode and caller', ()),
+    'portkeeper_stale_locks_total': (
+        'counter', 'Lock files broken because their holder was gone', ()),
+    'portkeeper_registry_read_seconds': (
+        'histogram', 'Time to read the registry, by backend', LATENCY_BUCKETS),
+    'portkeeper_registry_read_bytes_total': ('counter', 'Registry bytes read, by backend', ()),
+    'portkeeper_registry_write_seconds': (
+        'histogram', 'Time to write a registry commit including fsync, by backend',
+        LATENCY_BUCKETS),
+    'portkeeper_registry_write_bytes_total': ('counter', 'Registry bytes written, by backend', ()),
+    'portkeeper_fsync_seconds': ('histogram', 'Time spent in fsync, by backend', LATENCY_BUCKETS),
+    'portkeeper_registry_conflicts_total': (
+        'counter', 'Optimistic commits retried after a conflict, by backend', ()),
+    'portkeeper_scan_connects_total': ('counter', 'Scanner connect probes, by resulting state', ()),
+    'portkeeper_scan_connect_seconds': (
+        'histogram', 'Round trip of answered scanner connect probes', LATENCY_BUCKETS),
+    'portkeeper_scan_cache_requests_total': (
+        'counter', 'Scan cache lookups, by result (hit, miss)', ()),
+    'portkeeper_pool_requests_total': ('counter', 'Port pool hand-outs, by result (hit, miss)', ()),
+    'portkeeper_daemon_request_seconds': (
+        'histogram', 'Time portkeeperd spent serving a request, by op', LATENCY_BUCKETS),
+    'portkeeper_daemon_commit_failures_total': (
+        'counter', 'portkeeperd batches that failed to persist and were requeued', ()),
+    'portkeeper_reservations': ('gauge', 'Reservations in the registry, by host', ()),
+}
+
+Hook = Callable[[str, str, float, Dict[str, str]], None]
+
+enabled = False
+_lock = threading.Lock()
+_counters: dict[tuple[str, str], float] = {}
+_histograms: dict[tuple[str, str], list[float]] = {}  # bucket counts..., +Inf count, sum
+_hooks: list[Hook] = []
+_save_path: str | None = None
+
+
+def _buckets(name: str) -> tuple[float, ...]:
+    return METRICS.get(name, ('histogram', '', LATENCY_BUCKETS))[2] or LATENCY_BUCKETS
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_string(labels: dict[str, str]) -> str:
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+
+def enable(path: str | None = None) -> None:
+    """Start recording; with ``path``, merge this process's samples into that file at exit."""
+    global enabled, _save_path
+    enabled = True
+    if path and _save_path is None:
+        atexit.register(lambda: save(_save_path) if _save_path else None)
+    if path:
+        _save_path = path
+
+
+def disable() -> None:
+    """Stop recording; samples so far are kept until reset()."""
+    global enabled
+    enabled = False
+
+
+def reset() -> None:
+    """Forget every sample recorded by this process."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def add_hook(hook: Hook) -> None:
+    """Call ``hook(kind, name, value, labels)`` for every sample recorded while metrics are enabled.
+
+    ``kind`` is 'counter' or 'histogram'. Hooks run on the recording thread,
+    inside the hot path: they must be quick and must not raise.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    """Add ``value`` to the counter ``name``."""
+    if not enabled:
+        return
+    key = (name, _label_string(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    for hook in _hooks:
+        hook('counter', name, value, labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """Record ``value`` in the histogram ``name``."""
+    if not enabled:
+        return
+    key = (name, _label_string(labels))
+    buckets = _buckets(name)
+    with _lock:
+        counts = _histograms.get(key)
+        if counts is None:
+            counts = _histograms[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[len(buckets)] += 1
+        counts[-1] += value
+    for hook in _hooks:
+        hook('histogram', name, value, labels)
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'began')
+
+    def __init__(self, name: str, labels: dict[str, str]):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.began, **self.labels)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name: str, **labels: str):
+    """Context manager recording the time spent in its block in the histogram ``name``."""
+    return _Timer(name, labels) if enabled else _NULL_TIMER
+
+
+# --- snapshots and export ---
+def snapshot() -> dict:
+    """This process's samples as JSON-serializable data, for save(), merge() and render()."""
+    with _lock:
+        counters: dict[str, dict[str, float]] = {}
+        for (name, labels), value in _counters.items():
+            counters.setdefault(name, {})[labels] = value
+        histograms: dict[str, dict[str, dict]] = {}
+        for (name, labels), counts in _histograms.items():
+            histograms.setdefault(name, {})[labels] = {'le': list(_buckets(name)),
+                                                       'counts': counts[:-1], 'sum': counts[-1]}
+    return {'counters': counters, 'histograms': histograms}
+
+
+def merge(into: dict, other: dict) -> dict:
+    """Add the samples of snapshot ``other`` to snapshot ``into``, in place; returns ``into``."""
+    counters = into.setdefault('counters', {})
+    for name, series in other.get('counters', {}).items():
+        target = counters.setdefault(name, {})
+        for labels, value in series.items():
+            target[labels] = target.get(labels, 0) + value
+    histograms = into.setdefault('histograms', {})
+    for name, series in other.get('histograms', {}).items():
+        target = histograms.setdefault(name, {})
+        for labels, histogram in series.items():
+            mine = target.get(labels)
+            if mine is None or mine['le'] != histogram['le']:
+                # Bucket layouts only differ across versions; the newer samples win
+                target[labels] = {'le': list(histogram['le']), 'counts': list(histogram['counts']),
+                                  'sum': histogram['sum']}
+                continue
+            mine['counts'] = [a + b for a, b in zip(mine['counts'], histogram['counts'])]
+            mine['sum'] += histogram['sum']
+    return into
+
+
+def load(path: str) -> dict:
+    """The snapshot saved at ``path``, or an empty one."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'counters': {}, 'histograms': {}}
+
+
+def save(path: str) -> None:
+    """Merge this process's samples into the snapshot file at ``path`` and reset them."""
+    from .locking import FileLock
+
+    with FileLock(path + '.lock', caller='metrics'):
+        data = merge(load(path), snapshot())
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+        reset()
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _header(lines: list[str], name: str, kind: str) -> None:
+    help_text = METRICS.get(name, (kind, '', ()))[1]
+    if help_text:
+        lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def _series(name: str, labels: str, extra: str = '') -> str:
+    joined = ','.join(part for part in (labels, extra) if part)
+    return f'{name}{{{joined}}}' if joined else name
+
+
+def render(data: dict | None = None, gauges: dict[str, dict[str, float]] | None = None) -> str:
+    """Prometheus text exposition of snapshot ``data`` (default: this process's samples).
+
+    ``gauges`` maps gauge names to ``{label string: value}`` for values taken
+    at scrape time, such as ``portkeeper_reservations``.
+    """
+    data = snapshot() if data is None else data
+    lines: list[str] = []
+    for name, series in sorted(data.get('counters', {}).items()):
+        _header(lines, name, 'counter')
+        for labels, value in sorted(series.items()):
+            lines.append(f'{_series(name, labels)} {_number(value)}')
+    for name, series in sorted((gauges or {}).items()):
+        _header(lines, name, 'gauge')
+        for labels, value in sorted(series.items()):
+            lines.append(f'{_series(name, labels)} {_number(value)}')
+    for name, series in sorted(data.get('histograms', {}).items()):
+        _header(lines, name, 'histogram')
+        for labels, histogram in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(list(histogram['le']) + [float('inf')], histogram['counts']):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{_series(name + "_bucket", labels, le)} {cumulative}')
+            lines.append(f'{_series(name + "_sum", labels)} {_number(histogram["sum"])}')
+            lines.append(f'{_series(name + "_count", labels)} {cumulative}')
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+if (os.environ.get("PORTKEEPER_METRICS", "").lower() not in ('', '0', 'false', 'no', 'off')
+        or DEFAULT_METRICS_FILE):
+    enable(DEFAULT_METRICS_FILE or None)
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import TYPE_CHECKING
+
+from . import metrics
+from .errors import PortKeeperError
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .core import PortRegistry, Reservation
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_POOL_INTERVAL = 1.0
+DEFAULT_POOL_TTL = 60.0
+POOL_OWNER = 'portkeeper-pool'
+
+
+class PortPool:
+    """Keeps ``size`` ports on ``host`` in ``port_range`` reserved, verified and ready to hand out.
+
+    Pooled ports are recorded in the registry as leases owned by
+    ``portkeeper-pool`` (so gc() reclaims them if the process dies) and, with
+    ``hold``, kept bound. take() pops one in O(1) without probing or touching
+    the registry. A background thread re-records handed-out ports as plain
+    reservations of their new owner, refills the pool to ``size`` once it
+    drops below ``low_water`` (half of ``size`` by default), renews the pooled
+    leases and evicts ports someone else bound or released in the meantime;
+    it wakes up at least every ``interval`` seconds. Until then a handed-out
+    port is still recorded under ``portkeeper-pool``; the registry's status(),
+    iter_status() and find() settle pending hand-outs first, so they do show
+    the new owner, while other processes see it once the thread has run.
+    """
+
+    def __init__(self, registry: PortRegistry, port_range: tuple[int, int], host: str,
+                 size: int = DEFAULT_POOL_SIZE, low_water: int | None = None, hold: bool = False,
+                 interval: float = DEFAULT_POOL_INTERVAL, ttl: float = DEFAULT_POOL_TTL):
+        if size < 1:
+            raise PortKeeperError("Pool size must be at least 1")
+        self.registry = registry
+        self.port_range = port_range
+        self.host = host
+        self.size = size
+        self.low_water = size // 2 if low_water is None else low_water
+        self.hold = hold
+        self.interval = interval
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refills = 0
+        self.error: BaseException | None = None
+        self._ready: deque[Reservation] = deque()
+        self._taken: list[tuple[Reservation, str | None]] = []
+        self._cond = threading.Condition()
+        self._maintaining = threading.Lock()
+        # A settle in progress finishes before the next one returns
+        self._settling = threading.Lock()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict[str, float]:
+        return {'size': len(self._ready), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'evictions': self.evictions, 'refills': self.refills}
+
+    # --- hand-out path ---
+    def take(self, hold: bool = False, owner: str | None = None) -> Reservation | None:
+        """Pop a ready reservation for ``owner``, or None (a miss) if the pool is empty."""
+        with self._cond:
+            try:
+                reservation = self._ready.popleft()
+            except IndexError:
+                self.misses += 1
+                self._cond.notify()
+                metrics.inc('portkeeper_pool_requests_total', result='miss')
+                return None
+            self.hits += 1
+            if len(self._ready) < self.low_water:
+                self._cond.notify()
+        if hold and reservation._holder_socket is None:
+            try:
+                reservation._holder_socket = self.registry._hold_port(reservation.host,
+                                                                      reservation.port)
+            except OSError:
+                # Taken behind our back since the last check: drop it and let the caller
+                # allocate normally
+                self.registry.release(reservation)
+                with self._cond:
+                    self.hits -= 1
+                    self.misses += 1
+                    self.evictions += 1
+                metrics.inc('portkeeper_pool_requests_total', result='miss')
+                return None
+        elif not hold:
+            self.registry._close_holders([reservation])
+        reservation.held = hold
+        reservation.ttl = None
+        reservation.expires = None
+        metrics.inc('portkeeper_pool_requests_total', result='hit')
+        with self._cond:
+            self._taken.append((reservation, owner))
+            self._cond.notify()
+        return reservation
+
+    # --- background maintenance ---
+    def _settle(self) -> None:
+        """Record handed-out ports as plain reservations of their new owner, not pool leases."""
+        with self._settling:
+            with self._cond:
+                taken, self._taken = self._taken, []
+            by_owner: dict[str | None, list[Reservation]] = {}
+            for reservation, owner in taken:
+                by_owner.setdefault(owner, []).append(reservation)
+            for owner, reservations in by_owner.items():
+                self.registry._settle(reservations, owner)
+
+    def _evict(self) -> None:
+        """Drop pooled ports someone else released or bound; renew the leases of the rest."""
+        with self._cond:
+            pooled = list(self._ready)
+        if not pooled:
+            return
+        recorded = self.registry.status()
+        # id(reservation) -> whether our registry entry is still there to release
+        stale: dict[int, bool] = {}
+        for reservation in pooled:
+            if f"{reservation.host}:{reservation.port}" not in recorded:
+                stale[id(reservation)] = False
+            elif (reservation._holder_socket is None
+                  and not self.registry._is_port_free(reservation.host, reservation.port)):
+                stale[id(reservation)] = True
+        evicted = []
+        if stale:
+            with self._cond:
+                # Ports handed out since the snapshot above are the caller's now; leave them alone
+                evicted = [r for r in self._ready if id(r) in stale]
+                self._ready = deque(r for r in self._ready if id(r) not in stale)
+                self.evictions += len(evicted)
+        for reservation in evicted:
+            if stale[id(reservation)]:
+                self.registry.release(reservation)
+            else:
+                self.registry._close_holders([reservation])
+        self.registry.renew([r for r in pooled if id(r) not in stale])
+
+    def _refill(self) -> None:
+        need = self.size - len(self._ready)
+        if need <= 0:
+            return
+        result = self.registry.reserve(self.port_range, host=self.host, hold=self.hold,
+                                       owner=POOL_OWNER, count=need, ttl=self.ttl)
+        with self._cond:
+            self._ready.extend(result if isinstance(result, list) else [result])
+            self.refills += 1
+
+    def maintain(self) -> None:
+        """Run one maintenance pass: settle, evict, renew and refill."""
+        with self._maintaining:
+            self._settle()
+            self._evict()
+            try:
+                self._refill()
+            except PortKeeperError as e:
+                self.error = e  # range exhausted for now; retry on the next pass
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: (self._stopping or self._taken
+                                             or len(self._ready) < self.low_water),
+                                    timeout=self.interval)
+                if self._stopping:
+                    return
+            try:
+                self.maintain()
+            except Exception as e:  # keep the pool alive; callers fall back to normal reserve()
+                self.error = e
+
+    def start(self) -> PortPool:
+        """Fill the pool now and start the background refiller."""
+        self.maintain()
+        self._thread = threading.Thread(target=self._run, name='portkeeper-pool', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop refilling, settle handed-out ports and release the unused ones."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._maintaining:
+            self._settle()
+            with self._cond:
+                unused, self._ready = list(self._ready), deque()
+            for reservation in unused:
+                self.registry.release(reservation)
+        self.registry._pools.pop((self.host, tuple(self.port_range)), None)
+
+    def __enter__(self) -> PortPool:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import errno
+import selectors
+import socket
+import time
+from collections import deque
+from typing import Iterable, Iterator, Tuple
+
+from . import metrics
+
+OPEN = 'open'            # something accepted the connection: the port is in use
+CLOSED = 'closed'        # connection refused: nothing is listening
+FILTERED = 'filtered'    # no answer before the timeout, or unreachable
+
+ScanResult = Tuple[str, int, str]  # (host, port, state)
+
+DEFAULT_CONCURRENCY = 512
+DEFAULT_MIN_TIMEOUT = 0.02
+
+# 10035: WSAEWOULDBLOCK
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035}
+_REFUSED = {errno.ECONNREFUSED, 10061}  # 10061: WSAECONNREFUSED
+
+
+def address_family(host: str) -> int:
+    """AF_INET6 for IPv6 literals (they contain ':'), AF_INET otherwise."""
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+
+def _fd_budget(concurrency: int) -> int:
+    """Clamp concurrency below the process file descriptor limit."""
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return concurrency
+    if soft == resource.RLIM_INFINITY:
+        return concurrency
+    return max(1, min(concurrency, soft - 64))
+
+
+class _HostState:
+    """Per-host token bucket and smoothed round-trip estimate (RFC 6298 style)."""
+
+    def __init__(self, host: str, ports: Iterable[int], rate: float | None, timeout: float):
+        self.host = host
+        self.family = address_family(host)
+        self.ports = iter(ports)
+        self.exhausted = False
+        self.rate = rate
+        self.burst = max(1.0, rate * 0.1) if rate else 0.0
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.srtt: float | None = None
+        self.rttvar = 0.0
+        self.max_timeout = timeout
+
+    def next_port(self) -> int | None:
+        port = next(self.ports, None)
+        if port is None:
+            self.exhausted = True
+        return port
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a connect may start on this host (0 when allowed now)."""
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def spend(self) -> None:
+        if self.rate:
+            self.tokens -= 1.0
+
+    def observe(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def timeout(self, adaptive: bool, min_timeout: float) -> float:
+        if not adaptive or self.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(min_timeout, self.srtt + 4 * self.rttvar))
+
+
+class Scanner:
+    """TCP connect scanner built on non-blocking sockets and a selector.
+
+    Keeps up to ``concurrency`` connects in flight across all hosts, so a scan
+    finishes in roughly ``timeout * ports / concurrency`` instead of
+    ``timeout * ports``. ``rate`` caps new connects per second per host.
+    With ``adaptive``, each host's timeout shrinks towards a multiple of its
+    observed round-trip time, never exceeding ``timeout``.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, timeout: float = 0.5,
+                 rate: float | None = None, adaptive: bool = True,
+                 min_timeout: float = DEFAULT_MIN_TIMEOUT):
+        self.concurrency = _fd_budget(max(1, concurrency))
+        self.timeout = timeout
+        self.rate = rate
+        self.adaptive = adaptive
+        self.min_timeout = min(min_timeout, timeout)
+
+    def _results(self, targets: Iterable[tuple[str, Iterable[int]]]) -> Iterator[ScanResult]:
+        """Probe every (host, ports) target, yielding (host, port, state) as probes complete."""
+        hosts: deque[_HostState] = deque(_HostState(host, ports, self.rate, self.timeout)
+                                         for host, ports in targets)
+        selector = selectors.DefaultSelector()
+        inflight: dict[int, tuple[socket.socket, _HostState, int, float, float]] = {}
+        try:
+            while hosts or inflight:
+                now = time.monotonic()
+                # Start connects round-robin across hosts, within the concurrency and rate limits
+                wait = None
+                blocked = 0
+                while hosts and len(inflight) < self.concurrency and blocked < len(hosts):
+                    state = hosts[0]
+                    delay = state.wait_time(now)
+                    if delay > 0:
+                        hosts.rotate(-1)
+                        blocked += 1
+                        wait = delay if wait is None else min(wait, delay)
+                        continue
+                    port = state.next_port()
+                    if port is None:
+                        hosts.popleft()
+                        continue
+                    blocked = 0
+                    state.spend()
+                    hosts.rotate(-1)
+                    result = self._start(selector, inflight, state, port, now)
+                    if result is not None:
+                        metrics.inc('portkeeper_scan_connects_total', state=result)
+                        yield state.host, port, result
+
+                if not inflight:
+                    if hosts and wait:
+                        time.sleep(wait)
+                    continue
+
+                deadline = min(item[4] for item in inflight.values())
+                timeout = max(0.0, deadline - time.monotonic())
+                if wait is not None:
+                    timeout = min(timeout, wait)
+                for key, _ in selector.select(timeout):
+                    sock, state, port, started, _ = inflight.pop(key.fd)
+                    selector.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    sock.close()
+                    if err == 0 or err in _REFUSED:
+                        rtt = time.monotonic() - started
+                        state.observe(rtt)
+                        metrics.observe('portkeeper_scan_connect_seconds', rtt)
+                    result = OPEN if err == 0 else CLOSED if err in _REFUSED else FILTERED
+                    metrics.inc('portkeeper_scan_connects_total', state=result)
+                    yield state.host, port, result
+
+                now = time.monotonic()
+                for fd, (sock, state, port, _, expires) in list(inflight.items()):
+                    if expires <= now:
+                        del inflight[fd]
+                        selector.unregister(sock)
+                        sock.close()
+                        metrics.inc('portkeeper_scan_connects_total', state=FILTERED)
+                        yield state.host, port, FILTERED
+        finally:
+            for sock, *_ in inflight.values():
+                sock.close()
+            selector.close()
+
+    def _start(self, selector, inflight, state: _HostState, port: int, now: float) -> str | None:
+        """Begin a non-blocking connect; returns a state if it finished immediately."""
+        try:
+            sock = socket.socket(state.family, socket.SOCK_STREAM)
+        except OSError:
+            return FILTERED
+        sock.setblocking(False)
+        try:
+            err = sock.connect_ex((state.host, port))
+        except OSError:
+            sock.close()
+            return FILTERED
+        if err in _IN_PROGRESS:
+            selector.register(sock, selectors.EVENT_WRITE)
+            inflight[sock.fileno()] = (sock, state, port, now,
+                                       now + state.timeout(self.adaptive, self.min_timeout))
+            return None
+        sock.close()
+        if err == 0:
+            return OPEN
+        return CLOSED if err in _REFUSED else FILTERED
+
+    def iter_scan(self, hosts: Iterable[str], port_range: tuple[int, int]) -> Iterator[ScanResult]:
+        """Yield ``(host, port, state)`` for ``port_range`` on every host as probes complete.
+
+        Results arrive in completion order, not port order. Closing the
+        generator early (e.g. breaking out of a loop) aborts probes in flight.
+        """
+        start, end = port_range
+        return self._results((host, range(start, end + 1)) for host in hosts)
+
+    def scan(self, hosts: Iterable[str], port_range: tuple[int, int]) -> dict[str, dict[int, str]]:
+        """Scan ``port_range`` on every host; returns ``{host: {port: state}}``."""
+        results: dict[str, dict[int, str]] = {}
+        for host, port, state in self.iter_scan(hosts, port_range):
+            results.setdefault(host, {})[port] = state
+        return results
+
+    def free_ports(self, hosts: Iterable[str], port_range: tuple[int, int]) -> dict[str, list[int]]:
+        """Ports nothing accepted a connection on, per host, in ascending order."""
+        return {host: sorted(port for port, state in states.items() if state != OPEN)
+                for host, states in self.scan(hosts, port_range).items()}
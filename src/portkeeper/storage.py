@@ -0,0 +1,1340 @@
+from __future__ import annotations
+
+import glob
+import json
+import mmap
+import os
+import random
+import re
+import struct
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, TypeVar
+
+from . import metrics
+from .errors import PortKeeperError
+from .index import MAX_PORT, EntryIndex, PortIndex, entry_matches, split_entry
+from .locking import FileLock
+
+DEFAULT_REGISTRY = os.environ.get("PORTKEEPER_REGISTRY", ".port_registry.json")
+DEFAULT_LOCKFILE = os.environ.get("PORTKEEPER_LOCK", ".port_registry.lock")
+DEFAULT_BACKEND = os.environ.get("PORTKEEPER_BACKEND", "json")
+DEFAULT_SQLITE = os.environ.get("PORTKEEPER_DB", ".port_registry.db")
+DEFAULT_BITMAP = os.environ.get("PORTKEEPER_BITMAP", ".port_registry.bmp")
+DEFAULT_COMPACT_BYTES = 1 << 20
+DEFAULT_OPTIMISTIC_RETRIES = 8
+DEFAULT_SHARD_BLOCK = 1024
+DEFAULT_SHARD_RETRIES = 64
+DEFAULT_READ_CHUNK = 1 << 16
+
+T = TypeVar('T')
+
+# Bitmap registry layout: a header page, then one bitmap of all ports per host.
+_BITMAP_MAGIC = b'PKBM'
+_BITMAP_VERSION = 1
+_BITMAP_HEADER = struct.Struct('<4sHHIQQ')
+# compacted: the log size right after the last compaction
+_BITMAP_FIELDS = ('magic', 'version', 'dirty', 'hosts', 'generation', 'compacted')
+_BITMAP_PAGE = (MAX_PORT + 1) // 8  # 8 KB: the header page and each host's bitmap
+_BITMAP_SLOT = 64  # bytes per host name in the header page's host table
+_BITMAP_MAX_HOSTS = _BITMAP_PAGE // _BITMAP_SLOT - 1
+
+
+def _fsync(f, backend: str) -> None:
+    """Flush ``f`` to disk, timing the fsync when metrics are enabled."""
+    f.flush()
+    with metrics.timed('portkeeper_fsync_seconds', backend=backend):
+        os.fsync(f.fileno())
+
+
+_JSON_WS = re.compile(r'\s*')
+
+
+def _iter_json_object(f, chunk_size: int | None = None) -> Iterator[tuple[str, object]]:
+    """Yield the members of the JSON object in text file ``f``, ``chunk_size`` characters at a time.
+
+    Only one member's text is held at once besides the current chunk. Stops at
+    the first malformed member, having yielded those before it.
+    """
+    chunk_size = chunk_size or DEFAULT_READ_CHUNK
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def token(expected: str) -> bool:
+        nonlocal buf, pos, eof
+        while True:
+            pos = _JSON_WS.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                break
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+        if buf.startswith(expected, pos):
+            pos += 1
+            return True
+        return False
+
+    def value():
+        nonlocal buf, pos, eof
+        while True:
+            pos = _JSON_WS.match(buf, pos).end()
+            try:
+                decoded, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:  # a number may go on in the next chunk
+                    pos = end
+                    return decoded
+            except ValueError:
+                if eof:
+                    raise
+            chunk = f.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+
+    try:
+        if not token('{') or token('}'):
+            return
+        while True:
+            key = value()
+            if not isinstance(key, str) or not token(':'):
+                return
+            yield key, value()
+            if not token(','):
+                return
+    except ValueError:
+        return
+
+
+class RegistryTransaction:
+    """Mutable view of the registry inside one locked backend transaction.
+
+    ``index`` holds the reserved ports per host; ``put`` and ``delete`` keep it
+    in sync so allocations within the transaction see each other. ``find``
+    looks entries up by owner, pid and label, through a secondary index where
+    the backend keeps one.
+    """
+
+    index: PortIndex
+
+    def get(self, key: str) -> dict | None:
+        raise NotImplementedError
+
+    def put(self, key: str, entry: dict) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        raise NotImplementedError
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> list[str]:
+        """Keys of entries with this owner, pid and label (None means any); no criteria, no keys."""
+        criteria = {'owner': owner, 'pid': pid, 'label': label}
+        if all(value is None for value in criteria.values()):
+            return []
+        return sorted(key for key, entry in self.items() if entry_matches(entry, criteria))
+
+
+class RegistryBackend:
+    """Storage for registry entries keyed by ``host:port``."""
+
+    name = ''
+
+    def read(self) -> dict[str, dict]:
+        """Return a snapshot of all entries without taking the write lock."""
+        raise NotImplementedError
+
+    def iter_entries(self, host: str | None = None) -> Iterator[tuple[str, dict]]:
+        """Yield ``(key, entry)`` for one snapshot of the registry, only those on ``host`` if given.
+
+        Backends that can stream the registry do so instead of reading it into memory first.
+        """
+        for key, entry in self.read().items():
+            if host is None or split_entry(key, entry)[0] == host:
+                yield key, entry
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> dict[str, dict]:
+        """Entries with this owner, pid and label (None means any) from one unlocked snapshot."""
+        criteria = {'owner': owner, 'pid': pid, 'label': label}
+        if all(value is None for value in criteria.values()):
+            return {}
+        return {key: entry for key, entry in self.iter_entries() if entry_matches(entry, criteria)}
+
+    def transaction(self):
+        """Context manager yielding a RegistryTransaction; commits on clean exit."""
+        raise NotImplementedError
+
+    def update(self, fn: Callable[[RegistryTransaction], T]) -> T:
+        """Run ``fn`` against a transaction and commit its changes, returning its result.
+
+        Backends may run ``fn`` more than once (against fresh state) when a
+        concurrent writer got in first, so it must not leave side effects from
+        an earlier call behind.
+        """
+        with self.transaction() as txn:
+            return fn(txn)
+
+    def close(self) -> None:
+        pass
+
+
+class _DictTransaction(RegistryTransaction):
+    def __init__(self, data: dict[str, dict]):
+        self.data = data
+        self.index = PortIndex.from_registry(data)
+        self.entries: EntryIndex | None = None  # built on the first find()
+        self.dirty = False
+        self.changes: dict[str, dict | None] = {}
+
+    def get(self, key: str) -> dict | None:
+        return self.data.get(key)
+
+    def put(self, key: str, entry: dict) -> None:
+        if self.entries is not None:
+            self.entries.discard(key, self.data.get(key))
+            self.entries.add(key, entry)
+        self.data[key] = entry
+        self.index.add(*split_entry(key, entry))
+        self.dirty = True
+        self.changes[key] = entry
+
+    def delete(self, key: str) -> bool:
+        entry = self.data.pop(key, None)
+        if entry is None:
+            return False
+        self.index.discard(*split_entry(key, entry))
+        if self.entries is not None:
+            self.entries.discard(key, entry)
+        self.dirty = True
+        self.changes[key] = None
+        return True
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        return iter(list(self.data.items()))
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> list[str]:
+        if self.entries is None:
+            self.entries = EntryIndex.from_registry(self.data)
+        return sorted(self.entries.find(owner=owner, pid=pid, label=label))
+
+
+class JsonBackend(RegistryBackend):
+    """The whole registry as one JSON object, rewritten atomically.
+
+    Every write renames a complete new file into place, so readers need no
+    lock (except on Windows, where they take a shared one). update() is
+    optimistic: it computes changes against a snapshot without the lock,
+    writes and fsyncs the new file aside, then holds the exclusive lock only
+    to check that the registry is unchanged and rename the new file into
+    place, so one uncontended update takes the lock exactly once. If other
+    writers committed meanwhile but touched none of the same entries, the
+    changes are merged into the current registry instead; only a real
+    conflict (the same entry changed) starts over. transaction() holds the
+    exclusive lock throughout.
+    """
+
+    name = 'json'
+
+    def __init__(self, path: str | Path, lock_path: str,
+                 retries: int = DEFAULT_OPTIMISTIC_RETRIES, create: bool = True):
+        self.path = Path(path)
+        self.lock_path = lock_path
+        self.retries = retries
+        self.conflicts = 0
+        self.merges = 0
+        if create and not self.path.exists():
+            self._write({})
+
+    def _read_raw(self) -> bytes:
+        began = time.perf_counter()
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return b''
+        metrics.observe('portkeeper_registry_read_seconds', time.perf_counter() - began,
+                        backend=self.name)
+        metrics.inc('portkeeper_registry_read_bytes_total', len(raw), backend=self.name)
+        return raw
+
+    @staticmethod
+    def _decode(raw: bytes) -> dict[str, dict]:
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def _snapshot(self) -> bytes:
+        if os.name != 'nt':
+            # Every write renames a complete file into place: an unlocked read never sees a torn one
+            return self._read_raw()
+        # Windows cannot replace a file another process has open: keep readers and writers apart
+        with FileLock(self.lock_path, shared=True, caller=f'{self.name}.read'):
+            return self._read_raw()
+
+    def read(self) -> dict[str, dict]:
+        if not self.path.exists():
+            return {}
+        return self._decode(self._snapshot())
+
+    def iter_entries(self, host: str | None = None) -> Iterator[tuple[str, dict]]:
+        with ExitStack() as stack:
+            if os.name == 'nt':
+                stack.enter_context(FileLock(self.lock_path, shared=True,
+                                             caller=f'{self.name}.read'))
+            try:
+                # The open file stays the snapshot even if a writer renames a new one into place
+                f = stack.enter_context(open(self.path, encoding='utf-8'))
+            except OSError:
+                return
+            for key, entry in _iter_json_object(f):
+                if isinstance(entry, dict) and (host is None or split_entry(key, entry)[0] == host):
+                    yield key, entry
+            metrics.inc('portkeeper_registry_read_bytes_total', f.buffer.tell(), backend=self.name)
+
+    def _stage(self, data: dict[str, dict]) -> Path:
+        """Write ``data`` to a private temporary file next to the registry and fsync it."""
+        tmp = Path(f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp")
+        began = time.perf_counter()
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+            _fsync(f, self.name)
+            size = f.tell()
+        metrics.observe('portkeeper_registry_write_seconds', time.perf_counter() - began,
+                        backend=self.name)
+        metrics.inc('portkeeper_registry_write_bytes_total', size, backend=self.name)
+        return tmp
+
+    def _write(self, data: dict[str, dict]) -> None:
+        os.replace(self._stage(data), self.path)
+
+    def update(self, fn: Callable[[RegistryTransaction], T]) -> T:
+        for attempt in range(self.retries):
+            raw = self._snapshot()
+            base = self._decode(raw)
+            txn = _DictTransaction(dict(base))
+            result = fn(txn)
+            if not txn.dirty:
+                return result
+            tmp = self._stage(txn.data)
+            try:
+                with FileLock(self.lock_path, caller=f'{self.name}.commit'):
+                    current_raw = self._read_raw()
+                    if current_raw == raw:
+                        os.replace(tmp, self.path)
+                        return result
+                    current = self._decode(current_raw)
+                    if all(current.get(key) == base.get(key) for key in txn.changes):
+                        for key, entry in txn.changes.items():
+                            if entry is None:
+                                current.pop(key, None)
+                            else:
+                                current[key] = entry
+                        self._write(current)
+                        self.merges += 1
+                        return result
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+            self.conflicts += 1
+            metrics.inc('portkeeper_registry_conflicts_total', backend=self.name)
+            time.sleep(random.uniform(0, 0.001 * (1 << attempt)))
+        # Heavily contended: stop racing and serialize behind the exclusive lock
+        return super().update(fn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[RegistryTransaction]:
+        with FileLock(self.lock_path, caller=f'{self.name}.transaction'):
+            txn = _DictTransaction(self._decode(self._read_raw()))
+            yield txn
+            if txn.dirty:
+                self._write(txn.data)
+
+
+class _SQLiteTransaction(RegistryTransaction):
+    def __init__(self, conn):
+        self.conn = conn
+        self.index = PortIndex(loader=self._host_ports)
+
+    def _host_ports(self, host: str) -> Iterator[int]:
+        for (port,) in self.conn.execute('SELECT port FROM reservations WHERE host = ?', (host,)):
+            yield port
+
+    def get(self, key: str) -> dict | None:
+        host, port = split_entry(key)
+        row = self.conn.execute('SELECT data FROM reservations WHERE host = ? AND port = ?',
+                                (host, port)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, entry: dict) -> None:
+        host, port = split_entry(key, entry)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO reservations (host, port, owner, timestamp, pid, label, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', SQLiteBackend._row(host, port, entry))
+        self.index.add(host, port)
+
+    def delete(self, key: str) -> bool:
+        host, port = split_entry(key)
+        cursor = self.conn.execute('DELETE FROM reservations WHERE host = ? AND port = ?',
+                                   (host, port))
+        self.index.discard(host, port)
+        return cursor.rowcount > 0
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        rows = self.conn.execute('SELECT host, port, data FROM reservations').fetchall()
+        for host, port, data in rows:
+            yield f"{host}:{port}", json.loads(data)
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> list[str]:
+        rows = SQLiteBackend._select(self.conn, owner, pid, label)
+        return sorted(f"{host}:{port}" for host, port, _ in rows)
+
+
+class SQLiteBackend(RegistryBackend):
+    """SQLite database in WAL mode with one row per (host, port).
+
+    Reservations and releases are row-level inserts and deletes inside a
+    ``BEGIN IMMEDIATE`` transaction, which takes the place of FileLock, so
+    write cost does not grow with the registry and readers never block
+    writers. Connections are per thread and per process. Owner, pid and
+    label are columns with their own indexes.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS reservations ('
+        ' host TEXT NOT NULL,'
+        ' port INTEGER NOT NULL,'
+        " owner TEXT NOT NULL DEFAULT '',"
+        ' timestamp REAL NOT NULL DEFAULT 0,'
+        ' data TEXT NOT NULL,'
+        ' pid INTEGER,'
+        ' label TEXT,'
+        ' PRIMARY KEY (host, port)'
+        ') WITHOUT ROWID'
+    )
+    # Columns added since the first schema, backfilled from ``data`` when opening an older database
+    ADDED_COLUMNS = (('pid', 'INTEGER'), ('label', 'TEXT'))
+    INDEXED_COLUMNS = ('owner', 'pid', 'label')
+
+    def __init__(self, path: str | Path, timeout: float = 30.0):
+        try:
+            import sqlite3
+        except ImportError as e:  # pragma: no cover - Python built without sqlite
+            raise PortKeeperError("The sqlite backend requires the sqlite3 module") from e
+        self._sqlite3 = sqlite3
+        self.path = Path(path)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = self._sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(self.SCHEMA)
+        self._upgrade(conn)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _upgrade(self, conn) -> None:
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(reservations)')}
+        if (all(column in columns for column, _ in self.ADDED_COLUMNS)
+                and not self._missing_indexes(conn)):
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(reservations)')}
+            added = [column for column, _ in self.ADDED_COLUMNS if column not in columns]
+            for column, kind in self.ADDED_COLUMNS:
+                if column in added:
+                    conn.execute(f'ALTER TABLE reservations ADD COLUMN {column} {kind}')
+            if added:
+                rows = conn.execute('SELECT host, port, data FROM reservations').fetchall()
+                conn.executemany('UPDATE reservations SET pid = ?, label = ? '
+                                 'WHERE host = ? AND port = ?',
+                                 [self._row(host, port, json.loads(data))[4:6] + (host, port)
+                                  for host, port, data in rows])
+            for column in self.INDEXED_COLUMNS:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS reservations_{column} '
+                             f'ON reservations ({column})')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _missing_indexes(self, conn) -> bool:
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        names = {row[0] for row in rows}
+        return any(f'reservations_{column}' not in names for column in self.INDEXED_COLUMNS)
+
+    @staticmethod
+    def _row(host: str, port: int, entry: dict) -> tuple:
+        pid, label = entry.get('pid'), entry.get('label')
+        return (host, port, entry.get('owner', ''), entry.get('timestamp', 0.0),
+                pid if isinstance(pid, int) else None, label if isinstance(label, str) else None,
+                json.dumps(entry))
+
+    @staticmethod
+    def _select(conn, owner: str | None, pid: int | None,
+                label: str | None) -> list[tuple[str, int, str]]:
+        criteria = [(column, value)
+                    for column, value in (('owner', owner), ('pid', pid), ('label', label))
+                    if value is not None]
+        if not criteria:
+            return []
+        where = ' AND '.join(f'{column} = ?' for column, _ in criteria)
+        return conn.execute(f'SELECT host, port, data FROM reservations WHERE {where}',
+                            [value for _, value in criteria]).fetchall()
+
+    def read(self) -> dict[str, dict]:
+        with metrics.timed('portkeeper_registry_read_seconds', backend=self.name):
+            rows = self._connect().execute('SELECT host, port, data FROM reservations').fetchall()
+        return {f"{host}:{port}": json.loads(data) for host, port, data in rows}
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> dict[str, dict]:
+        return {f"{host}:{port}": json.loads(data)
+                for host, port, data in sorted(self._select(self._connect(), owner, pid, label))}
+
+    def iter_entries(self, host: str | None = None) -> Iterator[tuple[str, dict]]:
+        # A cursor of its own, so the rows come from one read snapshot without fetching them all
+        if host is None:
+            cursor = self._connect().execute('SELECT host, port, data FROM reservations')
+        else:
+            cursor = self._connect().execute('SELECT host, port, data FROM reservations '
+                                             'WHERE host = ?', (host,))
+        try:
+            for row_host, port, data in cursor:
+                yield f"{row_host}:{port}", json.loads(data)
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[RegistryTransaction]:
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield _SQLiteTransaction(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        with metrics.timed('portkeeper_registry_write_seconds', backend=self.name):
+            conn.execute('COMMIT')
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _OverlayTransaction(RegistryTransaction):
+    """Changes layered over a backend's cached state until commit."""
+
+    def __init__(self, state: dict[str, dict], index: PortIndex, entries: EntryIndex | None = None):
+        self.state = state
+        self.index = index
+        # The backend's secondary index of ``state``; read, never changed here
+        self.entries = entries
+        self.changes: dict[str, dict | None] = {}
+
+    def get(self, key: str) -> dict | None:
+        if key in self.changes:
+            return self.changes[key]
+        return self.state.get(key)
+
+    def put(self, key: str, entry: dict) -> None:
+        self.changes[key] = entry
+        self.index.add(*split_entry(key, entry))
+
+    def delete(self, key: str) -> bool:
+        entry = self.get(key)
+        if entry is None:
+            return False
+        self.changes[key] = None
+        self.index.discard(*split_entry(key, entry))
+        return True
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        for key, entry in list(self.state.items()):
+            if key not in self.changes:
+                yield key, entry
+        for key, entry in list(self.changes.items()):
+            if entry is not None:
+                yield key, entry
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> list[str]:
+        if self.entries is None:
+            return super().find(owner, pid, label)
+        criteria = {'owner': owner, 'pid': pid, 'label': label}
+        if all(value is None for value in criteria.values()):
+            return []
+        found = {key for key in self.entries.find(**criteria) if key not in self.changes}
+        found.update(key for key, entry in self.changes.items()
+                     if entry is not None and entry_matches(entry, criteria))
+        return sorted(found)
+
+
+class JournalBackend(RegistryBackend):
+    """JSON snapshot plus an append-only journal of reserve and release records.
+
+    Each transaction appends its records to ``<path>.journal`` with one write
+    and one fsync, so commit cost does not depend on registry size. The state
+    is cached in memory and only journal records past the last seen offset are
+    replayed. Once the journal grows past ``compact_threshold`` bytes it is
+    folded into the snapshot, in a background thread by default. The snapshot
+    keeps the JSON backend's format.
+    """
+
+    name = 'journal'
+
+    def __init__(self, path: str | Path, lock_path: str,
+                 compact_threshold: int = DEFAULT_COMPACT_BYTES, background: bool = True):
+        self.path = Path(path)
+        self.journal_path = Path(str(self.path) + '.journal')
+        self.lock_path = lock_path
+        self.compact_threshold = compact_threshold
+        self.background = background
+        self._mutex = threading.RLock()
+        self._state: dict[str, dict] = {}
+        self._index = PortIndex()
+        self._entries = EntryIndex()
+        self._snapshot_id: tuple[int, int, int] | None = None
+        self._offset = 0
+        self._torn = False
+        self._compactor: threading.Thread | None = None
+        if not self.path.exists():
+            with FileLock(self.lock_path, caller=f'{self.name}.create'):
+                if not self.path.exists():
+                    self._write_snapshot({})
+
+    def _stat_snapshot(self) -> tuple[int, int, int] | None:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _write_snapshot(self, data: dict[str, dict]) -> None:
+        tmp = Path(str(self.path) + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+            _fsync(f, self.name)
+        os.replace(tmp, self.path)
+
+    def _apply(self, record: dict) -> None:
+        key = record.get('key')
+        if not key:
+            return
+        if record.get('op') == 'reserve':
+            entry = record.get('entry') or {}
+            self._entries.discard(key, self._state.get(key))
+            self._state[key] = entry
+            self._index.add(*split_entry(key, entry))
+            self._entries.add(key, entry)
+        elif record.get('op') == 'release':
+            entry = self._state.pop(key, None)
+            if entry is not None:
+                self._index.discard(*split_entry(key, entry))
+                self._entries.discard(key, entry)
+
+    def _refresh(self) -> None:
+        """Bring the cached state up to date with the snapshot and the journal tail."""
+        while True:
+            snapshot_id = self._stat_snapshot()
+            try:
+                journal_size = os.path.getsize(self.journal_path)
+            except OSError:
+                journal_size = 0
+            if snapshot_id != self._snapshot_id or journal_size < self._offset:
+                # A compaction happened: start over from the new checkpoint
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        self._state = json.load(f)
+                except Exception:
+                    self._state = {}
+                self._index = PortIndex.from_registry(self._state)
+                self._entries = EntryIndex.from_registry(self._state)
+                self._snapshot_id = snapshot_id
+                self._offset = 0
+            if journal_size > self._offset:
+                began = time.perf_counter()
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(self._offset)
+                    tail = f.read(journal_size - self._offset)
+                metrics.observe('portkeeper_registry_read_seconds', time.perf_counter() - began,
+                                backend=self.name)
+                metrics.inc('portkeeper_registry_read_bytes_total', len(tail), backend=self.name)
+                complete = tail.rfind(b'\n') + 1
+                for line in tail[:complete].splitlines():
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        continue
+                self._offset += complete
+                self._torn = complete < len(tail)
+            # Retry if the snapshot was replaced while the journal was being read
+            if self._stat_snapshot() == self._snapshot_id:
+                return
+
+    def read(self) -> dict[str, dict]:
+        with self._mutex:
+            self._refresh()
+            return dict(self._state)
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> dict[str, dict]:
+        with self._mutex:
+            self._refresh()
+            return {key: self._state[key]
+                    for key in sorted(self._entries.find(owner=owner, pid=pid, label=label))}
+
+    def journal_size(self) -> int:
+        try:
+            return os.path.getsize(self.journal_path)
+        except OSError:
+            return 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[RegistryTransaction]:
+        with FileLock(self.lock_path, caller=f'{self.name}.transaction'), self._mutex:
+            self._refresh()
+            if self._torn:
+                # Drop a record left half-written by a crashed writer before appending
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(self._offset)
+                self._torn = False
+            txn = _OverlayTransaction(self._state, self._index.copy(), self._entries)
+            yield txn
+            if not txn.changes:
+                return
+            records = []
+            for key, entry in txn.changes.items():
+                if entry is None:
+                    records.append({'op': 'release', 'key': key, 'ts': time.time()})
+                else:
+                    records.append({'op': 'reserve', 'key': key, 'entry': entry})
+            payload = ''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                              for record in records).encode('utf-8')
+            began = time.perf_counter()
+            with open(self.journal_path, 'ab') as f:
+                f.write(payload)
+                _fsync(f, self.name)
+            metrics.observe('portkeeper_registry_write_seconds', time.perf_counter() - began,
+                            backend=self.name)
+            metrics.inc('portkeeper_registry_write_bytes_total', len(payload), backend=self.name)
+            for record in records:
+                self._apply(record)
+            self._offset += len(payload)
+            # Still holding the lock, so compacting in line does not take it a second time
+            if self.journal_size() > self.compact_threshold:
+                self._schedule_compaction()
+
+    def _schedule_compaction(self) -> None:
+        if not self.background:
+            self.compact()
+            return
+        with self._mutex:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self.compact, name='portkeeper-compact',
+                                               daemon=True)
+            self._compactor.start()
+
+    def compact(self) -> None:
+        """Fold the journal into a new snapshot and truncate it."""
+        with FileLock(self.lock_path, caller=f'{self.name}.compact'), self._mutex:
+            self._refresh()
+            if self._offset == 0 and not self._torn:
+                return
+            self._write_snapshot(self._state)
+            with open(self.journal_path, 'wb') as f:
+                _fsync(f, self.name)
+            self._snapshot_id = self._stat_snapshot()
+            self._offset = 0
+            self._torn = False
+
+    def close(self) -> None:
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+
+class MemoryBackend(RegistryBackend):
+    """Registry held in process memory, e.g. by the portkeeperd daemon.
+
+    ``on_commit`` is called with each committed transaction's changes
+    (key -> entry, or None for a release) so they can be persisted elsewhere.
+    """
+
+    name = 'memory'
+
+    def __init__(self, entries: dict[str, dict] | None = None, on_commit=None, path: str = ''):
+        self.path = Path(path)
+        self.on_commit = on_commit
+        self._mutex = threading.RLock()
+        self._state: dict[str, dict] = dict(entries or {})
+        self._index = PortIndex.from_registry(self._state)
+        self._entries = EntryIndex.from_registry(self._state)
+
+    def read(self) -> dict[str, dict]:
+        with self._mutex:
+            return dict(self._state)
+
+    def find(self, owner: str | None = None, pid: int | None = None,
+             label: str | None = None) -> dict[str, dict]:
+        with self._mutex:
+            return {key: self._state[key]
+                    for key in sorted(self._entries.find(owner=owner, pid=pid, label=label))}
+
+    @contextmanager
+    def transaction(self) -> Iterator[RegistryTransaction]:
+        with self._mutex:
+            txn = _OverlayTransaction(self._state, self._index.copy(), self._entries)
+            yield txn
+            if not txn.changes:
+                return
+            for key, entry in txn.changes.items():
+                old = self._state.pop(key, None)
+                if old is not None:
+                    self._entries.discard(key, old)
+                if entry is None:
+                    if old is not None:
+                        self._index.discard(*split_entry(key, old))
+                else:
+                    self._state[key] = entry
+                    self._index.add(*split_entry(key, entry))
+                    self._entries.add(key, entry)
+            if self.on_commit is not None:
+                self.on_commit(dict(txn.changes))
+
+
+class _ShardedTransaction(RegistryTransaction):
+    """Loads shards as the transaction touches them and records changes per shard."""
+
+    def __init__(self, backend: ShardedBackend):
+        self.backend = backend
+        # name -> (raw, base, data)
+        self.shards: dict[str, tuple[bytes, dict[str, dict], dict[str, dict]]] = {}
+        self.changes: dict[str, dict[str, dict | None]] = {}
+        self.index = PortIndex(loader=self._host_ports)
+        self._listed: set[str] = set()
+
+    def _load(self, name: str, host: str | None = None) -> dict[str, dict]:
+        if name not in self.shards:
+            if host in self._listed:
+                # The index already saw every shard of this host and this one did not exist;
+                # keep that view so a shard created since then shows up as a conflict at commit
+                raw = b''
+            else:
+                # Shards are only ever replaced by rename, so an unlocked read is consistent
+                raw = self.backend._shard(name)._read_raw()
+            base = JsonBackend._decode(raw)
+            self.shards[name] = (raw, base, dict(base))
+        return self.shards[name][2]
+
+    def _host_ports(self, host: str) -> Iterator[int]:
+        self._listed.add(host)
+        for name in self.backend._host_shards(host):
+            for key, entry in list(self._load(name).items()):
+                entry_host, port = split_entry(key, entry)
+                if entry_host == host:
+                    yield port
+
+    def get(self, key: str) -> dict | None:
+        host, port = split_entry(key)
+        return self._load(self.backend._shard_name(host, port), host).get(key)
+
+    def put(self, key: str, entry: dict) -> None:
+        host, port = split_entry(key, entry)
+        name = self.backend._shard_name(host, port)
+        self._load(name, host)[key] = entry
+        self.changes.setdefault(name, {})[key] = entry
+        self.index.add(host, port)
+
+    def delete(self, key: str) -> bool:
+        host, port = split_entry(key)
+        name = self.backend._shard_name(host, port)
+        entry = self._load(name, host).pop(key, None)
+        if entry is None:
+            return False
+        self.changes.setdefault(name, {})[key] = None
+        self.index.discard(*split_entry(key, entry))
+        return True
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        for name in sorted(set(self.backend._shard_names()) | set(self.shards)):
+            yield from list(self._load(name).items())
+
+
+class ShardedBackend(RegistryBackend):
+    """One JSON file and one lock per host and ``block_size``-port block, in directory ``path``.
+
+    Allocations on different hosts or distant ranges touch different shards,
+    so they neither wait for each other's locks nor rewrite each other's
+    files. Shards are read without taking locks; at commit the changed
+    shards are locked in name order (so concurrent commits cannot deadlock),
+    checked for concurrent changes to the same entries, and replaced. A
+    transaction spanning several shards is atomic against other writers,
+    but a crash halfway through its commit can leave only some shards written.
+    """
+
+    name = 'sharded'
+
+    def __init__(self, path: str | Path, block_size: int = DEFAULT_SHARD_BLOCK,
+                 retries: int = DEFAULT_SHARD_RETRIES):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.block_size = block_size
+        self.retries = retries
+        self.conflicts = 0
+
+    @staticmethod
+    def _safe(host: str) -> str:
+        return re.sub(r'[^A-Za-z0-9.\-]', '_', host)
+
+    def _shard_name(self, host: str, port: int) -> str:
+        return f"{self._safe(host)}@{port // self.block_size}"
+
+    def _shard(self, name: str) -> JsonBackend:
+        return JsonBackend(self.path / f"{name}.json", str(self.path / f"{name}.lock"),
+                           create=False)
+
+    def _shard_names(self, pattern: str = '*') -> list[str]:
+        return sorted(p.stem for p in self.path.glob(f"{pattern}.json"))
+
+    def _host_shards(self, host: str) -> list[str]:
+        return self._shard_names(f"{glob.escape(self._safe(host))}@*")
+
+    def read(self) -> dict[str, dict]:
+        entries: dict[str, dict] = {}
+        for name in self._shard_names():
+            entries.update(JsonBackend._decode(self._shard(name)._read_raw()))
+        return entries
+
+    def iter_entries(self, host: str | None = None) -> Iterator[tuple[str, dict]]:
+        # One shard in memory at a time; each shard is its own snapshot
+        for name in self._shard_names() if host is None else self._host_shards(host):
+            yield from self._shard(name).iter_entries(host)
+
+    def _commit(self, txn: _ShardedTransaction) -> bool:
+        """Write the transaction's changed shards; False if another writer changed those entries."""
+        dirty = sorted(name for name, changes in txn.changes.items() if changes)
+        if not dirty:
+            return True
+        shards = {name: self._shard(name) for name in dirty}
+        staged = {name: shards[name]._stage(txn.shards[name][2]) for name in dirty}
+        try:
+            with ExitStack() as stack:
+                for name in dirty:
+                    stack.enter_context(FileLock(shards[name].lock_path,
+                                                 caller=f'{self.name}.commit'))
+                merged: dict[str, dict[str, dict] | None] = {}
+                for name in dirty:
+                    raw, base, _ = txn.shards[name]
+                    current_raw = shards[name]._read_raw()
+                    if current_raw == raw:
+                        merged[name] = None
+                        continue
+                    current = JsonBackend._decode(current_raw)
+                    changes = txn.changes[name]
+                    if any(current.get(key) != base.get(key) for key in changes):
+                        return False
+                    for key, entry in changes.items():
+                        if entry is None:
+                            current.pop(key, None)
+                        else:
+                            current[key] = entry
+                    merged[name] = current
+                for name in dirty:
+                    if merged[name] is None:
+                        os.replace(staged[name], shards[name].path)
+                    else:
+                        shards[name]._write(merged[name])
+            return True
+        finally:
+            for tmp in staged.values():
+                if tmp.exists():
+                    tmp.unlink()
+
+    def update(self, fn: Callable[[RegistryTransaction], T]) -> T:
+        for attempt in range(self.retries):
+            txn = _ShardedTransaction(self)
+            result = fn(txn)
+            if self._commit(txn):
+                return result
+            self.conflicts += 1
+            metrics.inc('portkeeper_registry_conflicts_total', backend=self.name)
+            time.sleep(random.uniform(0, min(0.05, 0.001 * (1 << attempt))))
+        raise PortKeeperError(f"Registry update still conflicting after {self.retries} attempts")
+
+    @contextmanager
+    def transaction(self) -> Iterator[RegistryTransaction]:
+        txn = _ShardedTransaction(self)
+        yield txn
+        if not self._commit(txn):
+            self.conflicts += 1
+            metrics.inc('portkeeper_registry_conflicts_total', backend=self.name)
+            raise PortKeeperError("Registry entries changed concurrently; transaction aborted")
+
+
+class _MappedIndex(PortIndex):
+    """PortIndex whose host bitmaps are copied straight out of a BitmapBackend's mapping.
+
+    Loading a host is one 8 KB copy, whatever the number of reservations;
+    changes stay private to the transaction until it commits.
+    """
+
+    def __init__(self, backend: BitmapBackend):
+        super().__init__()
+        self._backend = backend
+
+    def copy(self) -> PortIndex:
+        index = _MappedIndex(self._backend)
+        index._bitmaps = {host: bytearray(bitmap) for host, bitmap in self._bitmaps.items()}
+        return index
+
+    def _bitmap(self, host: str) -> bytearray:
+        bitmap = self._bitmaps.get(host)
+        if bitmap is None:
+            bitmap = self._bitmaps[host] = self._backend._host_bitmap(host)
+        return bitmap
+
+    def _lookup(self, host: str) -> bytearray | None:
+        return self._bitmap(host)
+
+
+class _BitmapTransaction(RegistryTransaction):
+    def __init__(self, backend: BitmapBackend):
+        self.backend = backend
+        self.index = _MappedIndex(backend)
+        self.changes: dict[str, dict | None] = {}
+
+    def get(self, key: str) -> dict | None:
+        if key in self.changes:
+            return self.changes[key]
+        return self.backend._entries().get(key)
+
+    def put(self, key: str, entry: dict) -> None:
+        self.changes[key] = entry
+        self.index.add(*split_entry(key, entry))
+
+    def delete(self, key: str) -> bool:
+        # Decided by the bitmap, so releases never need the metadata log
+        host, port = split_entry(key, self.changes.get(key))
+        if not self.index.is_reserved(host, port):
+            return False
+        self.changes[key] = None
+        self.index.discard(host, port)
+        return True
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        for key, entry in list(self.backend._entries().items()):
+            if key not in self.changes:
+                yield key, entry
+        for key, entry in list(self.changes.items()):
+            if entry is not None:
+                yield key, entry
+
+
+class BitmapBackend(RegistryBackend):
+    """Per-host port bitmaps in a memory-mapped file, with entry metadata in a side log.
+
+    ``path`` starts with an 8 KB header page (host table, generation
+    counter, dirty flag) followed by one 8 KB bitmap per host, so allocation
+    copies a host's bitmap out of the mapping instead of deserializing the
+    registry, and is_reserved() reads the shared mapping directly: writes by
+    other processes are visible without re-reading anything. Owner,
+    timestamp, pid and lease fields live in ``<path>.meta``, an append-only
+    log in the journal backend's record format that is read incrementally,
+    and only when entries themselves are needed (status, renew, gc), never to
+    reserve or release. A writer that finds the dirty flag set (a crash
+    mid-commit) rebuilds the bitmaps from the log.
+    Holds at most 127 hosts.
+    """
+
+    name = 'bitmap'
+
+    def __init__(self, path: str | Path, lock_path: str,
+                 compact_threshold: int = DEFAULT_COMPACT_BYTES):
+        self.path = Path(path)
+        self.meta_path = Path(str(self.path) + '.meta')
+        self.lock_path = lock_path
+        self.compact_threshold = compact_threshold
+        self._mutex = threading.RLock()
+        self._map: mmap.mmap | None = None
+        self._slots: dict[str, int] = {}
+        self._state: dict[str, dict] = {}
+        self._meta_id: int | None = None
+        self._offset = 0
+        self._log_size = 0
+        with FileLock(self.lock_path, caller=f'{self.name}.create'):
+            if not self.path.exists() or os.path.getsize(self.path) < _BITMAP_PAGE:
+                tmp = Path(str(self.path) + '.tmp')
+                with open(tmp, 'wb') as f:
+                    header = _BITMAP_HEADER.pack(_BITMAP_MAGIC, _BITMAP_VERSION, 0, 0, 0, 0)
+                    f.write(header.ljust(_BITMAP_PAGE, b'\0'))
+                    _fsync(f, self.name)
+                os.replace(tmp, self.path)
+        self._remap()
+        if self._header()['magic'] != _BITMAP_MAGIC:
+            raise PortKeeperError(f"{self.path} is not a portkeeper bitmap registry")
+
+    # --- mapping ---
+    def _remap(self) -> None:
+        with open(self.path, 'r+b') as f:
+            mapping = mmap.mmap(f.fileno(), 0)
+        if self._map is not None:
+            self._map.close()
+        self._map = mapping
+
+    def _header(self) -> dict:
+        return dict(zip(_BITMAP_FIELDS, _BITMAP_HEADER.unpack_from(self._map, 0)))
+
+    def _set_header(self, **fields: int) -> None:
+        header = self._header()
+        header.update(fields)
+        _BITMAP_HEADER.pack_into(self._map, 0, *(header[field] for field in _BITMAP_FIELDS))
+
+    def _slot(self, host: str) -> int | None:
+        """Index of ``host``'s bitmap, mapping any hosts added by other processes."""
+        slot = self._slots.get(host)
+        if slot is not None:
+            return slot
+        hosts = self._header()['hosts']
+        if len(self._map) < _BITMAP_PAGE * (hosts + 1):
+            self._remap()
+        for i in range(len(self._slots), hosts):
+            slot = self._map[_BITMAP_SLOT * (i + 1):_BITMAP_SLOT * (i + 2)]
+            name = slot.rstrip(b'\0').decode('utf-8')
+            self._slots[name] = i
+        return self._slots.get(host)
+
+    def _add_host(self, host: str) -> int:
+        """Give ``host`` a bitmap; call with the lock held."""
+        name = host.encode('utf-8')
+        if len(name) >= _BITMAP_SLOT:
+            raise PortKeeperError(f"Host name too long for the bitmap registry: {host}")
+        hosts = self._header()['hosts']
+        if hosts >= _BITMAP_MAX_HOSTS:
+            raise PortKeeperError(f"The bitmap registry holds at most {_BITMAP_MAX_HOSTS} hosts")
+        self._map.close()  # a mapped file cannot be resized on every platform
+        self._map = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(_BITMAP_PAGE * (hosts + 2))
+        self._remap()
+        slot = name.ljust(_BITMAP_SLOT, b'\0')
+        self._map[_BITMAP_SLOT * (hosts + 1):_BITMAP_SLOT * (hosts + 2)] = slot
+        self._set_header(hosts=hosts + 1)
+        self._slots[host] = hosts
+        return hosts
+
+    def _host_bitmap(self, host: str) -> bytearray:
+        with self._mutex:
+            slot = self._slot(host)
+            if slot is None:
+                return bytearray(_BITMAP_PAGE)
+            offset = _BITMAP_PAGE * (slot + 1)
+            return bytearray(self._map[offset:offset + _BITMAP_PAGE])
+
+    def is_reserved(self, host: str, port: int) -> bool:
+        """Test one bit in the shared mapping, without locking or reading metadata."""
+        with self._mutex:
+            slot = self._slot(host)
+            if slot is None or not 0 <= port <= MAX_PORT:
+                return False
+            return bool(self._map[_BITMAP_PAGE * (slot + 1) + (port >> 3)] & (1 << (port & 7)))
+
+    def generation(self) -> int:
+        """Number of commits so far; changes whenever any process commits."""
+        with self._mutex:
+            return self._header()['generation']
+
+    # --- metadata log ---
+    def _apply(self, record: dict) -> None:
+        key = record.get('key')
+        if not key:
+            return
+        if record.get('op') == 'reserve':
+            self._state[key] = record.get('entry') or {}
+        elif record.get('op') == 'release':
+            self._state.pop(key, None)
+
+    def _entries(self) -> dict[str, dict]:
+        """Entry metadata, brought up to date with the tail of the side log."""
+        with self._mutex:
+            try:
+                f = open(self.meta_path, 'rb')
+            except FileNotFoundError:
+                self._state, self._meta_id, self._offset = {}, None, 0
+                return self._state
+            with f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self._meta_id or st.st_size < self._offset:
+                    # Compacted since we last looked: replay the new log from the start
+                    self._state, self._meta_id, self._offset = {}, st.st_ino, 0
+                if st.st_size > self._offset:
+                    f.seek(self._offset)
+                    tail = f.read(st.st_size - self._offset)
+                    metrics.inc('portkeeper_registry_read_bytes_total', len(tail),
+                                backend=self.name)
+                    complete = tail.rfind(b'\n') + 1
+                    for line in tail[:complete].splitlines():
+                        try:
+                            self._apply(json.loads(line))
+                        except ValueError:
+                            continue
+                    self._offset += complete
+            return self._state
+
+    def _repair_log(self) -> int:
+        """Drop a record left half-written by a crashed writer; returns the log size."""
+        try:
+            f = open(self.meta_path, 'r+b')
+        except FileNotFoundError:
+            return 0
+        with f:
+            size = end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+            return end
+
+    def read(self) -> dict[str, dict]:
+        with self._mutex:
+            return dict(self._entries())
+
+    def _rebuild(self) -> None:
+        """Recompute every bitmap from the metadata log after an interrupted commit."""
+        hosts = self._header()['hosts']
+        self._map[_BITMAP_PAGE:_BITMAP_PAGE * (hosts + 1)] = bytes(_BITMAP_PAGE * hosts)
+        for key, entry in self._entries().items():
+            host, port = split_entry(key, entry)
+            slot = self._slot(host)
+            if slot is None:
+                slot = self._add_host(host)
+            self._map[_BITMAP_PAGE * (slot + 1) + (port >> 3)] |= 1 << (port & 7)
+        self._set_header(dirty=0, generation=self._header()['generation'] + 1)
+        self._map.flush()
+
+    @contextmanager
+    def transaction(self) -> Iterator[RegistryTransaction]:
+        with FileLock(self.lock_path, caller=f'{self.name}.transaction'), self._mutex:
+            self._log_size = self._repair_log()
+            if self._header()['dirty']:
+                self._rebuild()
+            txn = _BitmapTransaction(self)
+            yield txn
+            if not txn.changes:
+                return
+            self._commit(txn)
+            # Compact once the log is over the threshold and mostly superseded records
+            if self._log_size > max(self.compact_threshold, 2 * self._header()['compacted']):
+                self.compact()
+
+    def _commit(self, txn: _BitmapTransaction) -> None:
+        began = time.perf_counter()
+        hosts = {split_entry(key, entry)[0] for key, entry in txn.changes.items()}
+        for host in hosts:
+            if self._slot(host) is None:
+                self._add_host(host)
+        self._set_header(dirty=1)
+        self._map.flush(0, _BITMAP_PAGE)
+        records = []
+        for key, entry in txn.changes.items():
+            if entry is None:
+                records.append({'op': 'release', 'key': key, 'ts': time.time()})
+            else:
+                records.append({'op': 'reserve', 'key': key, 'entry': entry})
+        payload = ''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                          for record in records).encode('utf-8')
+        with open(self.meta_path, 'ab') as f:
+            f.write(payload)
+            _fsync(f, self.name)
+            self._log_size = f.tell()
+        for host in hosts:
+            offset = _BITMAP_PAGE * (self._slots[host] + 1)
+            self._map[offset:offset + _BITMAP_PAGE] = txn.index._bitmap(host)
+        self._set_header(dirty=0, generation=self._header()['generation'] + 1)
+        self._map.flush()
+        metrics.observe('portkeeper_registry_write_seconds', time.perf_counter() - began,
+                        backend=self.name)
+        metrics.inc('portkeeper_registry_write_bytes_total',
+                    len(payload) + _BITMAP_PAGE * (len(hosts) + 1), backend=self.name)
+
+    def compact(self) -> None:
+        """Rewrite the metadata log with one record per live entry."""
+        with FileLock(self.lock_path, caller=f'{self.name}.compact'), self._mutex:
+            entries = self._entries()
+            tmp = Path(str(self.meta_path) + '.tmp')
+            with open(tmp, 'wb') as f:
+                for key, entry in entries.items():
+                    f.write(json.dumps({'op': 'reserve', 'key': key, 'entry': entry},
+                                       separators=(',', ':')).encode('utf-8') + b'\n')
+                _fsync(f, self.name)
+            os.replace(tmp, self.meta_path)
+            self._entries()
+            self._log_size = self._offset
+            self._set_header(compacted=self._offset)
+
+    def close(self) -> None:
+        with self._mutex:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+
+def open_backend(name: str | None = None, path: str | Path | None = None,
+                 lock_path: str | None = None) -> RegistryBackend:
+    """Create a registry backend by name, using the defaults for unset paths.
+
+    ``name`` is 'json', 'journal', 'sqlite', 'sharded' or 'bitmap'. The
+    sharded backend keeps its shards in the directory ``<path>.d``.
+    """
+    name = name or DEFAULT_BACKEND
+    if name == 'json':
+        return JsonBackend(path or DEFAULT_REGISTRY, lock_path or DEFAULT_LOCKFILE)
+    if name == 'journal':
+        return JournalBackend(path or DEFAULT_REGISTRY, lock_path or DEFAULT_LOCKFILE)
+    if name == 'sqlite':
+        return SQLiteBackend(path or DEFAULT_SQLITE)
+    if name == 'sharded':
+        path = str(path or DEFAULT_REGISTRY)
+        return ShardedBackend(path if path.endswith('.d') else f"{path}.d")
+    if name == 'bitmap':
+        return BitmapBackend(path or DEFAULT_BITMAP, lock_path or DEFAULT_LOCKFILE)
+    raise PortKeeperError(f"Unknown registry backend: {name}")
+
+
+def migrate(source: RegistryBackend, target: RegistryBackend, replace: bool = False) -> int:
+    """Copy every entry from source into target in one transaction; returns the number copied.
+
+    With ``replace``, entries in target that are missing from source are removed.
+    """
+    entries = source.read()
+    with target.transaction() as txn:
+        if replace:
+            for key, _ in list(txn.items()):
+                if key not in entries:
+                    txn.delete(key)
+        for key, entry in entries.items():
+            txn.put(key, entry)
+    return len(entries)
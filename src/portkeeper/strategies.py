@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import zlib
+from typing import Iterator
+
+from .errors import PortKeeperError
+from .index import PortIndex
+
+DEFAULT_STRATEGY = os.environ.get("PORTKEEPER_STRATEGY", "first-fit")
+DEFAULT_RANDOM_RETRIES = 64
+
+
+def _wrapped(index: PortIndex, host: str, port_range: tuple[int, int], first: int) -> Iterator[int]:
+    """Unreserved ports from ``first`` to the end of the range, then from the start to ``first``."""
+    start, end = port_range
+    yield from index.iter_free(host, first, end)
+    if first > start:
+        yield from index.iter_free(host, start, first - 1)
+
+
+class AllocationStrategy:
+    """Decides the order in which unreserved ports of a range are tried.
+
+    ``candidates`` yields ports not reserved in ``index``; the registry skips
+    those that turn out to be bound and, once a reservation is committed,
+    calls ``allocated`` with the last port it took. Strategies must eventually
+    yield every free port, so a range is only reported exhausted when it
+    really is.
+    """
+
+    name = ''
+
+    def candidates(self, index: PortIndex, host: str, port_range: tuple[int, int],
+                   owner: str | None = None) -> Iterator[int]:
+        raise NotImplementedError
+
+    def allocated(self, host: str, port_range: tuple[int, int], port: int) -> None:
+        pass
+
+
+class FirstFit(AllocationStrategy):
+    """Lowest free port first (the classic behaviour)."""
+
+    name = 'first-fit'
+
+    def candidates(self, index, host, port_range, owner=None):
+        return index.iter_free(host, port_range[0], port_range[1])
+
+
+class NextFit(AllocationStrategy):
+    """Resume after the last port handed out in the same range, wrapping around.
+
+    The cursor per (host, range) is kept in a small JSON sidecar at ``path``
+    (in memory only without one), so consecutive reservations from any process
+    spread across the range instead of piling onto its low end. The cursor is
+    a hint: a lost update only costs a few extra probes.
+    """
+
+    name = 'next-fit'
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._cursors: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(host: str, port_range: tuple[int, int]) -> str:
+        return f"{host}|{port_range[0]}|{port_range[1]}"
+
+    def _load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                self._cursors = {k: int(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def cursor(self, host: str, port_range: tuple[int, int]) -> int:
+        with self._lock:
+            self._load()
+            cursor = self._cursors.get(self._key(host, port_range), port_range[0])
+        return cursor if port_range[0] <= cursor <= port_range[1] else port_range[0]
+
+    def candidates(self, index, host, port_range, owner=None):
+        return _wrapped(index, host, port_range, self.cursor(host, port_range))
+
+    def allocated(self, host, port_range, port):
+        with self._lock:
+            cursor = port + 1 if port < port_range[1] else port_range[0]
+            self._cursors[self._key(host, port_range)] = cursor
+            if self.path:
+                tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump(self._cursors, f)
+                os.replace(tmp, self.path)
+
+
+class RandomFit(AllocationStrategy):
+    """Uniformly random ports, falling back to a scan from a random offset.
+
+    Up to ``retries`` random draws are tried first; concurrent reservers then
+    rarely pick the same port. The fallback keeps allocation complete once
+    the range is nearly full.
+    """
+
+    name = 'random'
+
+    def __init__(self, retries: int = DEFAULT_RANDOM_RETRIES, rng: random.Random | None = None):
+        self.retries = retries
+        self.rng = rng or random.SystemRandom()
+
+    def candidates(self, index, host, port_range, owner=None):
+        start, end = port_range
+        tried = set()
+        for _ in range(self.retries):
+            port = self.rng.randint(start, end)
+            if port in tried or index.is_reserved(host, port):
+                continue
+            tried.add(port)
+            yield port
+        for port in _wrapped(index, host, port_range, self.rng.randint(start, end)):
+            if port not in tried:
+                yield port
+
+
+class HashedFit(AllocationStrategy):
+    """Start at a position derived from the owner name and probe linearly from there.
+
+    The same owner tends to get the same port across restarts, and distinct
+    owners start in different parts of the range.
+    """
+
+    name = 'hashed'
+
+    def candidates(self, index, host, port_range, owner=None):
+        start, end = port_range
+        first = start + zlib.crc32((owner or '').encode('utf-8')) % (end - start + 1)
+        return _wrapped(index, host, port_range, first)
+
+
+STRATEGIES = {cls.name: cls for cls in (FirstFit, NextFit, RandomFit, HashedFit)}
+
+
+def get_strategy(strategy: str | AllocationStrategy | None = None,
+                 registry_path: str | None = None) -> AllocationStrategy:
+    """Resolve a strategy name (or instance) to an AllocationStrategy.
+
+    'next-fit' persists its cursor next to ``registry_path``.
+    """
+    if isinstance(strategy, AllocationStrategy):
+        return strategy
+    name = strategy or DEFAULT_STRATEGY
+    if name not in STRATEGIES:
+        raise PortKeeperError(f"Unknown allocation strategy: {name} "
+                              f"(choose from {', '.join(STRATEGIES)})")
+    if name == NextFit.name:
+        return NextFit(f"{registry_path}.cursor" if registry_path else None)
+    return STRATEGIES[name]()
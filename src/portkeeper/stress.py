@@ -0,0 +1,292 @@
+"""Multi-process stress harness: throughput, latency and duplicate-allocation detection.
+
+Spawns ``processes`` worker processes with ``threads`` threads each, all
+reserving and releasing ports of one range in a shared registry through
+PortRegistry as fast as they can. Every live reservation is entered in a
+shared ledger between the reserve and the release call; finding the
+(host, port) already there means two live reservations overlapped, and the
+run stops at once with the offending pair.
+
+    python -m portkeeper.stress --backend json --processes 8 --threads 4 --ops 200
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Sequence
+
+from .errors import PortKeeperError
+from .strategies import STRATEGIES
+
+DEFAULT_STRESS_RANGE = (30000, 30999)
+
+
+class DuplicateAllocation(PortKeeperError):
+    """Two live reservations were handed the same host and port."""
+
+
+class _Ledger:
+    """Which worker holds each port of the range right now, shared between processes."""
+
+    def __init__(self, ctx, port_range: tuple[int, int]):
+        self.start = port_range[0]
+        self.slots = ctx.Array('i', port_range[1] - port_range[0] + 1)
+
+    def enter(self, port: int, worker: int) -> int | None:
+        """Record ``worker`` as the holder of ``port``; returns the current holder if any."""
+        with self.slots.get_lock():
+            holder = self.slots[port - self.start]
+            if holder:
+                return holder
+            self.slots[port - self.start] = worker
+        return None
+
+    def leave(self, port: int) -> None:
+        with self.slots.get_lock():
+            self.slots[port - self.start] = 0
+
+
+@dataclass
+class StressReport:
+    backend: str
+    processes: int
+    threads: int
+    operations: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    ops_per_second: float = 0.0
+    reserve_p50_ms: float = 0.0
+    reserve_p99_ms: float = 0.0
+    release_p50_ms: float = 0.0
+    release_p99_ms: float = 0.0
+    lock_wait_ms: float = 0.0
+    lock_wait_p99_ms: float = 0.0
+    duplicates: list[dict] = field(default_factory=list)
+    leaked: list[str] = field(default_factory=list)
+    failures: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.duplicates and not self.leaked and not self.failures
+
+    def check(self) -> None:
+        """Raise DuplicateAllocation for a port held twice, PortKeeperError for failure or leaks."""
+        if self.duplicates:
+            d = self.duplicates[0]
+            raise DuplicateAllocation(f"{d['host']}:{d['port']} was held by workers "
+                                      f"{d['workers'][0]} and {d['workers'][1]} at once")
+        if self.failures:
+            raise PortKeeperError(f"{len(self.failures)} worker thread(s) failed: "
+                                  f"{self.failures[0]}")
+        if self.leaked:
+            raise PortKeeperError(f"{len(self.leaked)} reservation(s) were never released")
+
+
+def _percentile(samples: Sequence[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else 0.0
+
+
+def _time_locks(waits: list[float]) -> None:
+    """Record how long every FileLock acquisition in this process waits."""
+    from .locking import FileLock
+
+    enter = FileLock.__enter__
+
+    def timed_enter(self):
+        began = time.perf_counter()
+        result = enter(self)
+        waits.append(time.perf_counter() - began)
+        return result
+    FileLock.__enter__ = timed_enter
+
+
+def _worker(number: int, config: dict, ledger: _Ledger, start, stop, results) -> None:
+    from .core import PortRegistry
+    from .storage import open_backend
+
+    waits: list[float] = []
+    reserve, release, errors, duplicates, failures = [], [], [], [], []
+    try:
+        _time_locks(waits)
+        backend = open_backend(config['backend'], config['path'], config['lock'])
+        registry = PortRegistry(backend=backend, daemon=False, strategy=config['strategy'])
+        port_range = tuple(config['port_range'])
+    except Exception as e:  # still report, or the parent would wait for our results forever
+        failures.append(f"process {number}: {e!r}")
+        stop.set()
+        results.put({'process': number, 'reserve': reserve, 'release': release, 'waits': waits,
+                     'errors': 0, 'duplicates': duplicates, 'failures': failures})
+        return
+
+    def run(worker: int) -> None:
+        try:
+            work(worker)
+        except Exception as e:  # report instead of dying silently with the results never sent
+            failures.append(f"worker {worker}: {e!r}")
+            stop.set()
+
+    def work(worker: int) -> None:
+        rng = random.Random(worker)
+        for _ in range(config['ops']):
+            if stop.is_set():
+                return
+            began = time.perf_counter()
+            try:
+                reservation = registry.reserve(port_range=port_range, owner=f'stress-{worker}')
+            except PortKeeperError:
+                errors.append(1)
+                continue
+            reserve.append(time.perf_counter() - began)
+            holder = ledger.enter(reservation.port, worker)
+            if holder is not None:
+                duplicates.append({'host': reservation.host, 'port': reservation.port,
+                                   'workers': [holder, worker]})
+                stop.set()
+                return
+            if config['hold']:
+                time.sleep(rng.uniform(0, config['hold']))
+            ledger.leave(reservation.port)
+            began = time.perf_counter()
+            registry.release(reservation)
+            release.append(time.perf_counter() - began)
+
+    start.wait()
+    threads = [threading.Thread(target=run, args=(number * config['threads'] + i + 1,))
+               for i in range(config['threads'])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put({'process': number, 'reserve': reserve, 'release': release, 'waits': waits,
+                 'errors': len(errors), 'duplicates': duplicates, 'failures': failures})
+
+
+def _collect(workers: list, results, stop) -> list[dict]:
+    """Every worker's results; one that exits without reporting (e.g. killed) becomes a failure."""
+    collected: list[dict] = []
+    while len(collected) < len(workers):
+        try:
+            collected.append(results.get(timeout=0.5))
+        except queue.Empty:
+            if any(worker.is_alive() for worker in workers):
+                continue
+            # Everyone has exited and flushed what they sent: whoever is missing died first
+            reported = {c['process'] for c in collected}
+            lost = [f"process {n} exited with code {worker.exitcode} without reporting"
+                    for n, worker in enumerate(workers) if n not in reported]
+            collected.append({'process': None, 'reserve': [], 'release': [], 'waits': [],
+                              'errors': 0, 'duplicates': [], 'failures': lost})
+            stop.set()
+            break
+    return collected
+
+
+def run_stress(backend: str = 'json', processes: int = 4, threads: int = 2, ops: int = 100,
+               port_range: tuple[int, int] = DEFAULT_STRESS_RANGE, path: str | None = None,
+               lock_path: str | None = None, strategy: str | None = None, hold: float = 0.0,
+               start_method: str = 'spawn') -> StressReport:
+    """Run the stress workload and return its report; check ``report.ok``.
+
+    Without ``path`` a throwaway registry is used. ``hold`` is the upper
+    bound of a random pause (seconds) between reserving and releasing.
+    """
+    ctx = multiprocessing.get_context(start_method)
+    report = StressReport(backend, processes, threads)
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {'backend': backend, 'path': path or os.path.join(tmp, f'registry.{backend}'),
+                  'lock': lock_path or os.path.join(tmp, 'registry.lock'), 'strategy': strategy,
+                  'port_range': list(port_range), 'threads': threads, 'ops': ops, 'hold': hold}
+        ledger = _Ledger(ctx, port_range)
+        start, stop, results = ctx.Event(), ctx.Event(), ctx.Queue()
+        workers = [ctx.Process(target=_worker, args=(n, config, ledger, start, stop, results))
+                   for n in range(processes)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.2 + processes * 0.05)  # let interpreters start before the clock does
+        began = time.perf_counter()
+        start.set()
+        collected = _collect(workers, results, stop)
+        report.seconds = time.perf_counter() - began
+        for worker in workers:
+            worker.join()
+
+        from .storage import open_backend
+        registry = open_backend(backend, config['path'], config['lock'])
+        report.leaked = sorted(key for key, entry in registry.read().items()
+                               if str(entry.get('owner', '')).startswith('stress-'))
+        registry.close()
+
+    reserve = [s for c in collected for s in c['reserve']]
+    release = [s for c in collected for s in c['release']]
+    waits = [s for c in collected for s in c['waits']]
+    report.operations = len(reserve) + len(release)
+    report.errors = sum(c['errors'] for c in collected)
+    report.ops_per_second = report.operations / report.seconds if report.seconds else 0.0
+    report.reserve_p50_ms = _percentile(reserve, 0.5)
+    report.reserve_p99_ms = _percentile(reserve, 0.99)
+    report.release_p50_ms = _percentile(release, 0.5)
+    report.release_p99_ms = _percentile(release, 0.99)
+    report.lock_wait_ms = sum(waits) * 1000
+    report.lock_wait_p99_ms = _percentile(waits, 0.99)
+    report.duplicates = [d for c in collected for d in c['duplicates']]
+    report.failures = [f for c in collected for f in c['failures']]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default='json',
+                        choices=['json', 'journal', 'sqlite', 'sharded', 'bitmap'],
+                        help='Registry backend (default: json)')
+    parser.add_argument('--registry', help='Registry to stress (default: a throwaway one)')
+    parser.add_argument('--lock', help='Lock file for --registry')
+    parser.add_argument('--processes', type=int, default=8, help='Worker processes (default: 8)')
+    parser.add_argument('--threads', type=int, default=2, help='Threads per process (default: 2)')
+    parser.add_argument('--ops', type=int, default=100,
+                        help='Reserve/release pairs per thread (default: 100)')
+    parser.add_argument('--range', default=f'{DEFAULT_STRESS_RANGE[0]}-{DEFAULT_STRESS_RANGE[1]}',
+                        help='Port range (default: %(default)s)')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES),
+                        help='Allocation strategy (default: first-fit)')
+    parser.add_argument('--hold', type=float, default=0.0,
+                        help='Max seconds to keep each port (default: 0)')
+    parser.add_argument('--start-method', default='spawn',
+                        choices=multiprocessing.get_all_start_methods())
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    report = run_stress(args.backend, args.processes, args.threads, args.ops,
+                        tuple(map(int, args.range.split('-'))), args.registry, args.lock,
+                        args.strategy, args.hold, args.start_method)
+    if args.json:
+        print(json.dumps(asdict(report), indent=2))
+    else:
+        print(f"{report.backend}: {report.processes} processes x {report.threads} threads, "
+              f"{report.operations} ops in {report.seconds:.2f}s = "
+              f"{report.ops_per_second:.0f} ops/s ({report.errors} errors)")
+        print(f"reserve p50 {report.reserve_p50_ms:.2f} ms, p99 {report.reserve_p99_ms:.2f} ms; "
+              f"release p50 {report.release_p50_ms:.2f} ms, p99 {report.release_p99_ms:.2f} ms")
+        print(f"lock wait {report.lock_wait_ms:.0f} ms total, p99 {report.lock_wait_p99_ms:.2f} ms")
+    for duplicate in report.duplicates:
+        print(f"DUPLICATE ALLOCATION: {duplicate['host']}:{duplicate['port']} held by workers "
+              f"{duplicate['workers'][0]} and {duplicate['workers'][1]}", file=sys.stderr)
+    for failure in report.failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    if report.leaked:
+        print(f"LEAKED: {len(report.leaked)} reservation(s) never released: "
+              f"{', '.join(report.leaked[:10])}", file=sys.stderr)
+    sys.exit(0 if report.ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Tests for `portkeeper run` socket handoff and LISTEN_FDS adoption."""
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from portkeeper.activation import listen_fds, listen_fds_with_names, run
+from portkeeper.core import PortRegistry
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+# Adopts the handed-over sockets, checks each accepts connections and reports what it got
+CHILD = """
+import json, os, socket, sys
+sys.path.insert(0, {src!r})
+from portkeeper.activation import listen_fds_with_names
+report = {{'sockets': [], 'env': {{k: v for k, v in os.environ.items() if k.startswith(('PORT', 'WEB', 'LISTEN_'))}},
+          'argv': sys.argv[1:]}}
+for name, sock in listen_fds_with_names():
+    port = sock.getsockname()[1]
+    with socket.create_connection(('127.0.0.1', port), timeout=5):
+        conn, _ = sock.accept()
+        conn.close()
+    report['sockets'].append([name, port])
+report['cleared'] = 'LISTEN_FDS' not in os.environ
+with open(sys.argv[1], 'w') as f:
+    json.dump(report, f)
+sys.exit(int(sys.argv[2]))
+"""
+
+
+class TestActivation(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = PortRegistry(os.path.join(self.temp_dir, ".port_registry.json"),
+                                     os.path.join(self.temp_dir, ".port_registry.lock"), daemon=False)
+        self.script = os.path.join(self.temp_dir, "child.py")
+        with open(self.script, "w") as f:
+            f.write(CHILD.format(src=SRC))
+        self.report = os.path.join(self.temp_dir, "report.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, *args, **kwargs):
+        # The child's accepted connections leave TIME-WAIT sockets behind: use ports no other test does
+        code = run([sys.executable, self.script, self.report, *args], registry=self.registry,
+                   port_range=(41000, 41100), **kwargs)
+        with open(self.report) as f:
+            return code, json.load(f)
+
+    def test_run_hands_listening_sockets_to_the_command(self):
+        """Test that run() passes bound, listening sockets with their names and ports, then releases them."""
+        code, report = self._run("0", "{WEB}", ports=2, env_keys=["WEB"], label="handoff")
+        self.assertEqual(code, 0)
+        ports = [int(p) for p in report["env"]["PORTS"].split(",")]
+        self.assertEqual(report["sockets"], [["WEB", ports[0]], ["PORT_1", ports[1]]])
+        self.assertEqual(report["env"]["WEB"], report["env"]["PORT"])
+        self.assertEqual(report["env"]["PORT_1"], str(ports[1]))
+        self.assertEqual(report["argv"][-1], str(ports[0]))
+        self.assertEqual((report["env"]["LISTEN_FDS"], report["env"]["LISTEN_FDNAMES"]), ("2", "WEB:PORT_1"))
+        self.assertTrue(report["cleared"])
+        self.assertEqual(self.registry.status(), {})
+        for port in ports:
+            with socket.socket() as sock:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(("127.0.0.1", port))
+
+    def test_run_without_handoff_passes_only_ports_and_exit_status(self):
+        """Test that with handoff=False the command gets port variables but no sockets, and its status is returned."""
+        code, report = self._run("7", handoff=False)
+        self.assertEqual(code, 7)
+        self.assertEqual(report["sockets"], [])
+        self.assertIn("PORT", report["env"])
+        self.assertNotIn("LISTEN_FDS", report["env"])
+        self.assertEqual(self.registry.status(), {})
+
+    def test_listen_fds_ignores_sockets_meant_for_another_process(self):
+        """Test that listen_fds() returns nothing for another LISTEN_PID or without LISTEN_FDS, and clears them."""
+        env = {"LISTEN_FDS": "1", "LISTEN_PID": str(os.getpid() + 1), "LISTEN_FDNAMES": "web"}
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(listen_fds(), [])
+            self.assertNotIn("LISTEN_FDS", os.environ)
+        with mock.patch.dict(os.environ, {"LISTEN_PID": str(os.getpid())}):
+            os.environ.pop("LISTEN_FDS", None)
+            self.assertEqual(listen_fds_with_names(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Tests for the asyncio front end."""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from portkeeper.aio import AsyncPortRegistry
+from portkeeper.core import PortRegistry
+
+
+class TestAsyncPortRegistry(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry = PortRegistry(
+            registry_path=os.path.join(self.temp_dir, ".port_registry.json"),
+            lock_path=os.path.join(self.temp_dir, ".port_registry.lock"),
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_concurrent_reservations_are_unique(self):
+        """Test that many concurrent coroutines get distinct ports."""
+        async def run():
+            async with AsyncPortRegistry(self.registry) as reg:
+                reservations = await asyncio.gather(*(reg.reserve(port_range=(5000, 5200)) for _ in range(50)))
+                status = await reg.status()
+                return reservations, status
+        reservations, status = asyncio.run(run())
+        ports = [r.port for r in reservations]
+        self.assertEqual(len(ports), len(set(ports)))
+        self.assertEqual(len(status), 50)
+
+    def test_reserve_context_releases(self):
+        """Test that the async context manager releases on exit."""
+        async def run():
+            async with AsyncPortRegistry(self.registry) as reg:
+                async with reg.reserve_context(port_range=(5000, 5100), count=2) as reservations:
+                    inside = len(await reg.status())
+                return inside, len(await reg.status()), reservations
+        inside, after, reservations = asyncio.run(run())
+        self.assertEqual(len(reservations), 2)
+        self.assertEqual(inside, 2)
+        self.assertEqual(after, 0)
+
+    def test_reserve_context_renews_leases(self):
+        """Test that leases taken by the async context manager are renewed while inside it."""
+        async def run():
+            async with AsyncPortRegistry(self.registry) as reg:
+                async with reg.reserve_context(port_range=(5000, 5100), ttl=0.3) as reservation:
+                    first = reservation.expires
+                    await asyncio.sleep(0.5)
+                    entry = (await reg.status())[f"{reservation.host}:{reservation.port}"]
+                    removed = await reg.gc(check_pids=False)
+                return first, entry["expires"], removed, len(await reg.status())
+        first, renewed, removed, after = asyncio.run(run())
+        self.assertGreater(renewed, first)
+        self.assertEqual(removed, [])
+        self.assertEqual(after, 0)
+
+    def test_loop_stays_responsive(self):
+        """Test that the event loop keeps ticking while reservations run."""
+        async def run():
+            async with AsyncPortRegistry(self.registry, max_workers=2) as reg:
+                ticks = 0
+                async def ticker():
+                    nonlocal ticks
+                    while True:
+                        ticks += 1
+                        await asyncio.sleep(0)
+                task = asyncio.ensure_future(ticker())
+                await asyncio.gather(*(reg.reserve(port_range=(5000, 5200)) for _ in range(20)))
+                task.cancel()
+                return ticks
+        self.assertGreater(asyncio.run(run()), 1)
+
+    def test_iter_scan_local_network(self):
+        """Test that scan results stream through an async iterator and stop on break."""
+        def scan(*args, **kwargs):
+            for port in range(8000, 9000):
+                yield "10.0.0.1", port, "closed"
+        self.registry.iter_scan_local_network = scan
+
+        async def run():
+            async with AsyncPortRegistry(self.registry) as reg:
+                seen = []
+                async for host, port, state in reg.iter_scan_local_network():
+                    seen.append(port)
+                    if len(seen) == 3:
+                        break
+                return seen
+        self.assertEqual(asyncio.run(run()), [8000, 8001, 8002])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Tests for the TTL scan-result cache."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from portkeeper.cache import ScanCache
+
+
+class TestScanCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_pop_hands_out_each_port_once(self):
+        """Test that cached ports are handed out in order and never twice."""
+        cache = ScanCache()
+        cache.put("10.0.0.1", (8000, 8010), [8001, 8003])
+        self.assertTrue(cache.fresh((8000, 8010)))
+        self.assertEqual(cache.pop((8000, 8010)), ("10.0.0.1", 8001))
+        self.assertEqual(cache.pop((8000, 8010)), ("10.0.0.1", 8003))
+        self.assertIsNone(cache.pop((8000, 8010)))
+        self.assertFalse(cache.fresh((8000, 8010)))
+
+    def test_entries_expire(self):
+        """Test that results older than the TTL are never handed out."""
+        cache = ScanCache(ttl=10)
+        cache.put("10.0.0.1", (8000, 8010), [8001], scanned_at=time.time() - 11)
+        self.assertFalse(cache.fresh((8000, 8010)))
+        self.assertIsNone(cache.pop((8000, 8010)))
+
+    def test_invalidate_by_host_and_range(self):
+        """Test that invalidation drops only the matching hosts and overlapping ranges."""
+        cache = ScanCache()
+        cache.put("10.0.0.1", (8000, 8010), [8001])
+        cache.put("10.0.0.2", (8000, 8010), [8002])
+        cache.put("10.0.0.1", (9000, 9010), [9001])
+        self.assertEqual(cache.invalidate(host="10.0.0.2"), 1)
+        self.assertEqual(cache.invalidate(port_range=(8005, 8500)), 1)
+        self.assertFalse(cache.fresh((8000, 8010)))
+        self.assertEqual(cache.pop((9000, 9010)), ("10.0.0.1", 9001))
+
+    def test_persisted_cache_is_shared(self):
+        """Test that two caches on the same file share results and hand-outs."""
+        path = os.path.join(self.temp_dir, "scan_cache.json")
+        first, second = ScanCache(path=path), ScanCache(path=path)
+        first.put("10.0.0.1", (8000, 8010), [8001, 8002])
+        self.assertEqual(second.pop((8000, 8010)), ("10.0.0.1", 8001))
+        self.assertEqual(first.pop((8000, 8010)), ("10.0.0.1", 8002))
+        self.assertIsNone(second.pop((8000, 8010)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Tests for the portkeeper command line: cold-start imports, status and release."""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+from portkeeper import cli
+from portkeeper.core import PortRegistry
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry_file = os.path.join(self.temp_dir, ".port_registry.json")
+        self.lock_file = os.path.join(self.temp_dir, ".port_registry.lock")
+        self.registry = PortRegistry(self.registry_file, self.lock_file, daemon=False)
+        self.registry._claim("127.0.0.1", 5000, owner="web-1")
+        self.registry._claim("127.0.0.1", 5001, owner="web-2")
+        self.registry._claim("10.0.0.1", 5000, owner="db")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, *argv):
+        out, err = io.StringIO(), io.StringIO()
+        argv = ["portkeeper", *argv, "--registry", self.registry_file, "--lock", self.lock_file]
+        env = dict(os.environ, PORTKEEPER_SOCKET=os.path.join(self.temp_dir, "none.sock"))
+        with mock.patch.object(sys, "argv", argv), mock.patch.dict(os.environ, env), \
+                redirect_stdout(out), redirect_stderr(err):
+            try:
+                cli.main()
+                code = 0
+            except SystemExit as e:
+                code = e.code
+        return code, out.getvalue()
+
+    def test_import_stays_light(self):
+        """Test that importing the CLI loads neither the allocator nor asyncio, dataclasses or sqlite3."""
+        probe = ("import sys, portkeeper.cli; print(sorted(m for m in ('asyncio', 'dataclasses', 'ipaddress', "
+                 "'queue', 'sqlite3', 'portkeeper.core', 'portkeeper.aio') if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", probe], env=dict(os.environ, PYTHONPATH=SRC),
+                                check=True, capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_status_prints_filtered_json_lines(self):
+        """Test that status prints one JSON object per reservation, filtered by host, owner and age."""
+        code, out = self._run("status")
+        self.assertEqual(code, 0)
+        lines = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(sorted(line["key"] for line in lines), ["10.0.0.1:5000", "127.0.0.1:5000", "127.0.0.1:5001"])
+        self.assertEqual(lines[0]["owner"], self.registry.status()[lines[0]["key"]]["owner"])
+        _, out = self._run("status", "--host", "127.0.0.1", "--owner", "web-*", "--newer-than", "60")
+        self.assertEqual(sorted(json.loads(line)["key"] for line in out.splitlines()),
+                         ["127.0.0.1:5000", "127.0.0.1:5001"])
+        _, out = self._run("status", "--older-than", "60")
+        self.assertEqual(out, "")
+
+    def test_release_by_port_owner_and_glob(self):
+        """Test that release removes reservations chosen by port, owner or key glob, and fails on no match."""
+        code, out = self._run("release", "--port", "5000", "--host", "10.0.0.1")
+        self.assertEqual(code, 0)
+        self.assertIn("10.0.0.1:5000", out)
+        code, _ = self._run("release", "--owner", "web-?", "--glob", "*:5001")
+        self.assertEqual(code, 0)
+        self.assertEqual(list(self.registry.status()), ["127.0.0.1:5000"])
+        self.assertEqual(self._run("release", "--owner", "nobody")[0], 1)
+        self.assertEqual(self._run("release")[0], 2)
+        self.assertEqual(list(self.registry.status()), ["127.0.0.1:5000"])
+
+    def test_migrate_requires_existing_source(self):
+        """Test that migrate fails without creating anything when the source registry does not exist."""
+        missing = os.path.join(self.temp_dir, "missing.json")
+        target = os.path.join(self.temp_dir, "target.db")
+        with mock.patch.object(sys, "argv", ["portkeeper", "migrate", "--source", missing, "--registry", target]), \
+                redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()) as err:
+            with self.assertRaises(SystemExit) as exit_:
+                cli.main()
+        self.assertEqual(exit_.exception.code, 1)
+        self.assertIn(missing, err.getvalue())
+        self.assertFalse(os.path.exists(missing))
+        self.assertFalse(os.path.exists(target))
+
+
+if __name__ == '__main__':
+    unittest.main()
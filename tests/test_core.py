@@ -2,10 +2,23 @@
 
 import unittest
 import os
+import socket
 import tempfile
 import json
 from portkeeper.core import PortRegistry, PortKeeperError
 
+def _ipv6_loopback():
+    """Whether this machine can bind TCP sockets on ::1."""
+    if not socket.has_ipv6:
+        return False
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as s:
+            s.bind(("::1", 0))
+        return True
+    except OSError:
+        return False
+
+
 class TestPortRegistry(unittest.TestCase):
     def setUp(self):
         """Set up a temporary registry file for each test."""
@@ -167,6 +180,15 @@ class TestPortRegistry(unittest.TestCase):
         else:
             self.fail("Expected a list of reservations")
 
+    @unittest.skipUnless(_ipv6_loopback(), "requires IPv6 loopback")
+    def test_hold_on_ipv6_host(self):
+        """Test that hold=True binds an IPv6 socket for an IPv6 host."""
+        reservation = self.registry.reserve(port_range=(5000, 5100), host="::1", hold=True)
+        self.assertTrue(reservation.held)
+        self.assertEqual(reservation._holder_socket.family, socket.AF_INET6)
+        self.assertEqual(reservation._holder_socket.getsockname()[1], reservation.port)
+        self.registry.release(reservation)
+
     def test_multi_port_release(self):
         """Test releasing multiple ports reserved at once."""
         reservations = self.registry.reserve(port_range=(5000, 5100), count=2)
@@ -181,6 +203,61 @@ class TestPortRegistry(unittest.TestCase):
         else:
             self.fail("Expected a list of reservations")
 
+    def test_multi_port_reservation_single_write(self):
+        """Test that a batch reservation writes the registry exactly once."""
+        writes = []
+        original = self.registry.backend._stage
+        def counting_stage(data):
+            writes.append(len(data))
+            return original(data)
+        self.registry.backend._stage = counting_stage
+        reservations = self.registry.reserve(port_range=(5000, 5100), count=5)
+        self.assertEqual(len(reservations), 5)
+        self.assertEqual(writes, [5], "Batch reservation should write the registry once")
+
+    def test_reserve_takes_the_registry_lock_once(self):
+        """Test that a single or batch reservation acquires the OS-level registry lock exactly once."""
+        from portkeeper.locking import lock_stats, reset_lock_stats
+        for count in (1, 5):
+            reset_lock_stats()
+            self.registry.reserve(port_range=(5000, 5100), count=count, hold=True)
+            self.assertEqual(sum(stats['acquired'] for stats in lock_stats().values()), 1)
+
+    def test_multi_port_reservation_all_or_nothing(self):
+        """Test that a batch larger than the free range reserves nothing."""
+        with self.assertRaises(PortKeeperError):
+            self.registry.reserve(port_range=(5000, 5002), count=5, hold=True)
+        with open(self.registry_file, 'r') as f:
+            data = json.load(f)
+        self.assertEqual(data, {}, "Failed batch reservation should not leave partial entries")
+
+    def test_reserve_block(self):
+        """Test that a block is contiguous, aligned, skips reserved ports and is written once."""
+        self.registry.reserve(port_range=(5000, 5100), preferred=5004)
+        writes = []
+        original = self.registry.backend._stage
+        def counting_stage(data):
+            writes.append(len(data))
+            return original(data)
+        self.registry.backend._stage = counting_stage
+        block = self.registry.reserve_block(8, port_range=(5000, 5100), align=4, owner="rtp")
+        ports = [r.port for r in block]
+        self.assertEqual(ports, list(range(ports[0], ports[0] + 8)))
+        self.assertEqual(ports[0] % 4, 0)
+        self.assertNotIn(5004, ports)
+        self.assertEqual(writes, [9])
+        with self.assertRaises(PortKeeperError):
+            self.registry.reserve_block(200, port_range=(5000, 5100))
+
+    def test_reserve_context(self):
+        """Test that the context manager releases its reservations on exit."""
+        with self.registry.reserve_context(port_range=(5000, 5100)) as reservation:
+            key = f"127.0.0.1:{reservation.port}"
+            with open(self.registry_file, 'r') as f:
+                self.assertIn(key, json.load(f))
+        with open(self.registry_file, 'r') as f:
+            self.assertNotIn(key, json.load(f))
+
     def test_reserve_with_preferred_port(self):
         """Test that a preferred port can be successfully reserved."""
         preferred_port = 8080
@@ -222,5 +299,81 @@ class TestPortRegistry(unittest.TestCase):
         self.assertNotEqual(reservation.port, 8080)
         self.assertTrue(9000 <= reservation.port <= 10000)
 
+    def _fake_scan(self, results):
+        """Replace the network scan with `results`, counting how many are consumed."""
+        self.consumed = 0
+        def scan(*args, **kwargs):
+            for item in results:
+                self.consumed += 1
+                yield item
+        self.registry.iter_scan_local_network = scan
+
+    def test_iter_status_and_release_matching(self):
+        """Test that status filters by host, owner glob and age, and matching releases happen in one update."""
+        self.registry.reserve(port_range=(5000, 5100), count=3, owner="web-1")
+        self.registry.reserve(port_range=(5000, 5100), owner="db")
+        self.registry._claim("10.0.0.1", 5000, owner="web-2")
+        self.assertEqual(len(list(self.registry.iter_status(owner="web-*"))), 4)
+        self.assertEqual([key for key, _ in self.registry.iter_status(host="10.0.0.1")], ["10.0.0.1:5000"])
+        self.assertEqual(list(self.registry.iter_status(older_than=60)), [])
+        self.assertEqual(len(list(self.registry.iter_status(newer_than=60))), 5)
+        with self.assertRaises(PortKeeperError):
+            self.registry.release_matching()
+        updates = []
+        real_update = self.registry.backend.update
+        self.registry.backend.update = lambda fn: updates.append(fn) or real_update(fn)
+        self.assertEqual(self.registry.release_matching(owner="web-*", pattern="127.0.0.1:*"),
+                         ["127.0.0.1:5000", "127.0.0.1:5001", "127.0.0.1:5002"])
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.registry.release_matching(host="10.0.0.1", port=5000), ["10.0.0.1:5000"])
+        self.assertEqual(self.registry.release_matching(port=5000), [])
+        self.assertEqual(list(self.registry.status()), ["127.0.0.1:5003"])
+
+    def test_release_many_is_one_write(self):
+        """Test that release_many removes reservations and owner/label matches in one update and closes held sockets."""
+        mine = self.registry.reserve(port_range=(5000, 5100), count=2, hold=True, label="env-1")
+        self.registry.reserve(port_range=(5000, 5100), count=3, owner="svc", label="env-1")
+        other = self.registry.reserve(port_range=(5000, 5100), owner="svc", label="env-2")
+        self.assertEqual(sorted(self.registry.find(label="env-1")),
+                         [f"127.0.0.1:{port}" for port in range(5000, 5005)])
+        self.assertEqual(list(self.registry.find(owner="svc", label="env-2")), [f"127.0.0.1:{other.port}"])
+        updates = []
+        real_update = self.registry.backend.update
+        self.registry.backend.update = lambda fn: updates.append(fn) or real_update(fn)
+        released = self.registry.release_many(mine, owner="svc", label="env-1")
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(sorted(released), [f"127.0.0.1:{port}" for port in range(5000, 5005)])
+        self.assertFalse(any(r.held or r._holder_socket for r in mine))
+        self.assertEqual(list(self.registry.status()), [f"127.0.0.1:{other.port}"])
+        self.assertEqual(self.registry.release_many(), [])
+        self.assertEqual(len(updates), 1)
+
+    def test_release_many_closes_sockets_held_for_matches(self):
+        """Test that releasing by label closes the sockets this registry bound for those ports."""
+        held = self.registry.reserve(port_range=(5000, 5100), hold=True, label="env")
+        sock = held._holder_socket
+        self.assertEqual(self.registry.release_many(label="env"), [f"127.0.0.1:{held.port}"])
+        self.assertEqual(sock.fileno(), -1)
+
+    def test_get_free_host_port_stops_early(self):
+        """Test that the scan stops once enough free candidates are found and the rest are cached."""
+        self._fake_scan([("127.0.0.1", 8000 + i, "open" if i % 2 else "closed") for i in range(100)])
+        self.assertEqual(self.registry.get_free_host_port(candidates=3), ("127.0.0.1", 8000))
+        self.assertEqual(self.consumed, 5)
+        self.assertEqual(self.registry.get_free_host_port(candidates=3), ("127.0.0.1", 8002))
+        self.assertEqual(self.consumed, 5, "Cached candidates should be used before rescanning")
+
+    def test_reserve_network_port_uses_scan_cache(self):
+        """Test that reserve_network_port skips reserved ports and reuses cached scan results."""
+        self.registry._claim("127.0.0.1", 8000)
+        self._fake_scan([("127.0.0.1", 8000 + i, "closed") for i in range(100)])
+        reservation = self.registry.reserve_network_port()
+        self.assertEqual((reservation.host, reservation.port), ("127.0.0.1", 8001))
+        consumed = self.consumed
+        self.assertLess(consumed, 100)
+        reservation = self.registry.reserve_network_port()
+        self.assertEqual(reservation.port, 8002)
+        self.assertEqual(self.consumed, consumed, "Second reservation should not rescan")
+
 if __name__ == '__main__':
     unittest.main()
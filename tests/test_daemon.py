@@ -0,0 +1,154 @@
+"""Tests for the portkeeperd allocation daemon and transparent client fallback."""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from portkeeper.core import PortRegistry, PortKeeperError
+from portkeeper.storage import JsonBackend
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "requires Unix domain sockets")
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        from portkeeper.daemon import PortKeeperDaemon
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry_file = os.path.join(self.temp_dir, ".port_registry.json")
+        self.lock_file = os.path.join(self.temp_dir, ".port_registry.lock")
+        self.socket_path = os.path.join(self.temp_dir, "pk.sock")
+        self.daemon = PortKeeperDaemon(self.socket_path, JsonBackend(self.registry_file, self.lock_file),
+                                       flush_interval=0.01)
+        self.daemon.start()
+        self.thread = threading.Thread(target=self.daemon.serve_forever, daemon=True)
+        self.thread.start()
+        self.registry = PortRegistry(self.registry_file, self.lock_file, daemon=self.socket_path)
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+        shutil.rmtree(self.temp_dir)
+
+    def _persisted(self):
+        self.daemon.committer.flush()
+        with open(self.registry_file) as f:
+            return json.load(f)
+
+    def test_reserve_and_release_through_daemon(self):
+        """Test that reservations are served from daemon memory and persisted."""
+        reservations = self.registry.reserve(port_range=(5000, 5100), count=3, owner="svc")
+        ports = [r.port for r in reservations]
+        self.assertEqual(len(set(ports)), 3)
+        self.assertEqual(len(self.registry.status()), 3)
+        self.assertEqual(len(self._persisted()), 3)
+        self.registry.release(reservations[0])
+        self.assertNotIn(f"127.0.0.1:{ports[0]}", self.registry.status())
+        self.assertNotIn(f"127.0.0.1:{ports[0]}", self._persisted())
+
+    def test_daemon_errors_are_raised(self):
+        """Test that an exhausted range is reported as PortKeeperError."""
+        with self.assertRaises(PortKeeperError):
+            self.registry.reserve(port_range=(5000, 5002), count=5)
+
+    def test_hold_binds_locally(self):
+        """Test that hold=True keeps a socket bound in the client process."""
+        reservation = self.registry.reserve(port_range=(5000, 5100), hold=True)
+        self.assertTrue(reservation.held)
+        self.assertIsNotNone(reservation._holder_socket)
+        self.registry.release(reservation)
+        self.assertIsNone(reservation._holder_socket)
+
+    def test_leases_through_daemon(self):
+        """Test that leases record the client pid and are renewed and collected by the daemon."""
+        lease = self.registry.reserve(port_range=(5000, 5100), ttl=30)
+        key = f"127.0.0.1:{lease.port}"
+        self.assertEqual(self.registry.status()[key]["pid"], os.getpid())
+        self.assertEqual(self.registry.renew([lease]), 1)
+        self.assertEqual(self.registry.gc(), [])
+        with self.daemon.memory.transaction() as txn:
+            txn.put(key, dict(txn.get(key), expires=0))
+        self.assertEqual(self.registry.gc(), [key])
+
+    def test_filtered_status_and_release_matching(self):
+        """Test that status filters and matching releases are applied by the daemon."""
+        self.registry.reserve(port_range=(5000, 5100), count=2, owner="web")
+        db = self.registry.reserve(port_range=(5000, 5100), owner="db")
+        self.assertEqual([key for key, _ in self.registry.iter_status(owner="d?")], [f"127.0.0.1:{db.port}"])
+        self.assertEqual(len(self.registry.release_matching(owner="web")), 2)
+        self.assertEqual(list(self._persisted()), [f"127.0.0.1:{db.port}"])
+
+    def test_release_many_through_daemon(self):
+        """Test that the daemon finds and releases reservations by label in one request."""
+        self.registry.reserve(port_range=(5000, 5100), count=3, label="env")
+        keep = self.registry.reserve(port_range=(5000, 5100))
+        self.assertEqual(len(self.registry.find(label="env")), 3)
+        self.assertEqual(len(self.registry.release_many(label="env")), 3)
+        self.assertEqual(list(self._persisted()), [f"127.0.0.1:{keep.port}"])
+
+    def test_shutdown_flushes_pending_changes(self):
+        """Test that stopping the daemon persists changes not yet committed."""
+        reservation = self.registry.reserve(port_range=(5000, 5100))
+        self.daemon.shutdown()
+        with open(self.registry_file) as f:
+            self.assertIn(f"127.0.0.1:{reservation.port}", json.load(f))
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_fallback_when_daemon_is_gone(self):
+        """Test that the client falls back to the registry file once the daemon stops."""
+        self.daemon.shutdown()
+        reservation = self.registry.reserve(port_range=(5000, 5100))
+        with open(self.registry_file) as f:
+            self.assertIn(f"127.0.0.1:{reservation.port}", json.load(f))
+
+    def test_daemon_for_another_registry_is_not_used(self):
+        """Test that a registry on another file uses its backend even while a daemon listens on the socket."""
+        other_file = os.path.join(self.temp_dir, "other.json")
+        other = PortRegistry(other_file, self.lock_file, daemon=self.socket_path)
+        reservation = other.reserve(port_range=(5000, 5100), owner="other")
+        with open(other_file) as f:
+            self.assertIn(f"127.0.0.1:{reservation.port}", json.load(f))
+        self.assertEqual(self.registry.status(), {})
+        self.assertIsNone(other._daemon())
+
+    def test_failed_commit_is_retried(self):
+        """Test that a batch the backing registry fails to write is kept and persisted on a later attempt."""
+        transaction = self.daemon.target.transaction
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OSError(28, "No space left on device")
+            return transaction()
+        with mock.patch.object(self.daemon.target, "transaction", side_effect=flaky), \
+                mock.patch("sys.stderr"):
+            reservation = self.registry.reserve(port_range=(5000, 5100))
+            deadline = time.monotonic() + 5
+            while len(calls) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(self.daemon.committer.is_alive())
+        self.assertIn(f"127.0.0.1:{reservation.port}", self._persisted())
+
+    def test_stale_socket_is_not_retried_on_every_call(self):
+        """Test that after a daemon socket fails to answer, calls use the file without reconnecting for a while."""
+        from portkeeper.daemon import DaemonClient
+        self.daemon.shutdown()
+        open(self.socket_path, "w").close()  # a stale socket file nobody serves
+        registry = PortRegistry(self.registry_file, self.lock_file, daemon=self.socket_path)
+        with mock.patch.object(DaemonClient, "request", autospec=True, wraps=DaemonClient.request) as request:
+            reservation = registry.reserve(port_range=(5000, 5100))
+            registry.release(reservation)
+            registry.find(owner="nobody")
+        self.assertEqual(request.call_count, 1)
+        with open(self.registry_file) as f:
+            self.assertEqual(json.load(f), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Unit tests for the in-memory per-host port index and the owner/pid/label index."""
+
+import unittest
+
+from portkeeper.index import EntryIndex, PortIndex
+
+
+class TestPortIndex(unittest.TestCase):
+    def test_from_registry(self):
+        """Test that registry entries are indexed per host."""
+        registry = {
+            "127.0.0.1:5000": {"host": "127.0.0.1", "port": 5000},
+            "localhost:5001": {"host": "localhost", "port": 5001},
+            "::1:5002": {},
+        }
+        index = PortIndex.from_registry(registry)
+        self.assertTrue(index.is_reserved("127.0.0.1", 5000))
+        self.assertFalse(index.is_reserved("127.0.0.1", 5001))
+        self.assertTrue(index.is_reserved("localhost", 5001))
+        self.assertTrue(index.is_reserved("::1", 5002))
+
+    def test_iter_free_skips_reserved(self):
+        """Test that free-port iteration skips reserved ports and full bytes."""
+        index = PortIndex()
+        for port in range(5000, 5100):
+            index.add("127.0.0.1", port)
+        self.assertEqual(next(index.iter_free("127.0.0.1", 5000, 6000)), 5100)
+        self.assertEqual(list(index.iter_free("127.0.0.1", 5000, 5099)), [])
+        self.assertEqual(list(index.iter_free("10.0.0.1", 5000, 5002)), [5000, 5001, 5002])
+
+    def test_free_runs(self):
+        """Test that free runs are maximal and clipped to the range."""
+        index = PortIndex()
+        for port in [5003, 5004, 5010, *range(5016, 5040)]:
+            index.add("127.0.0.1", port)
+        self.assertEqual(list(index.free_runs("127.0.0.1", 5000, 5050)),
+                         [(5000, 5002), (5005, 5009), (5011, 5015), (5040, 5050)])
+        self.assertEqual(list(index.free_runs("127.0.0.1", 5016, 5039)), [])
+        self.assertEqual(list(index.free_runs("10.0.0.1", 5000, 5002)), [(5000, 5002)])
+
+    def test_discard(self):
+        """Test that discarded ports become free again."""
+        index = PortIndex()
+        index.add("127.0.0.1", 8080)
+        index.discard("127.0.0.1", 8080)
+        self.assertFalse(index.is_reserved("127.0.0.1", 8080))
+        self.assertEqual(list(index.ports("127.0.0.1")), [])
+
+
+
+class TestEntryIndex(unittest.TestCase):
+    def test_find_by_owner_pid_and_label(self):
+        """Test that keys are found by any combination of indexed fields and follow updates."""
+        index = EntryIndex.from_registry({
+            "h:1": {"owner": "web", "pid": 10, "label": "env-a"},
+            "h:2": {"owner": "web", "label": "env-b"},
+            "h:3": {"owner": "", "pid": 10},
+        })
+        self.assertEqual(index.find(owner="web"), {"h:1", "h:2"})
+        self.assertEqual(index.find(owner="web", label="env-a"), {"h:1"})
+        self.assertEqual(index.find(pid=10), {"h:1", "h:3"})
+        self.assertEqual(index.find(owner=""), set())
+        self.assertEqual(index.find(), set())
+        copy = index.copy()
+        index.discard("h:1", {"owner": "web", "pid": 10, "label": "env-a"})
+        index.add("h:4", {"owner": "db", "label": "env-a"})
+        self.assertEqual(index.find(label="env-a"), {"h:4"})
+        self.assertEqual(copy.find(label="env-a"), {"h:1"})
+        with self.assertRaises(ValueError):
+            index.find(host="h")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Unit tests for the free-interval structure behind block allocation."""
+
+import unittest
+
+from portkeeper.index import PortIndex
+from portkeeper.intervals import FreeIntervals
+
+
+class TestFreeIntervals(unittest.TestCase):
+    def test_find_best_fit_and_alignment(self):
+        """Test that the smallest fitting run is chosen and alignment is honoured."""
+        intervals = FreeIntervals([(1000, 1099), (2000, 2009), (3001, 3020)])
+        self.assertEqual(intervals.find(10), 2000)
+        self.assertEqual(intervals.find(11), 3001)
+        self.assertEqual(intervals.find(12, align=8), 3008)
+        self.assertEqual(intervals.find(20, align=8), 1000)
+        self.assertIsNone(intervals.find(101))
+
+    def test_take_and_free_merge(self):
+        """Test that taking splits a run and freeing merges neighbours back."""
+        intervals = FreeIntervals([(1000, 1099)])
+        intervals.take(1010, 10)
+        self.assertEqual(list(intervals), [(1000, 1009), (1020, 1099)])
+        self.assertNotIn(1015, intervals)
+        with self.assertRaises(ValueError):
+            intervals.take(1005, 10)
+        intervals.free(1010, 10)
+        self.assertEqual(list(intervals), [(1000, 1099)])
+        with self.assertRaises(ValueError):
+            intervals.free(1050, 1)
+
+    def test_from_index_excludes_ports(self):
+        """Test building runs from an index minus bound ports."""
+        index = PortIndex()
+        index.add("127.0.0.1", 5005)
+        intervals = FreeIntervals.from_index(index, "127.0.0.1", (5000, 5020), exclude=[5010, 6000])
+        self.assertEqual(list(intervals), [(5000, 5004), (5006, 5009), (5011, 5020)])
+
+
+if __name__ == '__main__':
+    unittest.main()
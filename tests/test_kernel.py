@@ -0,0 +1,72 @@
+"""Unit tests for reading the kernel socket table."""
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from portkeeper.core import PortRegistry
+from portkeeper.kernel import KernelPortTable
+
+HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+TCP = HEADER + (
+    "   0: 0100007F:1F90 00000000:0000 0A 00000000:00000000 00:00000000 00000000  1000  0 1 1\n"  # 127.0.0.1:8080 LISTEN
+    "   1: 00000000:1F91 00000000:0000 0A 00000000:00000000 00:00000000 00000000  1000  0 2 1\n"  # 0.0.0.0:8081 LISTEN
+    "   2: 0100007F:1F92 0100007F:9C40 06 00000000:00000000 00:00000000 00000000  1000  0 3 1\n"  # TIME_WAIT
+)
+TCP6 = HEADER + (
+    "   0: 00000000000000000000000001000000:1F93 00000000000000000000000000000000:0000 0A"
+    " 00000000:00000000 00:00000000 00000000  1000  0 4 1\n"  # ::1:8083 LISTEN
+)
+
+
+class TestKernelPortTable(unittest.TestCase):
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        for name, content in (("tcp", TCP), ("tcp6", TCP6), ("udp", HEADER), ("udp6", HEADER)):
+            with open(os.path.join(self.proc, name), "w") as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+
+    def test_used_ports_include_wildcard_listeners(self):
+        """Test that a host sees its own sockets plus wildcard listeners."""
+        table = KernelPortTable.load(root=self.proc)
+        self.assertEqual(table.used_ports("127.0.0.1"), {8080, 8081})
+        self.assertEqual(table.used_ports("10.0.0.5"), {8081})
+        self.assertEqual(table.used_ports("::1"), {8081, 8083})
+
+    def test_time_wait_is_ignored(self):
+        """Test that TIME_WAIT sockets do not mark a port as used."""
+        table = KernelPortTable.load(root=self.proc)
+        self.assertFalse(table.is_used("127.0.0.1", 8082))
+
+    def test_free_ports(self):
+        """Test answering a free-range query in one pass."""
+        table = KernelPortTable.load(root=self.proc)
+        self.assertEqual(table.free_ports("127.0.0.1", 8079, 8082), [8079, 8082])
+
+    def test_missing_table(self):
+        """Test that load returns None when no table can be read."""
+        self.assertIsNone(KernelPortTable.load(root=os.path.join(self.proc, "missing")))
+
+    @unittest.skipUnless(os.path.exists("/proc/net/tcp"), "requires /proc/net")
+    def test_reserve_skips_listening_port(self):
+        """Test that reserve skips a port the kernel reports as listening."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+        registry = PortRegistry(registry_path=os.path.join(self.proc, "registry.json"))
+        try:
+            self.assertIn(port, registry._kernel_used_ports("127.0.0.1"))
+            reservation = registry.reserve(port_range=(port, port + 10))
+            self.assertNotEqual(reservation.port, port)
+        finally:
+            listener.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
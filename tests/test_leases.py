@@ -0,0 +1,98 @@
+"""Tests for reservation leases, heartbeat renewal and garbage collection."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from portkeeper.core import PortRegistry, PortKeeperError
+from portkeeper.leases import is_dead, pid_alive
+
+
+class TestLeases(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry_file = os.path.join(self.temp_dir, ".port_registry.json")
+        self.registry = PortRegistry(self.registry_file, os.path.join(self.temp_dir, ".port_registry.lock"))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _entries(self):
+        with open(self.registry_file) as f:
+            return json.load(f)
+
+    def _set(self, key, **fields):
+        data = self._entries()
+        data[key].update(fields)
+        with open(self.registry_file, 'w') as f:
+            json.dump(data, f)
+
+    def test_lease_fields_recorded(self):
+        """Test that a leased reservation records its ttl, expiry and pid."""
+        reservation = self.registry.reserve(port_range=(5000, 5100), ttl=30)
+        entry = self._entries()[f"127.0.0.1:{reservation.port}"]
+        self.assertEqual(entry["ttl"], 30)
+        self.assertEqual(entry["pid"], os.getpid())
+        self.assertAlmostEqual(entry["expires"], reservation.expires)
+        with self.assertRaises(PortKeeperError):
+            self.registry.reserve(port_range=(5000, 5100), ttl=0)
+
+    def test_gc_removes_expired_leases_only(self):
+        """Test that gc drops expired leases in one pass and keeps plain reservations."""
+        plain = self.registry.reserve(port_range=(5000, 5100))
+        leases = self.registry.reserve(port_range=(5000, 5100), ttl=30, count=3)
+        self._set(f"127.0.0.1:{leases[0].port}", expires=time.time() - 1)
+        self._set(f"127.0.0.1:{leases[1].port}", expires=time.time() - 1)
+        removed = self.registry.gc()
+        self.assertEqual(sorted(removed), sorted(f"127.0.0.1:{r.port}" for r in leases[:2]))
+        self.assertEqual(set(self._entries()), {f"127.0.0.1:{plain.port}", f"127.0.0.1:{leases[2].port}"})
+
+    def test_gc_removes_leases_of_dead_processes(self):
+        """Test that gc reclaims leases whose owning process has exited."""
+        child = subprocess.Popen([sys.executable, "-c", "pass"])
+        child.wait()
+        self.assertFalse(pid_alive(child.pid))
+        lease = self.registry.reserve(port_range=(5000, 5100), ttl=300)
+        self._set(f"127.0.0.1:{lease.port}", pid=child.pid)
+        self.assertEqual(self.registry.gc(check_pids=False), [])
+        self.assertEqual(self.registry.gc(), [f"127.0.0.1:{lease.port}"])
+
+    def test_renew_extends_lease(self):
+        """Test that renew pushes the expiry forward and does not revive collected leases."""
+        lease = self.registry.reserve(port_range=(5000, 5100), ttl=30)
+        self._set(f"127.0.0.1:{lease.port}", expires=time.time() + 1)
+        self.assertEqual(self.registry.renew([lease]), 1)
+        self.assertGreater(self._entries()[f"127.0.0.1:{lease.port}"]["expires"], time.time() + 20)
+        self._set(f"127.0.0.1:{lease.port}", expires=time.time() - 1)
+        self.registry.gc()
+        self.assertEqual(self.registry.renew([lease]), 0)
+        self.assertEqual(self._entries(), {})
+
+    def test_keep_alive_heartbeat(self):
+        """Test that the heartbeat thread renews leases until stopped."""
+        lease = self.registry.reserve(port_range=(5000, 5100), ttl=30)
+        first = lease.expires
+        keeper = self.registry.keep_alive(lease, interval=0.02)
+        deadline = time.time() + 5
+        while keeper.renewals < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        keeper.stop()
+        self.assertFalse(keeper.is_alive())
+        self.assertGreaterEqual(keeper.renewals, 2)
+        self.assertGreater(lease.expires, first)
+
+    def test_is_dead(self):
+        """Test that entries without a lease never count as dead."""
+        now = time.time()
+        self.assertFalse(is_dead({"owner": "x", "timestamp": 0}, now))
+        self.assertTrue(is_dead({"expires": now - 1}, now))
+        self.assertFalse(is_dead({"expires": now + 10, "pid": os.getpid()}, now))
+
+
+if __name__ == '__main__':
+    unittest.main()
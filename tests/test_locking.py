@@ -0,0 +1,184 @@
+"""Tests for FileLock timeouts, stale lock files, fairness and contention stats."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from portkeeper import locking
+from portkeeper.errors import PortKeeperError
+from portkeeper.locking import FileLock, LockTimeout, lock_stats, reset_lock_stats
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.lock_file = os.path.join(self.temp_dir, "registry.lock")
+        reset_lock_stats()
+
+    def tearDown(self):
+        reset_lock_stats()
+        shutil.rmtree(self.temp_dir)
+
+    @unittest.skipUnless(locking._HAS_FCNTL, "requires flock")
+    def test_timeout_raises_lock_timeout(self):
+        """Test that a contended lock gives up after its timeout with a LockTimeout naming the lock."""
+        import fcntl
+        with open(self.lock_file, "a+") as holder:
+            fcntl.flock(holder.fileno(), fcntl.LOCK_EX)  # as another process would
+            began = time.monotonic()
+            with self.assertRaises(LockTimeout) as caught:
+                with FileLock(self.lock_file, timeout=0.2, caller="waiter"):
+                    pass
+            waited = time.monotonic() - began
+        self.assertIsInstance(caught.exception, PortKeeperError)
+        self.assertIn(self.lock_file, str(caught.exception))
+        self.assertGreaterEqual(waited, 0.2)
+        self.assertLess(waited, 1.0)
+        self.assertEqual(lock_stats()["waiter"]["timeouts"], 1)
+        self.assertEqual(lock_stats()["waiter"]["acquired"], 0)
+
+    def test_stats_per_caller(self):
+        """Test that acquisitions, contention, wait and hold times are recorded per caller."""
+        with FileLock(self.lock_file, caller="a"):
+            time.sleep(0.05)
+        with FileLock(self.lock_file, shared=True, caller="b"):
+            pass
+        released = threading.Event()
+
+        def hold():
+            with FileLock(self.lock_file, caller="a"):
+                released.set()
+                time.sleep(0.1)
+        thread = threading.Thread(target=hold)
+        thread.start()
+        released.wait()
+        with FileLock(self.lock_file, caller="b"):
+            pass
+        thread.join()
+        stats = lock_stats()
+        self.assertEqual(stats["a"]["acquired"], 2)
+        self.assertGreaterEqual(stats["a"]["hold_max_seconds"], 0.05)
+        self.assertEqual(stats["b"]["acquired"], 2)
+        self.assertEqual(stats["b"]["contended"], 1)
+        self.assertGreater(stats["b"]["wait_max_seconds"], 0.01)
+
+    @unittest.skipUnless(locking._HAS_FCNTL, "requires flock")
+    def test_fair_waiter_gets_the_lock(self):
+        """Test that a fair waiter queues on the turnstile and takes the lock once it is released."""
+        import fcntl
+        acquired = []
+
+        def wait():
+            with FileLock(self.lock_file, fair=True, timeout=5, caller="fair"):
+                acquired.append(time.monotonic())
+        with open(self.lock_file, "a+") as holder:
+            fcntl.flock(holder.fileno(), fcntl.LOCK_EX)  # as another process would
+            thread = threading.Thread(target=wait)
+            thread.start()
+            time.sleep(0.1)
+            self.assertEqual(acquired, [])
+            released = time.monotonic()
+            fcntl.flock(holder.fileno(), fcntl.LOCK_UN)
+        thread.join()
+        self.assertEqual(len(acquired), 1)
+        self.assertLess(acquired[0] - released, 0.5)
+        # The turnstile is free again for the next waiter
+        with FileLock(self.lock_file + ".queue", timeout=0.1):
+            pass
+
+    def test_reentrant_within_a_thread(self):
+        """Test that a thread holding the lock re-enters it without taking the OS lock again."""
+        with FileLock(self.lock_file, caller="outer"):
+            with FileLock(self.lock_file, caller="inner"), FileLock(self.lock_file, shared=True, caller="inner"):
+                pass
+        stats = lock_stats()
+        self.assertEqual(stats["outer"]["acquired"], 1)
+        self.assertEqual(stats["inner"]["acquired"], 0)
+        self.assertEqual(stats["inner"]["reentered"], 2)
+        with FileLock(self.lock_file, shared=True):
+            with self.assertRaises(PortKeeperError):
+                with FileLock(self.lock_file):
+                    pass
+        # Fully released again: another thread can take it at once
+        def later():
+            with FileLock(self.lock_file, timeout=0.5, caller="later"):
+                pass
+        thread = threading.Thread(target=later)
+        thread.start()
+        thread.join()
+        self.assertEqual(lock_stats()["later"]["contended"], 0)
+
+    def test_relative_path_survives_chdir(self):
+        """Test that a lock taken through a relative path is released even if the working directory changes."""
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self.temp_dir)
+        lock = FileLock("registry.lock", timeout=1)
+        with lock:
+            os.chdir(cwd)
+        self.assertIsNone(locking._process_lock(self.lock_file).owner)
+        acquired = []
+
+        def take():
+            with FileLock(self.lock_file, timeout=1):
+                acquired.append(True)
+        thread = threading.Thread(target=take)
+        thread.start()
+        thread.join()
+        self.assertEqual(acquired, [True])
+
+    def test_threads_take_turns(self):
+        """Test that threads of one process never hold the lock at the same time."""
+        inside, overlaps = [], []
+
+        def work():
+            for _ in range(20):
+                with FileLock(self.lock_file):
+                    inside.append(1)
+                    if len(inside) > 1:
+                        overlaps.append(1)
+                    time.sleep(0.0005)
+                    inside.pop()
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [])
+
+    def test_lockfile_fallback_breaks_stale_locks(self):
+        """Test that without flock a lock file left by a dead process is broken, and a live holder's is not."""
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        lck = self.lock_file + ".lck"
+        with mock.patch.object(locking, "_HAS_FCNTL", False), mock.patch.object(locking, "_HAS_MSVCRT", False):
+            with open(lck, "w") as f:
+                f.write(f"{dead.pid} {locking._HOSTNAME}\n")
+            with FileLock(self.lock_file, timeout=1):
+                with open(lck) as f:
+                    self.assertEqual(f.read().split()[0], str(os.getpid()))
+            self.assertFalse(os.path.exists(lck))
+
+            with open(lck, "w") as f:
+                f.write(f"{os.getpid()} {locking._HOSTNAME}\n")
+            with self.assertRaises(LockTimeout) as caught:
+                with FileLock(self.lock_file, timeout=0.2):
+                    pass
+            self.assertIn(f"held by {os.getpid()}", str(caught.exception))
+
+            with open(lck, "w") as f:
+                f.write("4242 some-other-host\n")
+            old = time.time() - 120
+            os.utime(lck, (old, old))
+            with FileLock(self.lock_file, timeout=1, stale_after=60):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
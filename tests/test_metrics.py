@@ -0,0 +1,131 @@
+"""Tests for the opt-in metrics and their Prometheus export."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from portkeeper import metrics
+from portkeeper.cache import ScanCache
+from portkeeper.core import PortRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.was_enabled = metrics.enabled
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        if not self.was_enabled:
+            metrics.disable()
+        metrics.reset()
+        shutil.rmtree(self.temp_dir)
+
+    def test_disabled_records_nothing(self):
+        """Test that nothing is recorded, and hooks are not called, while metrics are disabled."""
+        calls = []
+
+        def hook(*sample):
+            calls.append(sample)
+        metrics.add_hook(hook)
+        self.addCleanup(metrics.remove_hook, hook)
+        metrics.disable()
+        metrics.inc('portkeeper_bind_failures_total')
+        metrics.observe('portkeeper_reserve_seconds', 0.01, path='local')
+        with metrics.timed('portkeeper_release_seconds'):
+            pass
+        self.assertEqual(metrics.snapshot(), {'counters': {}, 'histograms': {}})
+        self.assertEqual(metrics.render(), '')
+        self.assertEqual(calls, [])
+
+    def test_render_prometheus_text(self):
+        """Test that counters and histograms render as cumulative Prometheus series with escaped labels."""
+        metrics.inc('portkeeper_scan_connects_total', 3, state='open')
+        metrics.observe('portkeeper_reserve_probes', 1)
+        metrics.observe('portkeeper_reserve_probes', 3)
+        metrics.observe('portkeeper_reserve_probes', 5000)
+        metrics.inc('portkeeper_bind_failures_total', host='a"b')
+        text = metrics.render()
+        self.assertIn('# TYPE portkeeper_scan_connects_total counter', text)
+        self.assertIn('portkeeper_scan_connects_total{state="open"} 3', text)
+        self.assertIn('portkeeper_bind_failures_total{host="a\\"b"} 1', text)
+        self.assertIn('# TYPE portkeeper_reserve_probes histogram', text)
+        self.assertIn('portkeeper_reserve_probes_bucket{le="1"} 1', text)
+        self.assertIn('portkeeper_reserve_probes_bucket{le="2"} 1', text)
+        self.assertIn('portkeeper_reserve_probes_bucket{le="4"} 2', text)
+        self.assertIn('portkeeper_reserve_probes_bucket{le="1024"} 2', text)
+        self.assertIn('portkeeper_reserve_probes_bucket{le="+Inf"} 3', text)
+        self.assertIn('portkeeper_reserve_probes_sum 5004', text)
+        self.assertIn('portkeeper_reserve_probes_count 3', text)
+        gauges = metrics.render({}, {'portkeeper_reservations': {'host="127.0.0.1"': 2}})
+        self.assertIn('# TYPE portkeeper_reservations gauge', gauges)
+        self.assertIn('portkeeper_reservations{host="127.0.0.1"} 2', gauges)
+
+    def test_hooks_see_every_sample(self):
+        """Test that hooks receive each recorded sample with its kind and labels."""
+        calls = []
+
+        def hook(kind, name, value, labels):
+            calls.append((kind, name, value, labels))
+        metrics.add_hook(hook)
+        self.addCleanup(metrics.remove_hook, hook)
+        metrics.inc('portkeeper_pool_requests_total', result='hit')
+        metrics.observe('portkeeper_release_seconds', 0.5)
+        self.assertEqual(calls, [('counter', 'portkeeper_pool_requests_total', 1, {'result': 'hit'}),
+                                 ('histogram', 'portkeeper_release_seconds', 0.5, {})])
+
+    def test_save_merges_processes(self):
+        """Test that saving adds this process's samples to the file and starts counting afresh."""
+        path = os.path.join(self.temp_dir, 'metrics.json')
+        metrics.inc('portkeeper_bind_failures_total', 2)
+        metrics.observe('portkeeper_release_seconds', 0.001)
+        metrics.save(path)
+        self.assertNotIn('portkeeper_bind_failures_total', metrics.snapshot()['counters'])
+        metrics.inc('portkeeper_bind_failures_total', 3)
+        metrics.observe('portkeeper_release_seconds', 0.002)
+        metrics.save(path)
+        data = metrics.load(path)
+        self.assertEqual(data['counters']['portkeeper_bind_failures_total'][''], 5)
+        histogram = data['histograms']['portkeeper_release_seconds']['']
+        self.assertEqual(sum(histogram['counts']), 2)
+        self.assertAlmostEqual(histogram['sum'], 0.003)
+
+    def test_reserve_is_instrumented(self):
+        """Test that a reservation records its latency, probes, lock waits and registry I/O."""
+        registry = PortRegistry(os.path.join(self.temp_dir, 'registry.json'),
+                                os.path.join(self.temp_dir, 'registry.lock'), daemon=False)
+        metrics.reset()
+        reservation = registry.reserve(port_range=(20000, 20100))
+        registry.release(reservation)
+        data = metrics.snapshot()
+        histograms, counters = data['histograms'], data['counters']
+        self.assertEqual(sum(histograms['portkeeper_reserve_seconds']['path="local"']['counts']), 1)
+        self.assertEqual(sum(histograms['portkeeper_release_seconds']['']['counts']), 1)
+        self.assertGreaterEqual(histograms['portkeeper_reserve_probes']['']['sum'], 1)
+        self.assertIn('caller="json.commit",mode="exclusive"', histograms['portkeeper_lock_wait_seconds'])
+        self.assertIn('backend="json"', histograms['portkeeper_registry_read_seconds'])
+        self.assertIn('backend="json"', histograms['portkeeper_fsync_seconds'])
+        self.assertGreater(counters['portkeeper_registry_write_bytes_total']['backend="json"'], 0)
+
+    def test_reservation_gauge_escapes_host(self):
+        """Test that the CLI's per-host reservation gauge escapes quotes and backslashes in host labels."""
+        from portkeeper.cli import _metrics_text
+        registry = PortRegistry(os.path.join(self.temp_dir, 'registry.json'),
+                                os.path.join(self.temp_dir, 'registry.lock'), daemon=False)
+        registry._claim('odd"host\\', 5000)
+        self.assertIn('portkeeper_reservations{host="odd\\"host\\\\"} 1', _metrics_text(registry, None))
+
+    def test_scan_cache_hit_rate(self):
+        """Test that scan cache lookups are counted as hits and misses."""
+        cache = ScanCache()
+        cache.put("10.0.0.1", (8000, 8010), [8001])
+        cache.pop((8000, 8010))
+        cache.pop((8000, 8010))
+        self.assertEqual(metrics.snapshot()['counters']['portkeeper_scan_cache_requests_total'],
+                         {'result="hit"': 1, 'result="miss"': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Tests for the pre-warmed port pool."""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from portkeeper.core import PortRegistry, PortKeeperError
+from portkeeper.pool import POOL_OWNER
+
+
+class TestPortPool(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry_file = os.path.join(self.temp_dir, ".port_registry.json")
+        self.registry = PortRegistry(self.registry_file, os.path.join(self.temp_dir, ".port_registry.lock"),
+                                     daemon=False)
+        # A port range no other test uses; a long interval keeps the background thread out of the way,
+        # tests drive maintain() themselves
+        self.pool = self.registry.pool((24000, 24100), size=4, low_water=2, interval=60)
+
+    def tearDown(self):
+        self.pool.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def _entries(self):
+        with open(self.registry_file) as f:
+            return json.load(f)
+
+    def test_prefilled_as_leases(self):
+        """Test that starting a pool records its ports as pool-owned leases."""
+        self.assertEqual(len(self.pool), 4)
+        entries = self._entries()
+        self.assertEqual(len(entries), 4)
+        for entry in entries.values():
+            self.assertEqual(entry["owner"], POOL_OWNER)
+            self.assertIn("expires", entry)
+
+    def test_reserve_served_from_pool(self):
+        """Test that reserve() takes a pooled port and it is re-recorded for the new owner."""
+        reservation = self.registry.reserve(port_range=(24000, 24100), owner="svc")
+        self.assertEqual(self.pool.hits, 1)
+        self.assertIsNone(reservation.expires)
+        self.pool.maintain()
+        entry = self._entries()[f"127.0.0.1:{reservation.port}"]
+        self.assertEqual(entry["owner"], "svc")
+        self.assertNotIn("expires", entry)
+        # Other ranges, counts and leases bypass the pool
+        self.registry.reserve(port_range=(25000, 25100))
+        self.registry.reserve(port_range=(24000, 24100), count=2)
+        self.assertEqual(self.pool.hits + self.pool.misses, 1)
+
+    def test_refill_below_low_water(self):
+        """Test that the pool is topped up to its size once below the low watermark."""
+        taken = [self.pool.take() for _ in range(3)]
+        self.assertEqual(len(self.pool), 1)
+        self.pool.maintain()
+        self.assertEqual(len(self.pool), 4)
+        self.assertEqual(self.pool.refills, 2)
+        pooled = {r.port for r in self.pool._ready}
+        self.assertFalse(pooled & {r.port for r in taken})
+
+    def test_released_port_is_not_resurrected(self):
+        """Test that a port released before the pool settles it stays released."""
+        reservation = self.pool.take()
+        self.registry.release(reservation)
+        self.pool.maintain()
+        # The port may be pooled again by the refill, but never settled as a plain reservation
+        owners = {entry["owner"] for entry in self._entries().values()}
+        self.assertEqual(owners, {POOL_OWNER})
+
+    def test_handed_out_port_found_under_new_owner(self):
+        """Test that find() and status() right after a pooled reserve() show the caller as owner."""
+        reservation = self.registry.reserve(port_range=(24000, 24100), owner="svc")
+        key = f"127.0.0.1:{reservation.port}"
+        self.assertEqual(list(self.registry.find(owner="svc")), [key])
+        self.assertEqual(self.registry.status()[key]["owner"], "svc")
+
+    def test_eviction(self):
+        """Test that pooled ports bound or released by someone else are evicted."""
+        bound, released = list(self.pool._ready)[:2]
+        squatter = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(squatter.close)
+        # As the pool's own probe does, so a leftover TIME-WAIT on the port does not get in the way
+        squatter.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        squatter.bind(("127.0.0.1", bound.port))
+        squatter.listen(1)
+        self.registry.release(released)
+        self.pool.maintain()
+        self.assertEqual(self.pool.evictions, 2)
+        self.assertEqual(len(self.pool), 4)
+        ports = {r.port for r in self.pool._ready}
+        self.assertNotIn(bound.port, ports)
+        self.assertNotIn(f"127.0.0.1:{bound.port}", self._entries())
+
+    def test_hit_rate_and_stop(self):
+        """Test hit-rate metrics, and that stopping releases the unused ports."""
+        kept = [self.pool.take() for _ in range(4)]
+        self.assertIsNone(self.pool.take())
+        self.assertAlmostEqual(self.pool.stats()["hit_rate"], 0.8)
+        self.pool.stop()
+        entries = self._entries()
+        self.assertEqual(set(entries), {f"127.0.0.1:{r.port}" for r in kept})
+        self.assertTrue(all(e["owner"] == "" for e in entries.values()))
+        with self.assertRaises(PortKeeperError):
+            self.registry.pool((24000, 24100), size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests for the non-blocking connect scanner."""
+
+import socket
+import time
+import unittest
+
+from portkeeper.scanner import CLOSED, OPEN, Scanner
+
+
+def _free_block(length):
+    """Find `length` consecutive ports on 127.0.0.1 that nothing listens on."""
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    start = probe.getsockname()[1]
+    probe.close()
+    return min(start, 65535 - length)
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.start = _free_block(200)
+        self.listeners = []
+        for port in (self.start + 3, self.start + 7):
+            sock = socket.socket()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind(("127.0.0.1", port))
+            except OSError:
+                sock.close()
+                self.skipTest(f"port {port} unexpectedly busy")
+            sock.listen(16)
+            self.listeners.append(sock)
+
+    def tearDown(self):
+        for sock in self.listeners:
+            sock.close()
+
+    def test_detects_listeners(self):
+        """Test that listening ports are open and the rest are closed."""
+        results = Scanner(concurrency=64, timeout=1.0).scan(["127.0.0.1"], (self.start, self.start + 9))
+        states = results["127.0.0.1"]
+        self.assertEqual(len(states), 10)
+        self.assertEqual(states[self.start + 3], OPEN)
+        self.assertEqual(states[self.start + 7], OPEN)
+        self.assertEqual(states[self.start], CLOSED)
+
+    def test_free_ports(self):
+        """Test that free_ports excludes ports with a listener."""
+        free = Scanner(timeout=1.0).free_ports(["127.0.0.1"], (self.start, self.start + 9))["127.0.0.1"]
+        self.assertNotIn(self.start + 3, free)
+        self.assertIn(self.start + 4, free)
+
+    def test_iter_scan_streams_results(self):
+        """Test that iter_scan yields each port once and can be abandoned early."""
+        results = Scanner(timeout=1.0).iter_scan(["127.0.0.1"], (self.start, self.start + 9))
+        seen = {port: state for _, port, state in results}
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(seen[self.start + 3], OPEN)
+
+        results = Scanner(concurrency=4, timeout=1.0).iter_scan(["127.0.0.1"], (self.start, self.start + 199))
+        host, port, state = next(results)
+        self.assertEqual(host, "127.0.0.1")
+        results.close()
+        self.assertIsNone(results.gi_frame)
+
+    def test_rate_limit(self):
+        """Test that the per-host rate caps how fast connects start."""
+        began = time.monotonic()
+        Scanner(timeout=1.0, rate=100).scan(["127.0.0.1"], (self.start, self.start + 29))
+        self.assertGreater(time.monotonic() - began, 0.15)
+
+    def test_many_ports_complete_quickly(self):
+        """Test that hundreds of probes run concurrently rather than one at a time."""
+        began = time.monotonic()
+        results = Scanner(concurrency=256, timeout=0.5).scan(["127.0.0.1"], (self.start, self.start + 199))
+        self.assertEqual(len(results["127.0.0.1"]), 200)
+        self.assertLess(time.monotonic() - began, 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,412 @@
+"""Unit tests for the pluggable registry storage backends."""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from portkeeper.core import PortRegistry, PortKeeperError
+from portkeeper import storage
+from portkeeper.locking import _HAS_FCNTL, FileLock
+from portkeeper.storage import (BitmapBackend, JournalBackend, JsonBackend, ShardedBackend, SQLiteBackend,
+                                migrate)
+
+
+def _reserve_many(registry_file, lock_file, count, results):
+    registry = PortRegistry(registry_file, lock_file)
+    results.put([registry.reserve(port_range=(5000, 5999)).port for _ in range(count)])
+
+
+class TestOptimisticJsonBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry_file = os.path.join(self.temp_dir, ".port_registry.json")
+        self.lock_file = os.path.join(self.temp_dir, ".port_registry.lock")
+        self.backend = JsonBackend(self.registry_file, self.lock_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _commit_behind(self, key):
+        """Commit key from another backend, as a concurrent process would."""
+        with JsonBackend(self.registry_file, self.lock_file).transaction() as other:
+            other.put(key, {"host": "127.0.0.1", "port": int(key.rsplit(":", 1)[1]), "owner": "other"})
+
+    def test_disjoint_commits_are_merged(self):
+        """Test that a concurrent commit to other entries is merged without recomputing."""
+        calls = []
+        def update(txn):
+            calls.append(sorted(k for k, _ in txn.items()))
+            self._commit_behind("127.0.0.1:5000")
+            txn.put("127.0.0.1:5001", {"host": "127.0.0.1", "port": 5001})
+        self.backend.update(update)
+        self.assertEqual(calls, [[]])
+        self.assertEqual((self.backend.merges, self.backend.conflicts), (1, 0))
+        self.assertEqual(sorted(self.backend.read()), ["127.0.0.1:5000", "127.0.0.1:5001"])
+
+    def test_conflicting_update_is_retried(self):
+        """Test that an update racing a commit to the same entry is recomputed against the new state."""
+        calls = []
+        def update(txn):
+            calls.append(txn.get("127.0.0.1:5000"))
+            if len(calls) == 1:
+                self._commit_behind("127.0.0.1:5000")
+            if txn.get("127.0.0.1:5000") is None:
+                txn.put("127.0.0.1:5000", {"host": "127.0.0.1", "port": 5000, "owner": "me"})
+            return len(calls)
+        self.assertEqual(self.backend.update(update), 2)
+        self.assertEqual(self.backend.conflicts, 1)
+        self.assertEqual(self.backend.read()["127.0.0.1:5000"]["owner"], "other")
+        self.assertEqual([f for f in os.listdir(self.temp_dir) if f.endswith(".tmp")], [])
+
+    def test_exhausted_retries_fall_back_to_lock(self):
+        """Test that with no optimistic attempts the update runs under the exclusive lock."""
+        backend = JsonBackend(self.registry_file, self.lock_file, retries=0)
+        backend.update(lambda txn: txn.put("127.0.0.1:5000", {"host": "127.0.0.1", "port": 5000}))
+        self.assertEqual(list(backend.read()), ["127.0.0.1:5000"])
+
+    @unittest.skipUnless(_HAS_FCNTL, "requires flock")
+    def test_shared_locks_coexist(self):
+        """Test that readers share the lock while a writer is excluded."""
+        import fcntl
+        with FileLock(self.lock_file, shared=True), FileLock(self.lock_file, shared=True):
+            with open(self.lock_file, "r+") as f:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_iter_entries_streams_one_snapshot(self):
+        """Test that entries are parsed chunk by chunk from the file as it was when iteration began."""
+        entries = {f"10.0.0.{port % 3}:{port}": {"host": f"10.0.0.{port % 3}", "port": port, "owner": "ü"}
+                   for port in range(5000, 5100)}
+        self.backend.update(lambda txn: [txn.put(key, entry) for key, entry in entries.items()])
+        with mock.patch.object(storage, "DEFAULT_READ_CHUNK", 7):
+            stream = self.backend.iter_entries()
+            first = next(stream)
+            JsonBackend(self.registry_file, self.lock_file).update(lambda txn: txn.put(
+                "10.0.0.9:9999", {"host": "10.0.0.9", "port": 9999}))
+            streamed = dict([first, *stream])
+        self.assertEqual(streamed, entries)
+        self.assertEqual(dict(self.backend.iter_entries("10.0.0.1")),
+                         {key: entry for key, entry in entries.items() if key.startswith("10.0.0.1:")})
+        with open(self.registry_file, "w") as f:
+            f.write('{"10.0.0.1:5000": {"port": 5000}, "10.0.0.1:5001": {"po')
+        self.assertEqual(list(self.backend.iter_entries()), [("10.0.0.1:5000", {"port": 5000})])
+
+    def test_concurrent_processes_get_unique_ports(self):
+        """Test that optimistic commits from several processes never hand out a port twice."""
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        workers = [ctx.Process(target=_reserve_many, args=(self.registry_file, self.lock_file, 10, results))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        ports = [port for _ in workers for port in results.get(timeout=60)]
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(ports), 40)
+        self.assertEqual(len(set(ports)), 40)
+        self.assertEqual(len(self.backend.read()), 40)
+
+
+class TestSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.temp_dir, ".port_registry.db")
+        self.registry = PortRegistry(registry_path=self.db_file, backend="sqlite")
+
+    def tearDown(self):
+        self.registry.backend.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_reserve_and_release(self):
+        """Test that reservations are stored as rows and removed on release."""
+        reservation = self.registry.reserve(port_range=(5000, 5100), owner="svc")
+        key = f"127.0.0.1:{reservation.port}"
+        data = self.registry.backend.read()
+        self.assertEqual(data[key]["owner"], "svc")
+        self.registry.release(reservation)
+        self.assertNotIn(key, self.registry.backend.read())
+
+    def test_reservations_are_unique(self):
+        """Test that consecutive reservations see each other's rows."""
+        ports = [self.registry.reserve(port_range=(5000, 5100)).port for _ in range(5)]
+        self.assertEqual(len(ports), len(set(ports)))
+
+    def test_failed_batch_rolls_back(self):
+        """Test that a batch that cannot be satisfied leaves no rows behind."""
+        with self.assertRaises(PortKeeperError):
+            self.registry.reserve(port_range=(5000, 5002), count=5)
+        self.assertEqual(self.registry.backend.read(), {})
+
+    def test_iter_entries_by_host(self):
+        """Test that entries stream from a cursor, narrowed to one host in the query."""
+        self.registry.reserve(port_range=(5000, 5100), count=2)
+        self.registry._claim("10.0.0.1", 5000)
+        self.assertEqual(len(list(self.registry.backend.iter_entries())), 3)
+        self.assertEqual([key for key, _ in self.registry.backend.iter_entries("10.0.0.1")], ["10.0.0.1:5000"])
+
+    def test_find_uses_indexed_columns(self):
+        """Test that owner, pid and label are indexed columns, added to databases created before them."""
+        import sqlite3
+        self.registry.backend.close()
+        old_db = os.path.join(self.temp_dir, "old.db")
+        conn = sqlite3.connect(old_db)
+        conn.execute("CREATE TABLE reservations (host TEXT NOT NULL, port INTEGER NOT NULL, "
+                     "owner TEXT NOT NULL DEFAULT '', timestamp REAL NOT NULL DEFAULT 0, data TEXT NOT NULL, "
+                     "PRIMARY KEY (host, port)) WITHOUT ROWID")
+        conn.execute("INSERT INTO reservations VALUES ('127.0.0.1', 5000, 'svc', 0, ?)",
+                     (json.dumps({"host": "127.0.0.1", "port": 5000, "owner": "svc", "pid": 42, "label": "ci"}),))
+        conn.commit()
+        conn.close()
+        backend = SQLiteBackend(old_db)
+        self.addCleanup(backend.close)
+        self.assertEqual(list(backend.find(pid=42, label="ci")), ["127.0.0.1:5000"])
+        backend.update(lambda txn: txn.put("127.0.0.1:5001", {"host": "127.0.0.1", "port": 5001, "owner": "svc"}))
+        self.assertEqual(backend.update(lambda txn: txn.find(owner="svc")), ["127.0.0.1:5000", "127.0.0.1:5001"])
+        plan = backend._connect().execute("EXPLAIN QUERY PLAN SELECT host FROM reservations WHERE label = ?",
+                                          ("ci",)).fetchall()
+        self.assertIn("reservations_label", " ".join(str(row) for row in plan))
+
+    def test_wal_mode(self):
+        """Test that the database runs in WAL journal mode."""
+        mode = self.registry.backend._connect().execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+
+class TestJournalBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry_file = os.path.join(self.temp_dir, ".port_registry.json")
+        self.lock_file = os.path.join(self.temp_dir, ".port_registry.lock")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _backend(self, **kwargs):
+        return JournalBackend(self.registry_file, self.lock_file, **kwargs)
+
+    def test_operations_append_to_journal(self):
+        """Test that reserve and release append records instead of rewriting the snapshot."""
+        registry = PortRegistry(backend=self._backend())
+        reservation = registry.reserve(port_range=(5000, 5100))
+        registry.release(reservation)
+        with open(self.registry_file) as f:
+            self.assertEqual(json.load(f), {})
+        with open(self.registry_file + ".journal") as f:
+            ops = [json.loads(line)["op"] for line in f]
+        self.assertEqual(ops, ["reserve", "release"])
+
+    def test_state_is_replayed_by_other_instances(self):
+        """Test that a second backend sees entries by replaying the journal."""
+        registry = PortRegistry(backend=self._backend())
+        reservations = registry.reserve(port_range=(5000, 5100), count=3)
+        other = self._backend()
+        self.assertEqual(len(other.read()), 3)
+        registry.release(reservations[0])
+        self.assertEqual(len(other.read()), 2)
+
+    def test_find_follows_other_instances(self):
+        """Test that the owner/label index is kept up to date with records replayed from the journal."""
+        backend, other = self._backend(), self._backend()
+        backend.update(lambda txn: txn.put("127.0.0.1:5000", {"host": "127.0.0.1", "port": 5000,
+                                                               "owner": "a", "label": "x"}))
+        self.assertEqual(list(other.find(label="x")), ["127.0.0.1:5000"])
+        backend.update(lambda txn: txn.put("127.0.0.1:5000", {"host": "127.0.0.1", "port": 5000,
+                                                               "owner": "b", "label": "x"}))
+        self.assertEqual(other.find(owner="a"), {})
+        self.assertEqual(other.update(lambda txn: txn.find(owner="b", label="x")), ["127.0.0.1:5000"])
+        other.update(lambda txn: txn.delete("127.0.0.1:5000"))
+        self.assertEqual(backend.find(label="x"), {})
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        """Test that passing the threshold checkpoints the journal into the snapshot."""
+        backend = self._backend(compact_threshold=1, background=False)
+        registry = PortRegistry(backend=backend)
+        reservation = registry.reserve(port_range=(5000, 5100))
+        self.assertEqual(backend.journal_size(), 0)
+        with open(self.registry_file) as f:
+            self.assertIn(f"127.0.0.1:{reservation.port}", json.load(f))
+        self.assertEqual(len(self._backend().read()), 1)
+
+    def test_torn_record_is_discarded(self):
+        """Test that a half-written trailing record is ignored and repaired."""
+        backend = self._backend()
+        with backend.transaction() as txn:
+            txn.put("127.0.0.1:5000", {"host": "127.0.0.1", "port": 5000})
+        with open(self.registry_file + ".journal", "a") as f:
+            f.write('{"op":"reserve","key":"127.0.0.1:5001"')
+        backend = self._backend()
+        self.assertEqual(list(backend.read()), ["127.0.0.1:5000"])
+        with backend.transaction() as txn:
+            txn.put("127.0.0.1:5002", {"host": "127.0.0.1", "port": 5002})
+        self.assertEqual(sorted(self._backend().read()), ["127.0.0.1:5000", "127.0.0.1:5002"])
+
+
+class TestShardedBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.shard_dir = os.path.join(self.temp_dir, ".port_registry.json.d")
+        self.registry = PortRegistry(os.path.join(self.temp_dir, ".port_registry.json"), backend="sharded")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_one_shard_per_host_and_block(self):
+        """Test that reservations land in per-host, per-1024-port shard files."""
+        self.registry.reserve(port_range=(5000, 5100), count=2)
+        self.registry.reserve(port_range=(9000, 9100))
+        self.registry._claim("::1", 5000)
+        shards = sorted(f for f in os.listdir(self.shard_dir) if f.endswith(".json"))
+        self.assertEqual(shards, ["127.0.0.1@4.json", "127.0.0.1@8.json", "__1@4.json"])
+        with open(os.path.join(self.shard_dir, "127.0.0.1@4.json")) as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+    def test_status_and_release_aggregate_shards(self):
+        """Test that status sees every shard and release finds the right one."""
+        low = self.registry.reserve(port_range=(5000, 5100))
+        high = self.registry.reserve(port_range=(20000, 20100))
+        self.assertEqual(sorted(self.registry.status()),
+                         sorted([f"127.0.0.1:{low.port}", f"127.0.0.1:{high.port}"]))
+        self.registry.release(high)
+        self.assertEqual(list(self.registry.status()), [f"127.0.0.1:{low.port}"])
+
+    def test_iter_entries_reads_only_the_hosts_shards(self):
+        """Test that iterating one host's entries opens only that host's shards."""
+        self.registry.reserve(port_range=(5000, 5100))
+        self.registry._claim("::1", 5000)
+        opened = []
+        real = storage.JsonBackend.iter_entries
+
+        def spy(shard, host=None):
+            opened.append(shard.path.name)
+            return real(shard, host)
+        with mock.patch.object(storage.JsonBackend, "iter_entries", spy):
+            self.assertEqual([key for key, _ in self.registry.backend.iter_entries("::1")], ["::1:5000"])
+        self.assertEqual(opened, ["__1@4.json"])
+
+    @unittest.skipUnless(_HAS_FCNTL, "requires flock")
+    def test_other_shards_are_not_blocked(self):
+        """Test that a held shard lock does not block allocations in another block."""
+        import fcntl
+        first = self.registry.reserve(port_range=(5000, 5100))
+        with open(os.path.join(self.shard_dir, "127.0.0.1@4.lock"), "r+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            reservation = self.registry.reserve(port_range=(20000, 20100))
+        self.assertTrue(20000 <= reservation.port <= 20100)
+        self.assertNotEqual(first.port, reservation.port)
+
+    def test_conflict_on_same_entry_is_retried(self):
+        """Test that a concurrent commit of the same port makes the update start over."""
+        backend = self.registry.backend
+        attempts = []
+        def update(txn):
+            attempts.append(1)
+            port = next(txn.index.iter_free("127.0.0.1", 5000, 5100))
+            if len(attempts) == 1:
+                ShardedBackend(self.shard_dir).update(
+                    lambda other: other.put(f"127.0.0.1:{port}", {"host": "127.0.0.1", "port": port}))
+            txn.put(f"127.0.0.1:{port}", {"host": "127.0.0.1", "port": port, "owner": "me"})
+            return port
+        port = backend.update(update)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(backend.conflicts, 1)
+        self.assertEqual(len(backend.read()), 2)
+        self.assertEqual(backend.read()[f"127.0.0.1:{port}"]["owner"], "me")
+
+    def test_migrate_json_to_sharded(self):
+        """Test that a JSON registry can be split into shards."""
+        json_path = os.path.join(self.temp_dir, "registry.json")
+        entries = {f"127.0.0.1:{port}": {"host": "127.0.0.1", "port": port} for port in (5000, 7000, 9000)}
+        with open(json_path, "w") as f:
+            json.dump(entries, f)
+        source = JsonBackend(json_path, os.path.join(self.temp_dir, "registry.lock"))
+        self.assertEqual(migrate(source, self.registry.backend), 3)
+        self.assertEqual(self.registry.status(), entries)
+
+
+class TestBitmapBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, ".port_registry.bmp")
+        self.lock = os.path.join(self.temp_dir, ".port_registry.lock")
+        self.registry = PortRegistry(self.path, self.lock, backend="bitmap")
+
+    def tearDown(self):
+        self.registry.backend.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_reserve_release_and_metadata(self):
+        """Test that reservations set bits and keep their metadata in the side log."""
+        reservation = self.registry.reserve(port_range=(5000, 5100), owner="svc", ttl=30)
+        backend = self.registry.backend
+        self.assertTrue(backend.is_reserved("127.0.0.1", reservation.port))
+        entry = self.registry.status()[f"127.0.0.1:{reservation.port}"]
+        self.assertEqual(entry["owner"], "svc")
+        self.assertEqual(entry["pid"], os.getpid())
+        self.registry.release(reservation)
+        self.assertFalse(backend.is_reserved("127.0.0.1", reservation.port))
+        self.assertEqual(self.registry.status(), {})
+        self.assertEqual(os.path.getsize(self.path), 2 * 8192)
+
+    def test_other_instances_see_updates(self):
+        """Test that another instance sees commits through the mapping, new hosts included."""
+        other = BitmapBackend(self.path, self.lock)
+        self.addCleanup(other.close)
+        generation = other.generation()
+        self.registry.reserve(port_range=(5000, 5100))
+        reservation = self.registry.reserve(port_range=(6000, 6100), host="::1")
+        self.assertTrue(other.is_reserved("::1", reservation.port))
+        self.assertGreater(other.generation(), generation)
+        self.assertEqual(len(other.read()), 2)
+
+    def test_rebuild_after_interrupted_commit(self):
+        """Test that a commit left half-done is repaired from the metadata log."""
+        reservation = self.registry.reserve(port_range=(5000, 5100))
+        backend = self.registry.backend
+        # Simulate a writer that died after logging but before updating the bitmap
+        backend._map[8192:16384] = bytes(8192)
+        backend._set_header(dirty=1)
+        self.assertFalse(backend.is_reserved("127.0.0.1", reservation.port))
+        self.registry.reserve(port_range=(5000, 5100))
+        self.assertTrue(backend.is_reserved("127.0.0.1", reservation.port))
+
+    def test_compaction(self):
+        """Test that the metadata log is rewritten once it is mostly superseded records."""
+        backend = BitmapBackend(os.path.join(self.temp_dir, "small.bmp"), self.lock, compact_threshold=2048)
+        self.addCleanup(backend.close)
+        registry = PortRegistry(backend=backend, daemon=False)
+        kept = registry.reserve(port_range=(5000, 5100))
+        for _ in range(30):
+            registry.release(registry.reserve(port_range=(5000, 5100)))
+        self.assertLess(os.path.getsize(backend.meta_path), 2048)
+        self.assertEqual(list(BitmapBackend(backend.path, self.lock).read()), [f"127.0.0.1:{kept.port}"])
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_migrate_json_to_sqlite(self):
+        """Test that every JSON entry is copied into the SQLite backend."""
+        json_path = os.path.join(self.temp_dir, "registry.json")
+        entries = {
+            "127.0.0.1:5000": {"host": "127.0.0.1", "port": 5000, "owner": "a", "timestamp": 1.0},
+            "::1:5001": {"host": "::1", "port": 5001, "owner": "b", "timestamp": 2.0},
+        }
+        with open(json_path, "w") as f:
+            json.dump(entries, f)
+        source = JsonBackend(json_path, os.path.join(self.temp_dir, "registry.lock"))
+        target = SQLiteBackend(os.path.join(self.temp_dir, "registry.db"))
+        self.assertEqual(migrate(source, target), 2)
+        self.assertEqual(target.read(), entries)
+        target.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Tests for pluggable allocation strategies."""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from portkeeper.core import PortRegistry, PortKeeperError
+from portkeeper.index import PortIndex
+from portkeeper.strategies import FirstFit, HashedFit, NextFit, RandomFit, get_strategy
+
+
+class TestStrategies(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.registry_file = os.path.join(self.temp_dir, ".port_registry.json")
+        self.lock_file = os.path.join(self.temp_dir, ".port_registry.lock")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _registry(self, strategy):
+        return PortRegistry(self.registry_file, self.lock_file, strategy=strategy)
+
+    def test_first_fit_takes_lowest(self):
+        """Test that first-fit yields free ports in ascending order."""
+        index = PortIndex()
+        index.add("127.0.0.1", 5000)
+        candidates = FirstFit().candidates(index, "127.0.0.1", (5000, 5005))
+        self.assertEqual(list(candidates), [5001, 5002, 5003, 5004, 5005])
+
+    def test_next_fit_cursor_is_persisted(self):
+        """Test that next-fit continues after the last allocation, across registry instances."""
+        first = self._registry("next-fit").reserve(port_range=(5000, 5100))
+        second = self._registry("next-fit").reserve(port_range=(5000, 5100))
+        self.assertGreater(second.port, first.port)
+        self.assertTrue(os.path.exists(self.registry_file + ".cursor"))
+        registry = self._registry("next-fit")
+        registry.release(first)
+        self.assertGreater(registry.reserve(port_range=(5000, 5100)).port, second.port,
+                           "Released low ports should not be reused before the cursor wraps")
+
+    def test_next_fit_cursor_written_once_per_batch(self):
+        """Test that a multi-port reservation moves the next-fit cursor once, past its last port."""
+        registry = self._registry("next-fit")
+        with mock.patch.object(registry.strategy, "allocated", wraps=registry.strategy.allocated) as allocated:
+            ports = [r.port for r in registry.reserve(port_range=(5000, 5100), count=3)]
+        allocated.assert_called_once_with("127.0.0.1", (5000, 5100), ports[-1])
+        self.assertEqual(registry.strategy.cursor("127.0.0.1", (5000, 5100)), ports[-1] + 1)
+
+    def test_next_fit_wraps_around(self):
+        """Test that next-fit wraps to the start of the range once it reaches the end."""
+        strategy = NextFit()
+        strategy.allocated("127.0.0.1", (5000, 5003), 5003)
+        self.assertEqual(list(strategy.candidates(PortIndex(), "127.0.0.1", (5000, 5003))), [5000, 5001, 5002, 5003])
+        strategy.allocated("127.0.0.1", (5000, 5003), 5001)
+        self.assertEqual(list(strategy.candidates(PortIndex(), "127.0.0.1", (5000, 5003))), [5002, 5003, 5000, 5001])
+
+    def test_random_is_complete(self):
+        """Test that random allocation still finds every free port of a nearly full range."""
+        strategy = RandomFit(retries=4, rng=random.Random(7))
+        index = PortIndex()
+        for port in range(5000, 5010):
+            if port != 5006:
+                index.add("127.0.0.1", port)
+        self.assertEqual(list(strategy.candidates(index, "127.0.0.1", (5000, 5009))), [5006])
+        ports = self._registry(strategy).reserve(port_range=(5000, 5004), count=5)
+        self.assertEqual(sorted(r.port for r in ports), list(range(5000, 5005)))
+
+    def test_hashed_is_stable_per_owner(self):
+        """Test that the same owner is steered to the same port again."""
+        registry = self._registry("hashed")
+        reservation = registry.reserve(port_range=(5000, 5999), owner="svc-a")
+        registry.release(reservation)
+        self.assertEqual(registry.reserve(port_range=(5000, 5999), owner="svc-a").port, reservation.port)
+        first = next(HashedFit().candidates(PortIndex(), "127.0.0.1", (5000, 5999), "svc-b"))
+        self.assertTrue(5000 <= first <= 5999)
+
+    def test_per_call_strategy_and_unknown_name(self):
+        """Test that reserve accepts a strategy override and rejects unknown names."""
+        registry = self._registry(None)
+        self.assertEqual(registry.strategy.name, "first-fit")
+        self.assertTrue(5000 <= registry.reserve(port_range=(5000, 5100), strategy="random").port <= 5100)
+        with self.assertRaises(PortKeeperError):
+            get_strategy("best-fit")
+
+
+if __name__ == '__main__':
+    unittest.main()
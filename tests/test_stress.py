@@ -0,0 +1,51 @@
+"""Tests for the multi-process stress harness."""
+
+import multiprocessing
+import os
+import unittest
+
+from portkeeper.stress import DuplicateAllocation, StressReport, _collect, _Ledger, run_stress
+
+
+class TestStress(unittest.TestCase):
+    def test_no_duplicates_under_load(self):
+        """Test that concurrent processes and threads never share a live reservation."""
+        report = run_stress('json', processes=3, threads=2, ops=15, port_range=(30000, 30063))
+        report.check()
+        self.assertEqual(report.operations, 3 * 2 * 15 * 2)
+        self.assertEqual(report.errors, 0)
+        self.assertGreater(report.ops_per_second, 0)
+        self.assertGreater(report.lock_wait_ms, 0)
+
+    def test_ledger_detects_overlap(self):
+        """Test that the ledger reports a port entered twice before being left."""
+        ledger = _Ledger(multiprocessing.get_context('spawn'), (30000, 30010))
+        self.assertIsNone(ledger.enter(30005, 1))
+        self.assertEqual(ledger.enter(30005, 2), 1)
+        ledger.leave(30005)
+        self.assertIsNone(ledger.enter(30005, 2))
+        report = StressReport('json', 1, 1, duplicates=[{'host': '127.0.0.1', 'port': 30005, 'workers': [1, 2]}])
+        self.assertFalse(report.ok)
+        with self.assertRaises(DuplicateAllocation):
+            report.check()
+
+    def test_worker_setup_failure_is_reported(self):
+        """Test that a worker failing before its run reports the error instead of leaving the parent waiting."""
+        report = run_stress('json', processes=1, threads=1, ops=1, port_range=(30000, 30063), strategy='bogus')
+        self.assertFalse(report.ok)
+        self.assertIn("Unknown allocation strategy", report.failures[0])
+
+    def test_worker_dying_without_report_is_a_failure(self):
+        """Test that collecting results stops with a failure when a worker process exits without reporting."""
+        ctx = multiprocessing.get_context('spawn')
+        results, stop = ctx.Queue(), ctx.Event()
+        worker = ctx.Process(target=os._exit, args=(3,))
+        worker.start()
+        worker.join()
+        collected = _collect([worker], results, stop)
+        self.assertEqual(collected[-1]['failures'], ["process 0 exited with code 3 without reporting"])
+        self.assertTrue(stop.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()